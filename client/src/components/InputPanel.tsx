@@ -98,7 +98,10 @@ export function InputPanel() {
           }
         };
         eventSource.onerror = () => {
-          eventSource.close();
+          // 浏览器会自动重连并补发断线期间的事件
+          if (eventSource.readyState === EventSource.CLOSED) {
+            eventSource.close();
+          }
         };
         
         setShowIncompleteTasks(false);
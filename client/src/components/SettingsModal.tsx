@@ -9,13 +9,14 @@ interface Props {
 }
 
 export function SettingsModal({ isOpen, onClose }: Props) {
-  const { apiKey, baseUrl, defaultModel, useStream, language, save, load, isLoading } = useSettingsStore();
+  const { apiKey, baseUrl, defaultModel, useStream, language, repairModel, save, load, isLoading } = useSettingsStore();
   const tr = (key: Parameters<typeof t>[0]) => t(key, language);
   
   const [localApiKey, setLocalApiKey] = useState(apiKey);
   const [localBaseUrl, setLocalBaseUrl] = useState(baseUrl);
   const [localModel, setLocalModel] = useState(defaultModel);
   const [localUseStream, setLocalUseStream] = useState(useStream);
+  const [localRepairModel, setLocalRepairModel] = useState(repairModel ?? '');
   const [showKey, setShowKey] = useState(false);
   const [saving, setSaving] = useState(false);
   const [saveStatus, setSaveStatus] = useState<'idle' | 'success' | 'error'>('idle');
@@ -31,7 +32,8 @@ export function SettingsModal({ isOpen, onClose }: Props) {
     setLocalBaseUrl(baseUrl);
     setLocalModel(defaultModel);
     setLocalUseStream(useStream);
-  }, [apiKey, baseUrl, defaultModel, useStream]);
+    setLocalRepairModel(repairModel ?? '');
+  }, [apiKey, baseUrl, defaultModel, useStream, repairModel]);
 
   if (!isOpen) return null;
 
@@ -43,7 +45,8 @@ export function SettingsModal({ isOpen, onClose }: Props) {
       apiKey: localApiKey,
       baseUrl: localBaseUrl,
       defaultModel: localModel,
-      useStream: localUseStream
+      useStream: localUseStream,
+      repairModel: localRepairModel
     });
     
     setSaving(false);
@@ -201,6 +204,21 @@ export function SettingsModal({ isOpen, onClose }: Props) {
                 />
               </div>
 
+              {/* Repair Model */}
+              <div>
+                <label style={labelStyle}>
+                  <Bot size={14} />
+                  {tr('repairModel')}
+                </label>
+                <input
+                  type="text"
+                  value={localRepairModel}
+                  onChange={(e) => setLocalRepairModel(e.target.value)}
+                  placeholder={tr('repairModelPlaceholder')}
+                  style={inputStyle}
+                />
+              </div>
+
               {/* Stream Mode */}
               <div>
                 <label style={labelStyle}>
@@ -29,6 +29,8 @@ export const translations = {
     apiKeyPlaceholder: '输入你的 API Key',
     baseUrl: 'Base URL',
     defaultModel: '默认模型',
+    repairModel: 'JSON 修复模型',
+    repairModelPlaceholder: '可选，留空则使用默认模型',
     useStream: '流式输出',
     language: '语言',
     save: '保存',
@@ -102,6 +104,8 @@ export const translations = {
     apiKeyPlaceholder: 'Enter your API Key',
     baseUrl: 'Base URL',
     defaultModel: 'Default Model',
+    repairModel: 'JSON Repair Model',
+    repairModelPlaceholder: 'Optional, uses the default model when empty',
     useStream: 'Stream Output',
     language: 'Language',
     save: 'Save',
@@ -23,7 +23,7 @@ export async function startPipeline(params: StartPipelineParams): Promise<{ task
 }
 
 export function subscribePipelineEvents(taskId: string): EventSource {
-  return new EventSource(`${API_BASE}/pipeline/stream?taskId=${taskId}`);
+  return new EventSource(`${API_BASE}/pipeline/stream?taskId=${taskId}&compact=1`);
 }
 
 export async function pausePipeline(taskId: string): Promise<void> {
@@ -101,15 +101,90 @@ export async function saveSettings(settings: Settings): Promise<void> {
 
 // ==================== Suites API ====================
 
-export async function getSuites(): Promise<SuiteListItem[]> {
-  const response = await fetch(`${API_BASE}/suites`);
+export interface SuiteQuery {
+  sort?: 'savedAt' | 'name' | 'systemName' | 'score' | 'rolesCount';
+  order?: 'asc' | 'desc';
+  q?: string;
+  minScore?: number;
+  limit?: number;
+  offset?: number;
+}
+
+export async function getSuites(query: SuiteQuery = {}): Promise<SuiteListItem[]> {
+  const params = new URLSearchParams();
+  Object.entries(query).forEach(([key, value]) => {
+    if (value !== undefined && value !== '') params.set(key, String(value));
+  });
+  const qs = params.toString();
+  const response = await fetch(`${API_BASE}/suites${qs ? `?${qs}` : ''}`);
+  const result = await response.json();
+  if (!result.success) throw new Error(result.error);
+  return result.data;
+}
+
+export interface SuiteSearchHit extends SuiteListItem {
+  rank: number;
+  highlights: { field: 'systemName' | 'description' | 'roleName' | 'prompt'; role?: string; snippet: string }[];
+}
+
+export async function searchSuites(q: string, limit = 20, offset = 0): Promise<{ hits: SuiteSearchHit[]; total: number }> {
+  const params = new URLSearchParams({ q, limit: String(limit), offset: String(offset) });
+  const response = await fetch(`${API_BASE}/suites/search?${params}`);
+  const result = await response.json();
+  if (!result.success) throw new Error(result.error);
+  return { hits: result.data, total: result.total };
+}
+
+/** Suite data; `fields` limits it to dotted paths such as `promptSuite.prompts.role_name`. */
+export async function getSuiteDetail(name: string, fields?: string[]): Promise<any> {
+  const query = fields?.length ? `?${new URLSearchParams({ fields: fields.join(',') })}` : '';
+  const response = await fetch(`${API_BASE}/suites/${encodeURIComponent(name)}${query}`);
   const result = await response.json();
   if (!result.success) throw new Error(result.error);
   return result.data;
 }
 
-export async function getSuiteDetail(name: string): Promise<any> {
-  const response = await fetch(`${API_BASE}/suites/${encodeURIComponent(name)}`);
+export interface SuiteRole {
+  index: number;
+  role_id?: string;
+  role_name?: string;
+  role_type?: string;
+  description?: string;
+  prompt?: string;
+  [key: string]: any;
+}
+
+/** Roles of a suite without their prompt texts. */
+export async function getSuiteRoles(name: string): Promise<SuiteRole[]> {
+  const response = await fetch(`${API_BASE}/suites/${encodeURIComponent(name)}/roles`);
+  const result = await response.json();
+  if (!result.success) throw new Error(result.error);
+  return result.data;
+}
+
+/** One role with its prompt, by role_id, role_name or index. */
+export async function getSuiteRole(name: string, role: string | number): Promise<SuiteRole> {
+  const response = await fetch(
+    `${API_BASE}/suites/${encodeURIComponent(name)}/roles/${encodeURIComponent(String(role))}`
+  );
+  const result = await response.json();
+  if (!result.success) throw new Error(result.error);
+  return result.data;
+}
+
+/** Download URL of a ZIP with the given suites (all suites if `names` is empty). */
+export function suitesExportUrl(names: string[] = []): string {
+  if (names.length === 1) return `${API_BASE}/suites/${encodeURIComponent(names[0])}/export.zip`;
+  const params = new URLSearchParams(names.length ? names.map(n => ['name', n]) : [['all', '1']]);
+  return `${API_BASE}/suites/export.zip?${params}`;
+}
+
+export async function importSuites(file: Blob): Promise<{ name: string; folder: string; files: number }[]> {
+  const response = await fetch(`${API_BASE}/suites/import`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/zip' },
+    body: file,
+  });
   const result = await response.json();
   if (!result.success) throw new Error(result.error);
   return result.data;
@@ -138,10 +213,21 @@ export async function saveSuite(params: SaveSuiteParams): Promise<{ folder: stri
 // ==================== History API ====================
 
 export async function getHistory(): Promise<HistoryRecord[]> {
-  const response = await fetch(`${API_BASE}/history`);
+  return (await getHistoryPage()).records;
+}
+
+export async function getHistoryPage(
+  cursor?: string | null,
+  limit?: number
+): Promise<{ records: HistoryRecord[]; nextCursor: string | null }> {
+  const params = new URLSearchParams();
+  if (cursor) params.set('cursor', cursor);
+  if (limit) params.set('limit', String(limit));
+  const qs = params.toString();
+  const response = await fetch(`${API_BASE}/history${qs ? `?${qs}` : ''}`);
   const result = await response.json();
   if (!result.success) throw new Error(result.error);
-  return result.data;
+  return { records: result.data, nextCursor: result.nextCursor };
 }
 
 export async function addHistory(record: Omit<HistoryRecord, 'id' | 'createdAt'>): Promise<HistoryRecord> {
@@ -68,8 +68,10 @@ export const usePipelineStore = create<PipelineStore>()((set, get) => ({
       };
       
       eventSource.onerror = () => {
-        set({ error: '连接断开', isRunning: false });
-        eventSource.close();
+        // 连接中断时浏览器会带 Last-Event-ID 自动重连，服务端补发期间的事件；只有彻底关闭才报错
+        if (eventSource.readyState === EventSource.CLOSED) {
+          set({ error: '连接断开', isRunning: false });
+        }
       };
       
       set({ taskId, eventSource });
@@ -12,6 +12,7 @@ interface SettingsState extends Settings {
   setDefaultModel: (model: string) => void;
   setUseStream: (useStream: boolean) => void;
   setLanguage: (language: Language) => void;
+  setRepairModel: (model: string) => void;
 }
 
 export const useSettingsStore = create<SettingsState>()((set, get) => ({
@@ -20,6 +21,7 @@ export const useSettingsStore = create<SettingsState>()((set, get) => ({
   defaultModel: 'claude-sonnet-4-5-20250929',
   useStream: false,
   language: 'cn',
+  repairModel: '',
   isLoading: false,
   isLoaded: false,
 
@@ -48,6 +50,7 @@ export const useSettingsStore = create<SettingsState>()((set, get) => ({
       defaultModel: newSettings.defaultModel ?? current.defaultModel,
       useStream: newSettings.useStream ?? current.useStream,
       language: newSettings.language ?? current.language,
+      repairModel: newSettings.repairModel ?? current.repairModel,
     };
     
     try {
@@ -64,4 +67,5 @@ export const useSettingsStore = create<SettingsState>()((set, get) => ({
   setDefaultModel: (model) => set({ defaultModel: model }),
   setUseStream: (useStream) => set({ useStream }),
   setLanguage: (language) => set({ language }),
+  setRepairModel: (repairModel) => set({ repairModel }),
 }));
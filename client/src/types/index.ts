@@ -129,6 +129,7 @@ export interface Settings {
   defaultModel: string;
   useStream: boolean;
   language: Language;
+  repairModel?: string;
 }
 
 export interface HistoryRecord {
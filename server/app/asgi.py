@@ -0,0 +1,437 @@
+# -*- coding: utf-8 -*-
+"""ASGI serving mode.
+
+The pipeline's start, stream, status and state endpoints are served natively with
+asyncio, so an SSE watcher or a /state long-poll costs a coroutine instead of a thread. The WebSocket endpoint
+/api/pipeline/ws watches many tasks over one connection. Every other request goes to
+the Flask app through a WSGI adapter that runs each request on a pool thread.
+
+Run with: uvicorn asgi:app --host 0.0.0.0 --port 5000
+"""
+
+import re
+import json
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgiInstance
+
+from app import create_app
+from app.config import Config
+from app.routes.pipeline import (
+    format_sse, get_pipeline, log, long_poll_timeout, parse_last_event_id, parse_state_tag,
+    replay_snapshot, should_wait_for_state, start_task, state_etag
+)
+from app.services.event_bus import EventSubscription, wait_any
+from app.services.pipeline_registry import get_pipeline_registry
+
+HEARTBEAT_SECONDS = 30
+STATE_RECHECK_SECONDS = 0.5  # 长轮询复查状态版本的间隔（远程任务的版本变化不一定伴随事件）
+TERMINAL_EVENTS = ('pipeline_completed', 'pipeline_error', 'pipeline_cancelled')
+CORS_HEADERS = [(b'access-control-allow-origin', b'*')]
+
+_STATUS_RE = re.compile(r'^/api/pipeline/([^/]+)/status$')
+_STATE_RE = re.compile(r'^/api/pipeline/([^/]+)/state$')
+
+Receive = Callable[[], Awaitable[dict]]
+Send = Callable[[dict], Awaitable[None]]
+
+
+async def _read_body(receive: Receive) -> bytes:
+    body = b''
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            break
+    return body
+
+
+async def _send_json(send: Send, data: Optional[dict], status: int = 200, headers: Optional[List[tuple]] = None) -> None:
+    body = json.dumps(data, ensure_ascii=False).encode('utf-8') if data is not None else b''
+    content_headers = [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())] if body else []
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': content_headers + (headers or []) + CORS_HEADERS
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def _query_args(scope: dict) -> Dict[str, str]:
+    return {k: v[-1] for k, v in parse_qs(scope.get('query_string', b'').decode()).items()}
+
+
+def _headers(scope: dict) -> Dict[str, str]:
+    return {k.decode('latin-1').lower(): v.decode('latin-1') for k, v in scope.get('headers', [])}
+
+
+async def _start(scope: dict, receive: Receive, send: Send) -> None:
+    log("收到 /start 请求 (ASGI)")
+    try:
+        data = json.loads(await _read_body(receive) or b'null')
+    except ValueError:
+        data = None
+    # 创建流水线会读取配置文件，放到线程池中执行
+    result, status = await asyncio.to_thread(start_task, data)
+    await _send_json(send, result, status)
+
+
+async def _status(task_id: str, send: Send) -> None:
+    snapshot = await asyncio.to_thread(get_pipeline_registry().get_snapshot, task_id)
+    if not snapshot:
+        await _send_json(send, {'success': False, 'error': '任务不存在'}, 404)
+        return
+    await _send_json(send, {'success': True, 'data': snapshot})
+
+
+async def _wait_for_change(pipeline, version: int, timeout: float) -> None:
+    """Async counterpart of pipeline.wait_for_change(): waits on the task's event bus."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    run_id = pipeline.run_id
+    subscription = pipeline.events.subscribe(pipeline.events.last_seq)
+    try:
+        while pipeline.version == version and pipeline.run_id == run_id:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            await subscription.get_async(min(remaining, STATE_RECHECK_SECONDS))
+    finally:
+        subscription.close()
+
+
+async def _state(task_id: str, scope: dict, send: Send) -> None:
+    """Same as the Flask /<task_id>/state route, with a long-poll that holds no thread."""
+    query = _query_args(scope)
+    pipeline, state = await asyncio.to_thread(get_pipeline_registry().get_state, task_id)
+    if not state:
+        await _send_json(send, {'success': False, 'error': '任务不存在'}, 404)
+        return
+
+    wait_run, wait_version = parse_state_tag(query.get('waitFor'))
+    if should_wait_for_state(pipeline, state, wait_run, wait_version):
+        await _wait_for_change(pipeline, wait_version, long_poll_timeout(query.get('timeout')))
+        state = await asyncio.to_thread(pipeline.state_snapshot)
+
+    etag, not_modified = state_etag(state, wait_run, wait_version, _headers(scope).get('if-none-match', ''))
+    headers = [(b'etag', etag.encode()), (b'cache-control', b'no-cache')]
+    if not_modified:
+        await _send_json(send, None, 304, headers)
+    else:
+        await _send_json(send, {'success': True, 'data': state}, headers=headers)
+
+
+async def _stream(scope: dict, receive: Receive, send: Send) -> None:
+    query = _query_args(scope)
+    headers = _headers(scope)
+
+    task_id = query.get('taskId')
+    if not task_id:
+        await _send_json(send, {'success': False, 'error': '缺少 taskId'}, 400)
+        return
+    compact = query.get('compact') in ('1', 'true')
+    last_event_id = parse_last_event_id(headers.get('last-event-id') or query.get('lastEventId'))
+
+    # 查找远程任务会读取代理数据库，放到线程池中执行
+    pipeline = await asyncio.to_thread(get_pipeline, task_id)
+    snapshot = None
+    if not pipeline:
+        snapshot = await asyncio.to_thread(get_pipeline_registry().get_snapshot, task_id)
+        if not snapshot:
+            await _send_json(send, {'success': False, 'error': '任务不存在'}, 404)
+            return
+
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [(b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache')] + CORS_HEADERS
+    })
+
+    async def write(frames: List[str]) -> None:
+        await send({'type': 'http.response.body', 'body': ''.join(frames).encode('utf-8'), 'more_body': True})
+
+    if snapshot:
+        await write(list(replay_snapshot(snapshot, last_event_id or 0, compact)))
+        await send({'type': 'http.response.body', 'body': b''})
+        return
+
+    subscription = pipeline.events.subscribe(last_event_id)
+
+    # 客户端断开时关闭订阅，唤醒等待中的读取
+    async def watch_disconnect() -> None:
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+        subscription.close()
+
+    watcher = asyncio.create_task(watch_disconnect())
+    try:
+        await write([f'data: {json.dumps({"type": "connected", "lastEventId": last_event_id})}\n\n'])
+        while not subscription.closed:
+            dropped = subscription.dropped
+            events = await subscription.get_async(HEARTBEAT_SECONDS)
+            if subscription.closed:
+                break
+            if not events:
+                await write([f'data: {json.dumps({"type": "heartbeat"})}\n\n'])
+                continue
+
+            frames = []
+            if subscription.dropped > dropped:
+                frames.append(f'data: {json.dumps({"type": "events_dropped", "data": {"count": subscription.dropped - dropped}})}\n\n')
+            done = False
+            for event in events:
+                frames.append(format_sse(event, compact))
+                if event.type in TERMINAL_EVENTS:
+                    done = True
+                    break
+            # 一次读取到的多个事件合并为一次发送
+            await write(frames)
+            if done:
+                break
+        await send({'type': 'http.response.body', 'body': b''})
+    except OSError:
+        pass  # 连接已断开
+    finally:
+        subscription.close()
+        watcher.cancel()
+
+
+def _event_dict(task_id: str, event) -> dict:
+    return {'taskId': task_id, 'seq': event.seq, 'type': event.type, 'data': event.data, 'timestamp': event.timestamp}
+
+
+async def _websocket(scope: dict, receive: Receive, send: Send) -> None:
+    """Multiplexed pipeline events over one WebSocket.
+
+    Client messages (JSON):
+        {"action": "subscribe", "taskId": str, "lastEventId": int?}
+        {"action": "unsubscribe", "taskId": str}
+        {"action": "pause" | "resume" | "cancel", "taskId": str}
+        {"action": "ping"}
+
+    Server messages:
+        {"type": "subscribed" | "unsubscribed" | "ack" | "pong" | "error", ...}
+        {"type": "batch", "events": [{"taskId", "seq", "type", "data", "timestamp"}, ...]}
+
+    Events of all subscriptions are sent as one batch per WS_BATCH_INTERVAL tick. ``seq``
+    is the task's event ID; pass the last one as lastEventId to resume after reconnecting.
+    A subscription ends after its task's terminal event.
+    """
+    if (await receive())['type'] != 'websocket.connect':
+        return
+    await send({'type': 'websocket.accept'})
+
+    loop = asyncio.get_running_loop()
+    subscriptions: Dict[str, EventSubscription] = {}
+    outgoing: List[dict] = []  # 已结束任务的快照事件，随下一批发送
+    wakeup = asyncio.Event()
+    send_lock = asyncio.Lock()
+    closed = False
+
+    async def send_json(data: dict) -> None:
+        async with send_lock:
+            await send({'type': 'websocket.send', 'text': json.dumps(data, ensure_ascii=False, separators=(',', ':'))})
+
+    async def handle(message: dict) -> dict:
+        action, task_id = message.get('action'), message.get('taskId')
+        if action == 'ping':
+            return {'type': 'pong'}
+        if not task_id:
+            return {'type': 'error', 'action': action, 'error': '缺少 taskId'}
+
+        if action == 'subscribe':
+            if task_id in subscriptions:
+                subscriptions.pop(task_id).close()
+            last_event_id = parse_last_event_id(str(message.get('lastEventId') or ''))
+            pipeline = await asyncio.to_thread(get_pipeline, task_id)
+            if pipeline:
+                subscriptions[task_id] = pipeline.events.subscribe(last_event_id)
+                return {'type': 'subscribed', 'taskId': task_id, 'lastEventId': pipeline.events.last_seq}
+            snapshot = await asyncio.to_thread(get_pipeline_registry().get_snapshot, task_id)
+            if not snapshot:
+                return {'type': 'error', 'action': action, 'taskId': task_id, 'error': '任务不存在'}
+            outgoing.extend(
+                {'taskId': task_id, **e} for e in snapshot.get('events', []) if e['seq'] > (last_event_id or 0)
+            )
+            return {'type': 'subscribed', 'taskId': task_id, 'lastEventId': snapshot.get('lastEventId'), 'finished': True}
+
+        if action == 'unsubscribe':
+            sub = subscriptions.pop(task_id, None)
+            if sub:
+                sub.close()
+            return {'type': 'unsubscribed', 'taskId': task_id}
+
+        if action in ('pause', 'resume', 'cancel'):
+            pipeline = await asyncio.to_thread(get_pipeline, task_id)
+            if not pipeline:
+                return {'type': 'error', 'action': action, 'taskId': task_id, 'error': '任务不存在'}
+            # 远程任务的控制命令写入代理数据库
+            await asyncio.to_thread(getattr(pipeline, action))
+            return {'type': 'ack', 'action': action, 'taskId': task_id}
+
+        return {'type': 'error', 'action': action, 'error': f'未知操作: {action}'}
+
+    async def read_messages() -> None:
+        nonlocal closed
+        try:
+            while True:
+                message = await receive()
+                if message['type'] == 'websocket.disconnect':
+                    break
+                try:
+                    data = json.loads(message.get('text') or message.get('bytes') or b'null')
+                except ValueError:
+                    data = None
+                if not isinstance(data, dict):
+                    await send_json({'type': 'error', 'error': '消息格式无效'})
+                    continue
+                await send_json(await handle(data))
+                wakeup.set()
+        finally:
+            closed = True
+            wakeup.set()
+
+    reader = asyncio.create_task(read_messages())
+    last_sent = 0.0
+    try:
+        while not closed:
+            await wait_any(list(subscriptions.values()), wakeup=wakeup)
+            wakeup.clear()
+            # 距上一帧不足一个周期时稍等，把这段时间的事件合并为一帧
+            delay = last_sent + Config.WS_BATCH_INTERVAL - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if closed:
+                break
+
+            events, outgoing[:] = list(outgoing), []
+            for task_id, sub in list(subscriptions.items()):
+                dropped = sub.dropped
+                polled = sub.poll()
+                if sub.dropped > dropped:
+                    events.append({'taskId': task_id, 'type': 'events_dropped', 'data': {'count': sub.dropped - dropped}})
+                for event in polled:
+                    events.append(_event_dict(task_id, event))
+                    if event.type in TERMINAL_EVENTS:
+                        subscriptions.pop(task_id, None)
+                        sub.close()
+                        break
+            if events:
+                await send_json({'type': 'batch', 'events': events})
+                last_sent = loop.time()
+    except OSError:
+        pass  # 连接已断开
+    finally:
+        for sub in subscriptions.values():
+            sub.close()
+        reader.cancel()
+
+
+class _PooledWsgiInstance(WsgiToAsgiInstance):
+    """One request of ThreadPoolWsgi (environ building and start_response come from asgiref)."""
+
+    def __init__(self, wsgi_application, executor: ThreadPoolExecutor):
+        super().__init__(wsgi_application)
+        self.executor = executor
+
+    async def run_wsgi_app(self, body) -> None:
+        await sync_to_async(self._run, thread_sensitive=False, executor=self.executor)(body)
+
+    def _run(self, body) -> None:
+        try:
+            environ = self.build_environ(self.scope, body)
+        except ValueError:
+            self.sync_send({'type': 'http.response.start', 'status': 400, 'headers': [(b'content-type', b'text/plain')]})
+            self.sync_send({'type': 'http.response.body', 'body': b'Bad Request'})
+            return
+        result = self.wsgi_application(environ, self.start_response)
+        try:
+            for output in result:
+                if not output:
+                    continue
+                if not self.response_started:
+                    self.response_started = True
+                    self.sync_send(self.response_start)
+                self.sync_send({'type': 'http.response.body', 'body': output, 'more_body': True})
+        finally:
+            # 关闭响应，执行 Flask 的 teardown 和流式生成器的 finally
+            close = getattr(result, 'close', None)
+            if close:
+                close()
+        if not self.response_started:
+            self.response_started = True
+            self.sync_send(self.response_start)
+        self.sync_send({'type': 'http.response.body'})
+
+
+class ThreadPoolWsgi:
+    """ASGI adapter that runs a WSGI app with real concurrency.
+
+    asgiref's WsgiToAsgi runs every request on one shared thread, so a single slow
+    Flask request (a suites ZIP export, a large import upload) would hold up the whole
+    REST API. Here each request runs on a thread of a pool of ``max_workers``.
+    """
+
+    def __init__(self, wsgi_application, max_workers: int):
+        self.wsgi_application = wsgi_application
+        self.executor = ThreadPoolExecutor(max_workers, thread_name_prefix='wsgi')
+
+    async def __call__(self, scope: dict, receive: Receive, send: Send) -> None:
+        await _PooledWsgiInstance(self.wsgi_application, self.executor)(scope, receive, send)
+
+
+def _route(method: str, path: str) -> Optional[Tuple[str, Dict[str, str]]]:
+    """Match a request to a native async handler."""
+    if method == 'POST' and path == '/api/pipeline/start':
+        return 'start', {}
+    if method == 'GET' and path == '/api/pipeline/stream':
+        return 'stream', {}
+    m = _STATUS_RE.match(path)
+    if method == 'GET' and m:
+        return 'status', {'task_id': m.group(1)}
+    m = _STATE_RE.match(path)
+    if method == 'GET' and m:
+        return 'state', {'task_id': m.group(1)}
+    return None
+
+
+def create_asgi_app():
+    """Create the ASGI application (native pipeline streaming + Flask for the rest)."""
+    flask_app = ThreadPoolWsgi(create_app(), Config.ASGI_WSGI_THREADS)
+
+    async def app(scope: dict, receive: Receive, send: Send) -> None:
+        if scope['type'] == 'lifespan':
+            while True:
+                message = await receive()
+                if message['type'] == 'lifespan.startup':
+                    await send({'type': 'lifespan.startup.complete'})
+                elif message['type'] == 'lifespan.shutdown':
+                    await send({'type': 'lifespan.shutdown.complete'})
+                    return
+
+        if scope['type'] == 'websocket' and scope.get('path') == '/api/pipeline/ws':
+            await _websocket(scope, receive, send)
+            return
+
+        route = _route(scope.get('method', ''), scope.get('path', '')) if scope['type'] == 'http' else None
+        if not route:
+            await flask_app(scope, receive, send)
+            return
+
+        name, params = route
+        if name == 'start':
+            await _start(scope, receive, send)
+        elif name == 'stream':
+            await _stream(scope, receive, send)
+        elif name == 'state':
+            await _state(params['task_id'], scope, send)
+        else:
+            await _status(params['task_id'], send)
+
+    return app
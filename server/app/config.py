@@ -20,9 +20,68 @@ class Config:
     MAX_ITERATIONS = 3
     PASS_SCORE = 8.0
     DEFAULT_MAX_PARALLEL = 3
+    GENERATOR_CONTEXT_MAX_TOKENS = 6000  # Generator 输入上下文的 token 上限
+    # 内置表之外的模型上限（如网关自定义名称）："名称前缀=上下文:最大输出,..."，未知模型不做预检
+    MODEL_LIMITS = os.environ.get('MODEL_LIMITS', '')
+    OPTIMIZER_MODE = 'patch'  # 'patch': 输出章节编辑操作，失败时回退 'full': 完整重写
+    
+    # Task progress journal: 追加多少条检查点后合并为快照
+    TASK_JOURNAL_COMPACT_LINES = 64
+    
+    # Result files: 后台写线程的待写文件上限，以及完成前等待落盘的超时（秒）
+    RESULT_WRITER_MAX_PENDING = 256
+    RESULT_FLUSH_TIMEOUT = 30
+    
+    # agent_output 事件合并：缓冲的输出最多等待此时间窗口（秒，模型停顿时也按时发送）或达到字节阈值即发送
+    STREAM_COALESCE_WINDOW = 0.05
+    STREAM_COALESCE_BYTES = 2048
+    
+    # 每个任务的事件回放缓冲区大小（断线重连时按 Last-Event-ID 补发）
+    EVENT_BUFFER_SIZE = 2000
+    
+    # GET /state?waitFor= 长轮询的最长等待（秒）
+    STATE_LONG_POLL_TIMEOUT = 25
+    
+    # WebSocket 多任务订阅：事件按此间隔（秒）合并为一帧发送
+    WS_BATCH_INTERVAL = 0.1
+    
+    # ASGI 模式下转交 Flask 处理的请求所用线程数（导出、导入等慢请求互不阻塞）
+    ASGI_WSGI_THREADS = int(os.environ.get('ASGI_WSGI_THREADS', 32))
+    
+    # 多进程部署时共享任务状态与事件：'sqlite' 使用 config/broker.db，'none' 关闭
+    TASK_BROKER = os.environ.get('TASK_BROKER', 'sqlite')
+    BROKER_STATE_INTERVAL = 0.25  # 任务状态写入代理数据库的最短间隔（秒），期间的变化合并写入
+    
+    # 已结束的流水线：内存中保留的时长（秒）和数量，超出后只保留磁盘快照
+    PIPELINE_TTL_SECONDS = 600
+    PIPELINE_MAX_FINISHED = 20
+    PIPELINE_SNAPSHOT_KEEP = 500  # 磁盘快照保留数量
+    
+    # 套件索引：结果目录未变化时，每隔多少秒仍全量核对一次（捕获文件夹内的手动修改）
+    CATALOG_RECONCILE_INTERVAL = 60
+    SUITES_MAX_PAGE_SIZE = 500  # /api/suites 单页最大数量
+    SEARCH_MAX_HIGHLIGHTS = 5  # 每条搜索结果返回的高亮片段数
+    
+    # 套件 blob 库：不短于此长度的文本存入 config/blobs 去重；差量链的最大长度；读取缓存条数
+    BLOB_MIN_CHARS = 256
+    BLOB_MAX_DELTA_CHAIN = 8
+    BLOB_CACHE_SIZE = 256
+    
+    # 套件 ZIP 导出/导入：每次读写的块大小；单次导入解压后的总大小上限
+    EXPORT_CHUNK_SIZE = 64 * 1024
+    IMPORT_MAX_BYTES = int(os.environ.get('IMPORT_MAX_BYTES', 1024 * 1024 * 1024))
+    
+    # HTTP 缓存：序列化/压缩后响应的 LRU（条数、总字节数）；小于该字节数的响应不压缩
+    HTTP_CACHE_SIZE = 256
+    HTTP_CACHE_MAX_BYTES = 64 * 1024 * 1024
+    HTTP_COMPRESS_MIN_BYTES = 1024
     
     # History settings
-    MAX_HISTORY_RECORDS = 50
+    MAX_HISTORY_RECORDS = 50  # GET /api/history 默认每页数量
+    # 保留最新的多少条（0 不限）和多少天内的记录（0 不限）
+    HISTORY_RETENTION_COUNT = int(os.environ.get('HISTORY_RETENTION_COUNT', 100))
+    HISTORY_RETENTION_DAYS = int(os.environ.get('HISTORY_RETENTION_DAYS', 0))
+    HISTORY_PRUNE_EVERY = 20  # 每插入多少条执行一次清理
     
     # Ensure directories exist
     @classmethod
@@ -222,3 +222,4 @@ class PipelineEvent:
     ]
     data: Dict[str, Any] = field(default_factory=dict)
     timestamp: str = field(default_factory=lambda: datetime.now().isoformat())
+    seq: int = 0  # 事件序号，由 EventBus 分配（SSE 的 id）
@@ -12,6 +12,7 @@ class Settings:
     default_model: str = "claude-sonnet-4-5-20251022"
     use_stream: bool = True  # 是否使用流式输出
     language: str = "cn"  # 语言设置: cn/en
+    repair_model: str = ""  # 修复损坏 JSON 用的快速模型，为空时使用任务模型
     
     def to_dict(self) -> dict:
         """Convert to dictionary for JSON serialization."""
@@ -20,7 +21,8 @@ class Settings:
             "baseUrl": self.base_url,
             "defaultModel": self.default_model,
             "useStream": self.use_stream,
-            "language": self.language
+            "language": self.language,
+            "repairModel": self.repair_model
         }
     
     @classmethod
@@ -31,5 +33,6 @@ class Settings:
             base_url=data.get("baseUrl", "https://api.openai.com"),
             default_model=data.get("defaultModel", "claude-sonnet-4-5-20251022"),
             use_stream=data.get("useStream", True),
-            language=data.get("language", "cn")
+            language=data.get("language", "cn"),
+            repair_model=data.get("repairModel", "")
         )
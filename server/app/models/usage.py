@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""Token usage data model."""
+
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Optional
+
+
+@dataclass
+class UsageRecord:
+    """Token usage of a single LLM call."""
+    task_id: str
+    agent: str
+    model: str = ""
+    role_index: Optional[int] = None
+    iteration: Optional[int] = None
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    created_at: str = field(default_factory=lambda: datetime.now().isoformat())
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def to_dict(self) -> dict:
+        """Convert to dictionary for JSON serialization."""
+        return {
+            "task_id": self.task_id,
+            "agent": self.agent,
+            "model": self.model,
+            "role_index": self.role_index,
+            "iteration": self.iteration,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cached_tokens": self.cached_tokens,
+            "created_at": self.created_at
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "UsageRecord":
+        """Create from dictionary."""
+        return cls(
+            task_id=data.get("task_id", ""),
+            agent=data.get("agent", ""),
+            model=data.get("model", ""),
+            role_index=data.get("role_index"),
+            iteration=data.get("iteration"),
+            prompt_tokens=data.get("prompt_tokens", 0),
+            completion_tokens=data.get("completion_tokens", 0),
+            cached_tokens=data.get("cached_tokens", 0),
+            created_at=data.get("created_at", datetime.now().isoformat())
+        )
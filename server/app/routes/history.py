@@ -3,19 +3,30 @@
 
 from datetime import datetime
 from flask import Blueprint, request, jsonify
+from app.config import Config
 from app.services.storage_service import get_storage_service
+from app.utils import http_cache
 from app.models.history import HistoryRecord
 
 bp = Blueprint('history', __name__, url_prefix='/api')
+http_cache.register(bp)
 
 
 @bp.route('/history', methods=['GET'])
 def get_history():
-    """Get history records."""
+    """Get history records, newest first.
+    
+    Query params:
+        limit: page size (default MAX_HISTORY_RECORDS)
+        cursor: nextCursor from the previous page
+    """
     try:
+        limit = max(1, min(request.args.get('limit', Config.MAX_HISTORY_RECORDS, type=int), 500))
         storage = get_storage_service()
-        records = storage.get_history(limit=50)
-        return jsonify({'success': True, 'data': [r.to_dict() for r in records]})
+        records, next_cursor = storage.page_history(limit, request.args.get('cursor') or None)
+        return jsonify({'success': True, 'data': [r.to_dict() for r in records], 'nextCursor': next_cursor})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -5,11 +5,14 @@ import json
 import threading
 from datetime import datetime
 from flask import Blueprint, request, jsonify, Response, g
-from typing import Optional
+from typing import Optional, Tuple
 
+from app.config import Config
 from app.services.pipeline_service import PipelineService
+from app.services.pipeline_registry import get_pipeline_registry
 from app.services.llm_client import LLMClient
 from app.services.storage_service import get_storage_service
+from app.models.pipeline import PipelineEvent
 from app.services.prompt_loader import set_language
 
 bp = Blueprint('pipeline', __name__, url_prefix='/api/pipeline')
@@ -20,25 +23,22 @@ def log(msg: str, level: str = "INFO"):
     timestamp = datetime.now().strftime("%H:%M:%S.%f")[:-3]
     print(f"[{timestamp}] [Route] [{level}] {msg}", flush=True)
 
-# Store active pipelines
-_pipelines: dict = {}
-_pipeline_lock = threading.Lock()
+def get_pipeline(task_id: str):
+    """Get a pipeline by task ID (one of this process or a proxy for another worker's)."""
+    return get_pipeline_registry().lookup(task_id)
 
 
-def get_pipeline(task_id: str) -> Optional[PipelineService]:
-    """Get pipeline by task ID."""
-    with _pipeline_lock:
-        return _pipelines.get(task_id)
-
-
-@bp.route('/start', methods=['POST'])
-def start_pipeline():
-    """Start a new pipeline execution."""
-    log("收到 /start 请求")
-    data = request.get_json()
+def start_task(data: Optional[dict]) -> Tuple[dict, int]:
+    """Create a pipeline and run it on a background thread.
+    
+    Shared by the Flask route and the ASGI server.
+    
+    Returns:
+        (response body, HTTP status)
+    """
     if not data:
         log("请求数据无效", "ERROR")
-        return jsonify({'success': False, 'error': '请求数据无效'}), 400
+        return {'success': False, 'error': '请求数据无效'}, 400
     
     description = data.get('description', '').strip()
     prompt_type = data.get('type', 'general')
@@ -48,7 +48,7 @@ def start_pipeline():
     
     if not description:
         log("需求描述为空", "ERROR")
-        return jsonify({'success': False, 'error': '请输入需求描述'}), 400
+        return {'success': False, 'error': '请输入需求描述'}, 400
     
     # Get settings for API key
     log("加载配置...")
@@ -59,7 +59,7 @@ def start_pipeline():
     
     if not settings.api_key:
         log("API Key 未配置", "ERROR")
-        return jsonify({'success': False, 'error': '请先配置 API Key'}), 400
+        return {'success': False, 'error': '请先配置 API Key'}, 400
     
     log(f"配置加载成功: base_url={settings.base_url}")
     
@@ -78,18 +78,20 @@ def start_pipeline():
     
     try:
         llm_client = LLMClient(api_key=settings.api_key, base_url=settings.base_url)
-        pipeline = PipelineService(llm_client, use_stream=use_stream, max_parallel=max_parallel)
+        pipeline = PipelineService(
+            llm_client, use_stream=use_stream, max_parallel=max_parallel,
+            repair_model=settings.repair_model or None
+        )
         task_id = pipeline.start(description, prompt_type, model)
         
-        with _pipeline_lock:
-            _pipelines[task_id] = pipeline
+        get_pipeline_registry().register(task_id, pipeline)
         
         log(f"流水线创建成功: task_id={task_id}, parallel={use_parallel}, max_parallel={max_parallel}")
     except Exception as e:
         log(f"流水线创建失败: {type(e).__name__}: {e}", "ERROR")
         import traceback
         traceback.print_exc()
-        return jsonify({'success': False, 'error': f'流水线创建失败: {str(e)}'}), 500
+        return {'success': False, 'error': f'流水线创建失败: {str(e)}'}, 500
     
     # Start pipeline in background thread
     def run_pipeline():
@@ -111,37 +113,142 @@ def start_pipeline():
                 pipeline.state.status = 'error'
                 pipeline.state.error = str(e)
             pipeline._emit_event('pipeline_error', {'error': str(e)})
+        finally:
+            get_pipeline_registry().finish(task_id)
     
     thread = threading.Thread(target=run_pipeline, daemon=True)
     thread.start()
     log("后台线程已启动")
     
-    return jsonify({'success': True, 'data': {'taskId': task_id}})
+    return {'success': True, 'data': {'taskId': task_id}}, 200
+
+
+@bp.route('/start', methods=['POST'])
+def start_pipeline():
+    """Start a new pipeline execution."""
+    log("收到 /start 请求")
+    result, status = start_task(request.get_json())
+    return jsonify(result), status
+
+
+def format_sse(event, compact: bool = False) -> str:
+    """Encode a pipeline event as an SSE frame.
+    
+    compact 模式：紧凑分隔符、直接输出 UTF-8（中文不转义为 \\uXXXX），agent_output 不带时间戳。
+    """
+    if not compact:
+        return f'id: {event.seq}\ndata: {json.dumps({"type": event.type, "data": event.data, "timestamp": event.timestamp})}\n\n'
+    payload = {'type': event.type, 'data': event.data}
+    if event.type != 'agent_output':
+        payload['timestamp'] = event.timestamp
+    return f'id: {event.seq}\ndata: {json.dumps(payload, ensure_ascii=False, separators=(",", ":"))}\n\n'
+
+
+def parse_last_event_id(value: Optional[str]) -> Optional[int]:
+    """Parse a Last-Event-ID header or lastEventId query value."""
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
+
+
+def parse_state_tag(value: Optional[str]) -> Tuple[Optional[str], Optional[int]]:
+    """Split a waitFor value into (run ID or None, version or None)."""
+    if not value:
+        return None, None
+    run_id, _, version = value.rpartition('.')
+    try:
+        return run_id or None, int(version)
+    except ValueError:
+        return None, None
+
+
+def should_wait_for_state(pipeline, state: dict, wait_run: Optional[str], wait_version: Optional[int]) -> bool:
+    """True if a waitFor tag is still the current state of a live task (the long-poll should wait)."""
+    return (wait_version is not None and pipeline is not None and pipeline.version == wait_version
+            and wait_run in (None, state.get('runId')))
+
+
+def long_poll_timeout(value: Optional[str]) -> float:
+    """Long-poll wait in seconds from a timeout query value, at most STATE_LONG_POLL_TIMEOUT."""
+    try:
+        timeout = float(value) if value else Config.STATE_LONG_POLL_TIMEOUT
+    except ValueError:
+        timeout = Config.STATE_LONG_POLL_TIMEOUT
+    return max(0.0, min(timeout, Config.STATE_LONG_POLL_TIMEOUT))
+
+
+def state_etag(state: dict, wait_run: Optional[str], wait_version: Optional[int], if_none_match: str) -> Tuple[str, bool]:
+    """ETag of a task state and whether the client already has it.
+    
+    Returns:
+        (quoted ETag, True if If-None-Match or the waitFor tag matches it)
+    """
+    tag = f'{state.get("runId", "")}.{state["version"]}'
+    etag = f'"{tag}"'
+    not_modified = (
+        (wait_run is not None and f'{wait_run}.{wait_version}' == tag)
+        or etag in [t.strip() for t in (if_none_match or '').split(',')]
+    )
+    return etag, not_modified
+
+
+def replay_snapshot(snapshot: dict, after_seq: int, compact: bool):
+    """Yield the SSE frames of a finished task's saved events."""
+    yield f'data: {json.dumps({"type": "connected", "lastEventId": after_seq or None})}\n\n'
+    for e in snapshot.get('events', []):
+        if e['seq'] > after_seq:
+            yield format_sse(PipelineEvent(type=e['type'], data=e['data'], timestamp=e['timestamp'], seq=e['seq']), compact)
 
 
 @bp.route('/stream')
 def stream_events():
-    """SSE endpoint for pipeline progress."""
+    """SSE endpoint for pipeline progress.
+    
+    Query params:
+        taskId: Task ID
+        compact: '1' for the compact event encoding
+        lastEventId: Resume after this event ID (same as the Last-Event-ID header)
+    """
     task_id = request.args.get('taskId')
     if not task_id:
         return jsonify({'success': False, 'error': '缺少 taskId'}), 400
     
+    compact = request.args.get('compact') in ('1', 'true')
+    
+    # 浏览器重连时 EventSource 会自动带上 Last-Event-ID
+    last_event_id = parse_last_event_id(request.headers.get('Last-Event-ID') or request.args.get('lastEventId'))
+    
     pipeline = get_pipeline(task_id)
     if not pipeline:
-        return jsonify({'success': False, 'error': '任务不存在'}), 404
+        # 已移出内存的任务：从快照回放保存下来的事件
+        snapshot = get_pipeline_registry().get_snapshot(task_id)
+        if not snapshot:
+            return jsonify({'success': False, 'error': '任务不存在'}), 404
+        return Response(replay_snapshot(snapshot, last_event_id or 0, compact), mimetype='text/event-stream')
+    
+    subscription = pipeline.events.subscribe(last_event_id)
     
     def generate():
-        yield f'data: {json.dumps({"type": "connected"})}\n\n'
-        
-        while True:
-            try:
-                event = pipeline.event_queue.get(timeout=30)
-                yield f'data: {json.dumps({"type": event.type, "data": event.data, "timestamp": event.timestamp})}\n\n'
+        try:
+            yield f'data: {json.dumps({"type": "connected", "lastEventId": last_event_id})}\n\n'
+            
+            while True:
+                dropped = subscription.dropped
+                events = subscription.get(timeout=30)
+                if not events:
+                    yield f'data: {json.dumps({"type": "heartbeat"})}\n\n'
+                    continue
+                
+                if subscription.dropped > dropped:
+                    yield f'data: {json.dumps({"type": "events_dropped", "data": {"count": subscription.dropped - dropped}})}\n\n'
                 
-                if event.type in ('pipeline_completed', 'pipeline_error', 'pipeline_cancelled'):
-                    break
-            except:
-                yield f'data: {json.dumps({"type": "heartbeat"})}\n\n'
+                for event in events:
+                    yield format_sse(event, compact)
+                    if event.type in ('pipeline_completed', 'pipeline_error', 'pipeline_cancelled'):
+                        return
+        finally:
+            subscription.close()
     
     return Response(generate(), mimetype='text/event-stream')
 
@@ -179,6 +286,57 @@ def cancel_pipeline():
     return jsonify({'success': True})
 
 
+@bp.route('/<task_id>/status', methods=['GET'])
+def get_status(task_id: str):
+    """Get the state of a task (运行中从内存读取，已结束从快照读取)."""
+    snapshot = get_pipeline_registry().get_snapshot(task_id)
+    if not snapshot:
+        return jsonify({'success': False, 'error': '任务不存在'}), 404
+    return jsonify({'success': True, 'data': snapshot})
+
+
+@bp.route('/<task_id>/state', methods=['GET'])
+def get_state(task_id: str):
+    """Get the serialized state of a task with an ETag of its run and version.
+    
+    Query params:
+        waitFor: Long-poll until the state differs from this tag ("<runId>.<version>",
+            the ETag value); a bare version number is accepted but never yields a 304
+        timeout: Long-poll wait in seconds (at most STATE_LONG_POLL_TIMEOUT)
+        
+    Responds 304 when the client's If-None-Match (or waitFor after the wait) is
+    still the current run and version. The run ID changes when a task is recovered,
+    whose version starts again from 0.
+    
+    The long-poll holds a thread here; the ASGI server answers this route natively
+    instead (see app/asgi.py).
+    """
+    registry = get_pipeline_registry()
+    pipeline, state = registry.get_state(task_id)
+    if not state:
+        return jsonify({'success': False, 'error': '任务不存在'}), 404
+    
+    wait_run, wait_version = parse_state_tag(request.args.get('waitFor'))
+    if should_wait_for_state(pipeline, state, wait_run, wait_version):
+        pipeline.wait_for_change(wait_version, long_poll_timeout(request.args.get('timeout')))
+        state = pipeline.state_snapshot()
+    
+    etag, not_modified = state_etag(state, wait_run, wait_version, request.headers.get('If-None-Match', ''))
+    response = Response(status=304) if not_modified else jsonify({'success': True, 'data': state})
+    response.headers['ETag'] = etag
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+@bp.route('/<task_id>/usage', methods=['GET'])
+def get_usage(task_id: str):
+    """Get the token usage ledger of a task (token 用量统计)."""
+    usage = get_pipeline_registry().get_usage(task_id)
+    if not usage:
+        return jsonify({'success': False, 'error': '任务不存在'}), 404
+    return jsonify({'success': True, 'data': usage})
+
+
 @bp.route('/incomplete', methods=['GET'])
 def list_incomplete_tasks():
     """List all incomplete tasks that can be resumed (断点恢复列表)."""
@@ -220,12 +378,24 @@ def recover_pipeline():
     
     use_parallel = data.get('parallel', True)
     
+    # 任务仍在本进程或其他进程中运行时不能再次恢复
+    registry = get_pipeline_registry()
+    if not registry.claim(task_id):
+        log(f"任务正在运行，拒绝恢复: {task_id}", "WARN")
+        return jsonify({'success': False, 'error': '任务正在运行中'}), 409
+    
     # Create pipeline and resume
-    llm_client = LLMClient(api_key=settings.api_key, base_url=settings.base_url)
-    pipeline = PipelineService(llm_client, use_stream=settings.use_stream)
+    try:
+        llm_client = LLMClient(api_key=settings.api_key, base_url=settings.base_url)
+        pipeline = PipelineService(
+            llm_client, use_stream=settings.use_stream,
+            repair_model=settings.repair_model or None
+        )
+    except Exception:
+        registry.release(task_id)
+        raise
     
-    with _pipeline_lock:
-        _pipelines[task_id] = pipeline
+    registry.register(task_id, pipeline)
     
     def run_recovery():
         log(f"开始恢复任务: {task_id}")
@@ -246,6 +416,8 @@ def recover_pipeline():
                 pipeline.state.status = 'error'
                 pipeline.state.error = str(e)
             pipeline._emit_event('pipeline_error', {'error': str(e)})
+        finally:
+            get_pipeline_registry().finish(task_id)
     
     thread = threading.Thread(target=run_recovery, daemon=True)
     thread.start()
@@ -3,9 +3,11 @@
 
 from flask import Blueprint, request, jsonify
 from app.services.storage_service import get_storage_service
+from app.utils import http_cache
 from app.models.settings import Settings
 
 bp = Blueprint('settings', __name__, url_prefix='/api')
+http_cache.register(bp, private=True)
 
 
 @bp.route('/settings', methods=['GET'])
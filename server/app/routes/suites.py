@@ -1,32 +1,198 @@
 # -*- coding: utf-8 -*-
 """Suites API routes."""
 
-from flask import Blueprint, request, jsonify
+from datetime import datetime
+from urllib.parse import quote
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+from app.config import Config
 from app.services.storage_service import get_storage_service
+from app.services.suite_archive import import_stream, iter_export
+from app.utils import http_cache
+from app.utils.projection import parse_fields
 
 bp = Blueprint('suites', __name__, url_prefix='/api')
+http_cache.register(bp)
 
 
 @bp.route('/suites', methods=['GET'])
 def list_suites():
-    """List all saved suites."""
+    """List saved suites.
+    
+    Query params (all optional):
+        sort: savedAt (default) | name | systemName | score | rolesCount
+        order: desc (default) | asc
+        q: substring of name, system name or description
+        minScore: minimum review score
+        from / to: savedAt range, ISO date/time (to is exclusive)
+        limit / offset: paging; all suites when limit is omitted
+        refresh: 1 to re-check the result directory before listing
+    """
+    try:
+        args = request.args
+        limit = args.get('limit', type=int)
+        offset = args.get('offset', 0, type=int)
+        if limit is not None:
+            limit = max(0, min(limit, Config.SUITES_MAX_PAGE_SIZE))
+        
+        storage = get_storage_service()
+        suites, total = storage.query_suites(
+            refresh=args.get('refresh') in ('1', 'true'),
+            sort=args.get('sort', 'savedAt'),
+            order=args.get('order', 'desc'),
+            q=args.get('q') or None,
+            min_score=args.get('minScore', type=float),
+            saved_from=args.get('from') or None,
+            saved_to=args.get('to') or None,
+            limit=limit,
+            offset=max(0, offset)
+        )
+        return jsonify({'success': True, 'data': suites, 'total': total, 'offset': max(0, offset), 'limit': limit})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@bp.route('/suites/search', methods=['GET'])
+def search_suites():
+    """Full-text search over suite descriptions, system names, role names and prompts.
+    
+    Query params:
+        q: search text (Chinese matched by character bigrams, English by words)
+        limit / offset: paging (default 20)
+    """
+    try:
+        q = (request.args.get('q') or '').strip()
+        if not q:
+            return jsonify({'success': False, 'error': '缺少搜索关键词'}), 400
+        limit = max(0, min(request.args.get('limit', 20, type=int), Config.SUITES_MAX_PAGE_SIZE))
+        offset = max(0, request.args.get('offset', 0, type=int))
+        
+        storage = get_storage_service()
+        results, total = storage.search_suites(q, limit=limit, offset=offset)
+        return jsonify({'success': True, 'data': results, 'total': total, 'offset': offset, 'limit': limit})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+def _zip_response(names, filename: str) -> Response:
+    """Stream a ZIP archive of suites as a download."""
+    storage = get_storage_service()
+    response = Response(stream_with_context(iter_export(storage, names)), mimetype='application/zip')
+    response.headers['Content-Disposition'] = f"attachment; filename*=UTF-8''{quote(filename)}"
+    return response
+
+
+@bp.route('/suites/export.zip', methods=['GET'])
+def export_suites():
+    """Bulk export as one ZIP (one folder per suite).
+    
+    Query params:
+        name: suite name, repeatable
+        all: 1 to export every suite
+    """
+    try:
+        names = request.args.getlist('name')
+        if request.args.get('all') in ('1', 'true'):
+            storage = get_storage_service()
+            names = [s['name'] for s in storage.list_suites()]
+        if not names:
+            return jsonify({'success': False, 'error': '未指定要导出的套件'}), 400
+        return _zip_response(names, f"suites_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip")
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@bp.route('/suites/<name>/export.zip', methods=['GET'])
+def export_suite(name: str):
+    """Export one suite as a ZIP."""
+    storage = get_storage_service()
+    if not storage.layout.resolve(name):
+        return jsonify({'success': False, 'error': '套件不存在'}), 404
+    return _zip_response([name], f'{name}.zip')
+
+
+@bp.route('/suites/import', methods=['POST'])
+def import_suites():
+    """Import suites from a ZIP sent as the raw request body (format of the export)."""
     try:
         storage = get_storage_service()
-        suites = storage.list_suites()
-        return jsonify({'success': True, 'data': suites})
+        imported = import_stream(storage, request.stream)
+        return jsonify({'success': True, 'data': imported})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+def _suite_response(name: str, build, *variant):
+    """Cached JSON response built from a suite folder.
+    
+    Revalidated by the mtime and size of _data.json: a 304 or a cached body is
+    returned without reading the file.
+    
+    Args:
+        name: Suite name
+        build: (storage, suite_dir) -> data; raises LookupError for a 404
+        variant: Request parameters that change the response
+    """
+    storage = get_storage_service()
+    suite_dir = storage.layout.resolve(name)
+    data_file = suite_dir / '_data.json' if suite_dir else None
+    if not data_file or not data_file.exists():
+        return jsonify({'success': False, 'error': '套件不存在'}), 404
+    stat = data_file.stat()
+    etag = http_cache.make_etag(data_file, stat.st_mtime_ns, stat.st_size, *variant)
+    return http_cache.cached_json(
+        etag, stat.st_mtime,
+        lambda: {'success': True, 'data': build(storage, suite_dir)}
+    )
+
+
 @bp.route('/suites/<name>', methods=['GET'])
 def get_suite(name: str):
-    """Get suite details."""
+    """Get suite details.
+    
+    Query params:
+        fields: comma-separated dotted paths to return, e.g.
+            promptSuite.prompts.role_name,review.score (default: everything)
+    """
     try:
-        storage = get_storage_service()
-        suite = storage.get_suite(name)
-        if suite is None:
-            return jsonify({'success': False, 'error': '套件不存在'}), 404
-        return jsonify({'success': True, 'data': suite})
+        paths = parse_fields(request.args.get('fields'))
+        if not paths:
+            return _suite_response(name, lambda storage, suite_dir: storage.read_suite_data(suite_dir))
+        return _suite_response(
+            name, lambda storage, suite_dir: storage.read_suite_fields(suite_dir, paths),
+            'fields', sorted('.'.join(p) for p in paths)
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@bp.route('/suites/<name>/roles', methods=['GET'])
+def get_suite_roles(name: str):
+    """List the roles of a suite without their prompts."""
+    try:
+        return _suite_response(name, lambda storage, suite_dir: storage.suite_roles(suite_dir), 'roles')
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@bp.route('/suites/<name>/roles/<role>', methods=['GET'])
+def get_suite_role(name: str, role: str):
+    """Get one role of a suite with its prompt (role_id, role_name or index)."""
+    def build(storage, suite_dir):
+        data = storage.suite_role(suite_dir, role)
+        if data is None:
+            raise LookupError(role)
+        return data
+    
+    try:
+        return _suite_response(name, build, 'role', role)
+    except LookupError:
+        return jsonify({'success': False, 'error': '角色不存在'}), 404
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
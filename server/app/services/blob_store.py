@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""Content-addressed store for long texts (prompt bodies, versions).
+
+A blob is keyed by the SHA-256 of its full text and stored zlib-compressed under
+config/blobs/<2 hex>/<hash>, so the same prompt saved by several suites is stored
+once. A blob can be stored as a line delta against another blob (e.g. the previous
+version of the same prompt); delta chains are capped at BLOB_MAX_DELTA_CHAIN.
+
+Suite _data.json files reference blobs as ``{"$blob": "<hash>"}`` (see pack/unpack).
+"""
+
+import os
+import json
+import zlib
+import hashlib
+import difflib
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+from typing import Any, List, Optional, Union
+
+from app.config import Config
+
+
+def log(msg: str, level: str = "INFO"):
+    """打印带时间戳的日志"""
+    timestamp = datetime.now().strftime("%H:%M:%S.%f")[:-3]
+    print(f"[{timestamp}] [Blobs] [{level}] {msg}", flush=True)
+
+
+BLOB_KEY = '$blob'
+
+# 解压后的首字节：完整文本 / 行级差量
+_FULL = b'F'
+_DELTA = b'D'
+
+
+def content_hash(text: str) -> str:
+    """Key of a text in the blob store."""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def is_blob_ref(value: Any) -> bool:
+    """True for a ``{"$blob": key}`` reference."""
+    return isinstance(value, dict) and len(value) == 1 and BLOB_KEY in value
+
+
+def _line_delta(base: str, text: str) -> List[Union[List[int], str]]:
+    """Ops rebuilding ``text`` from ``base``: [start, end] copies base lines, a string is inserted."""
+    a = base.splitlines(keepends=True)
+    b = text.splitlines(keepends=True)
+    ops: List[Union[List[int], str]] = []
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, a, b, autojunk=False).get_opcodes():
+        if tag == 'equal':
+            ops.append([i1, i2])
+        elif j2 > j1:
+            ops.append(''.join(b[j1:j2]))
+    return ops
+
+
+class BlobStore:
+    """Deduplicated, compressed text blobs with optional delta encoding."""
+
+    def __init__(self, root: Path, min_chars: Optional[int] = None, max_chain: Optional[int] = None):
+        self.root = root
+        self.min_chars = Config.BLOB_MIN_CHARS if min_chars is None else min_chars
+        self.max_chain = Config.BLOB_MAX_DELTA_CHAIN if max_chain is None else max_chain
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._cache: 'OrderedDict[str, str]' = OrderedDict()  # 最近读取的文本
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / key
+
+    def exists(self, key: str) -> bool:
+        """True if the blob is stored."""
+        return self._path(key).exists()
+
+    def put(self, text: str, base: Optional[str] = None) -> str:
+        """Store a text (no-op if already stored).
+
+        Args:
+            text: Full text
+            base: Key of a similar stored text; the new blob is saved as a delta
+                against it when that is less than half the size
+
+        Returns:
+            The blob key
+        """
+        key = content_hash(text)
+        path = self._path(key)
+        if path.exists():
+            return key
+
+        payload = _FULL + text.encode('utf-8')
+        if base and base != key:
+            depth = self._depth(base)
+            if depth is not None and depth < self.max_chain:
+                ops = _line_delta(self.get(base), text)
+                delta = json.dumps({'base': base, 'depth': depth + 1, 'ops': ops}, ensure_ascii=False).encode('utf-8')
+                if len(delta) < len(payload) // 2:
+                    payload = _DELTA + delta
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f'.{key}.{os.getpid()}.{threading.get_ident()}.tmp')
+        with open(tmp, 'wb') as f:
+            f.write(zlib.compress(payload, 6))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        return key
+
+    def get(self, key: str) -> str:
+        """Full text of a blob (deltas resolved).
+
+        Raises:
+            KeyError: If the blob (or a base in its chain) is missing
+        """
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+        kind, body = self._read(key)
+        if kind == _FULL:
+            text = body.decode('utf-8')
+        else:
+            record = json.loads(body)
+            base_lines = self.get(record['base']).splitlines(keepends=True)
+            text = ''.join(
+                op if isinstance(op, str) else ''.join(base_lines[op[0]:op[1]]) for op in record['ops']
+            )
+
+        with self._lock:
+            self._cache[key] = text
+            while len(self._cache) > Config.BLOB_CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return text
+
+    def _read(self, key: str):
+        try:
+            payload = zlib.decompress(self._path(key).read_bytes())
+        except FileNotFoundError:
+            raise KeyError(f'blob 不存在: {key}')
+        return payload[:1], payload[1:]
+
+    def _depth(self, key: str) -> Optional[int]:
+        """Delta chain length of a stored blob (0 = full text), None if missing."""
+        try:
+            kind, body = self._read(key)
+        except KeyError:
+            return None
+        return 0 if kind == _FULL else json.loads(body)['depth']
+
+    # ==================== JSON documents ====================
+
+    def pack(self, value: Any, base: Any = None) -> Any:
+        """Replace long strings in a JSON value with blob references.
+
+        Args:
+            value: JSON-compatible value
+            base: Value of the same shape (e.g. the previous version); strings at the
+                same position are used as delta bases
+        """
+        if isinstance(value, str):
+            if len(value) < self.min_chars:
+                return value
+            base_key = None
+            if isinstance(base, str) and len(base) >= self.min_chars:
+                base_key = self.put(base)
+            return {BLOB_KEY: self.put(value, base_key)}
+        if isinstance(value, dict):
+            base = base if isinstance(base, dict) else {}
+            return {k: self.pack(v, base.get(k)) for k, v in value.items()}
+        if isinstance(value, list):
+            base = base if isinstance(base, list) else []
+            return [self.pack(v, base[i] if i < len(base) else None) for i, v in enumerate(value)]
+        return value
+
+    def pack_chain(self, versions: List[Any]) -> List[Any]:
+        """Pack a list of versions, each delta-encoded against the one before it."""
+        return [self.pack(v, versions[i - 1] if i else None) for i, v in enumerate(versions)]
+
+    def unpack(self, value: Any) -> Any:
+        """Resolve blob references in a JSON value."""
+        if is_blob_ref(value):
+            return self.get(value[BLOB_KEY])
+        if isinstance(value, dict):
+            return {k: self.unpack(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self.unpack(v) for v in value]
+        return value
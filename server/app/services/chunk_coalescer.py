@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""Coalescing of streamed LLM chunks into fewer agent_output events."""
+
+import time
+import heapq
+import itertools
+import threading
+from typing import Callable, List, Optional, Tuple
+
+from app.config import Config
+
+
+class ChunkCoalescer:
+    """Buffers streamed chunks and emits them joined.
+
+    A flush happens when the buffer reaches ``max_bytes`` or ``window`` seconds after
+    the first buffered chunk, even if the model stalls and no further chunk arrives,
+    so ``window`` bounds the added latency. Call ``flush()`` when the stream ends to
+    emit the remainder.
+    """
+
+    def __init__(
+        self,
+        emit: Callable[[str], None],
+        window: Optional[float] = None,
+        max_bytes: Optional[int] = None
+    ):
+        self._emit = emit
+        self.window = Config.STREAM_COALESCE_WINDOW if window is None else window
+        self.max_bytes = Config.STREAM_COALESCE_BYTES if max_bytes is None else max_bytes
+        self._parts: List[str] = []
+        self._size = 0
+        self._started = 0.0
+        self._generation = 0  # 每次发送后递增，过期的定时刷新据此忽略
+        self._lock = threading.Lock()
+
+    def add(self, chunk: str) -> None:
+        """Buffer a chunk, flushing if the time window or byte threshold is reached."""
+        if not chunk:
+            return
+        with self._lock:
+            if not self._parts:
+                self._started = time.monotonic()
+                if self.window > 0:
+                    _flusher.schedule(self._started + self.window, self, self._generation)
+            self._parts.append(chunk)
+            self._size += len(chunk.encode('utf-8'))
+            if self._size >= self.max_bytes or time.monotonic() - self._started >= self.window:
+                self._flush_locked()
+
+    def flush(self) -> None:
+        """Emit buffered text, if any."""
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_expired(self, generation: int) -> None:
+        """Deadline flush: emit the buffer if it is still the one the deadline was set for."""
+        with self._lock:
+            if generation == self._generation:
+                self._flush_locked()
+
+    def _flush_locked(self) -> None:
+        if not self._parts:
+            return
+        text = ''.join(self._parts)
+        self._parts = []
+        self._size = 0
+        self._generation += 1
+        # 在锁内发送，定时刷新与流式线程的输出保持顺序
+        self._emit(text)
+
+
+class _DeadlineFlusher:
+    """One thread flushing the buffers of all coalescers whose window has expired."""
+
+    def __init__(self):
+        self._heap: List[Tuple[float, int, ChunkCoalescer, int]] = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def schedule(self, deadline: float, coalescer: ChunkCoalescer, generation: int) -> None:
+        with self._cond:
+            heapq.heappush(self._heap, (deadline, next(self._counter), coalescer, generation))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='chunk-flusher', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                deadline, _, coalescer, generation = self._heap[0]
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                heapq.heappop(self._heap)
+            coalescer._flush_expired(generation)
+
+
+_flusher = _DeadlineFlusher()
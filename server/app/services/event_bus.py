@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""Per-task event bus with a bounded replay log."""
+
+import asyncio
+import threading
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional
+
+from app.config import Config
+from app.models.pipeline import PipelineEvent
+
+
+class EventSubscription:
+    """A subscriber's cursor into an EventBus.
+
+    Subscribers read from the bus's shared ring buffer, so a slow subscriber costs no
+    memory: once it falls behind the buffer, the oldest events are dropped for it.
+    """
+
+    def __init__(self, bus: 'EventBus', next_seq: int):
+        self._bus = bus
+        self.next_seq = next_seq
+        self.dropped = 0  # 因落后于缓冲区而丢失的事件数
+        self.closed = False
+
+    def get(self, timeout: Optional[float] = None) -> List[PipelineEvent]:
+        """Wait for events after the cursor.
+
+        Returns:
+            New events in sequence order, empty on timeout or when closed
+        """
+        return self._bus._read(self, timeout)
+
+    @property
+    def pending(self) -> bool:
+        """True if events are waiting to be read."""
+        return self._bus.last_seq >= self.next_seq
+
+    def poll(self) -> List[PipelineEvent]:
+        """Read waiting events without blocking."""
+        return self._bus._read(self, 0)
+
+    async def get_async(self, timeout: Optional[float] = None) -> List[PipelineEvent]:
+        """Async version of get() for ASGI servers; does not block a thread while waiting."""
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while True:
+            # 先登记唤醒事件再读取，避免读取和等待之间发布的事件被错过
+            waiter = self._bus._async_waiter(loop)
+            events = self._bus._read(self, 0)
+            if events or self.closed:
+                return events
+            remaining = None if deadline is None else deadline - loop.time()
+            if remaining is not None and remaining <= 0:
+                return []
+            try:
+                await asyncio.wait_for(waiter.wait(), remaining)
+            except asyncio.TimeoutError:
+                return []
+
+    def close(self) -> None:
+        """Stop the subscription and wake up a blocked get()."""
+        self._bus._unsubscribe(self)
+
+
+class EventBus:
+    """Fan-out of pipeline events to any number of subscribers.
+
+    Every published event gets an increasing sequence ID (``PipelineEvent.seq``) and is
+    kept in a ring buffer of ``capacity`` events for replay, so a reconnecting client
+    can resume after the last ID it saw.
+    """
+
+    def __init__(self, capacity: Optional[int] = None):
+        self.capacity = capacity or Config.EVENT_BUFFER_SIZE
+        self._buffer: Deque[PipelineEvent] = deque(maxlen=self.capacity)
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._subscribers: List[EventSubscription] = []
+        # 每个事件循环共用一个 asyncio.Event，发布时每个循环只唤醒一次
+        self._async_waiters: Dict[asyncio.AbstractEventLoop, asyncio.Event] = {}
+        self._listeners: List[Callable[[PipelineEvent], None]] = []
+
+    @property
+    def last_seq(self) -> int:
+        """Sequence ID of the latest event (0 if none)."""
+        return self._seq
+
+    def publish(self, event: PipelineEvent) -> int:
+        """Append an event, assign its sequence ID and wake up subscribers.
+
+        An event that already carries a sequence ID (mirrored from another process)
+        keeps it.
+        """
+        with self._cond:
+            if event.seq > self._seq:
+                self._seq = event.seq
+            else:
+                self._seq += 1
+                event.seq = self._seq
+            self._buffer.append(event)
+            # 在锁内调用，保证监听者按序号顺序收到事件
+            for listener in self._listeners:
+                listener(event)
+            self._cond.notify_all()
+            self._wake_async_locked()
+        return event.seq
+
+    def add_listener(self, listener: Callable[[PipelineEvent], None]) -> None:
+        """Call ``listener(event)`` on every publish, in sequence order (on the publishing thread)."""
+        with self._cond:
+            self._listeners.append(listener)
+
+    def subscribe(self, last_event_id: Optional[int] = None) -> EventSubscription:
+        """Create a subscription.
+
+        Args:
+            last_event_id: Last sequence ID the client received; events after it are
+                replayed. None replays everything still buffered.
+        """
+        with self._cond:
+            # 客户端的 ID 比当前还新（例如服务重启后），从当前位置开始
+            sub = EventSubscription(self, min(last_event_id or 0, self._seq) + 1)
+            self._subscribers.append(sub)
+            return sub
+
+    def replay(self, after_seq: int = 0) -> List[PipelineEvent]:
+        """Buffered events with a sequence ID greater than ``after_seq``."""
+        with self._cond:
+            return [e for e in self._buffer if e.seq > after_seq]
+
+    def subscriber_count(self) -> int:
+        """Number of open subscriptions."""
+        with self._cond:
+            return len(self._subscribers)
+
+    def _read(self, sub: EventSubscription, timeout: Optional[float]) -> List[PipelineEvent]:
+        with self._cond:
+            self._cond.wait_for(lambda: sub.closed or self._seq >= sub.next_seq, timeout)
+            if sub.closed or not self._buffer:
+                return []
+            oldest = self._buffer[0].seq
+            if sub.next_seq < oldest:
+                # 订阅者落后于缓冲区：丢弃最旧的事件，从缓冲区开头继续
+                sub.dropped += oldest - sub.next_seq
+                sub.next_seq = oldest
+            start = sub.next_seq - oldest
+            events = [self._buffer[i] for i in range(start, len(self._buffer))]
+            sub.next_seq = self._seq + 1
+            return events
+
+    def _async_waiter(self, loop: asyncio.AbstractEventLoop) -> asyncio.Event:
+        with self._cond:
+            waiter = self._async_waiters.get(loop)
+            if waiter is None:
+                waiter = self._async_waiters[loop] = asyncio.Event()
+            return waiter
+
+    def _wake_async_locked(self) -> None:
+        waiters, self._async_waiters = self._async_waiters, {}
+        for loop, waiter in waiters.items():
+            try:
+                loop.call_soon_threadsafe(waiter.set)
+            except RuntimeError:
+                pass  # 事件循环已关闭
+
+    def _unsubscribe(self, sub: EventSubscription) -> None:
+        with self._cond:
+            sub.closed = True
+            if sub in self._subscribers:
+                self._subscribers.remove(sub)
+            self._cond.notify_all()
+            self._wake_async_locked()
+
+
+async def wait_any(
+    subscriptions: List[EventSubscription],
+    timeout: Optional[float] = None,
+    wakeup: Optional[asyncio.Event] = None
+) -> None:
+    """Wait until any of the subscriptions has events, ``wakeup`` is set or the timeout passes."""
+    loop = asyncio.get_running_loop()
+    # 先登记唤醒事件再检查，避免检查之后发布的事件被错过
+    waiters = {id(sub._bus): sub._bus._async_waiter(loop) for sub in subscriptions}
+    if any(sub.pending or sub.closed for sub in subscriptions) or (wakeup and wakeup.is_set()):
+        return
+    if wakeup:
+        waiters['wakeup'] = wakeup
+    if not waiters:
+        await asyncio.sleep(timeout or 0)
+        return
+    tasks = [asyncio.ensure_future(w.wait()) for w in waiters.values()]
+    try:
+        await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
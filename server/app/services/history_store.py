@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""SQLite-backed history store.
+
+Records live in config/history.db. An insert is a single-row INSERT, deletes are
+tombstones (a deleted flag, or for "clear all" a watermark sequence number), and
+retention is applied by a periodic prune that physically removes tombstoned and
+expired rows. SQLite's locking makes it safe for concurrent writers, also across
+worker processes. A legacy history.json is imported once on first use.
+"""
+
+import json
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from app.config import Config
+from app.models.history import HistoryRecord
+
+
+def log(msg: str, level: str = "INFO"):
+    """打印带时间戳的日志"""
+    timestamp = datetime.now().strftime("%H:%M:%S.%f")[:-3]
+    print(f"[{timestamp}] [History] [{level}] {msg}", flush=True)
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS history (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    data TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    deleted INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# 清空操作记录的水位线：序号不大于它的记录视为已删除
+_CLEARED_KEY = 'cleared_seq'
+
+
+class HistoryStore:
+    """History records with O(1) inserts, tombstone deletes and cursor pagination."""
+
+    def __init__(
+        self,
+        db_path: Path,
+        retention_count: Optional[int] = None,
+        retention_days: Optional[int] = None
+    ):
+        self.db_path = db_path
+        self.retention_count = Config.HISTORY_RETENTION_COUNT if retention_count is None else retention_count
+        self.retention_days = Config.HISTORY_RETENTION_DAYS if retention_days is None else retention_days
+        self._conn = sqlite3.connect(str(db_path), timeout=10, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+        self._inserts = 0  # 距上次清理的插入次数
+
+    def _cleared_seq_locked(self) -> int:
+        row = self._conn.execute('SELECT value FROM meta WHERE key = ?', (_CLEARED_KEY,)).fetchone()
+        return int(row[0]) if row else 0
+
+    def add(self, record: HistoryRecord) -> HistoryRecord:
+        """Insert a record. A duplicate ID (two records in the same millisecond) gets a suffix."""
+        base_id = record.id
+        with self._lock:
+            for attempt in range(100):
+                record.id = base_id if attempt == 0 else f'{base_id}-{attempt}'
+                cursor = self._conn.execute(
+                    'INSERT OR IGNORE INTO history (id, data, created_at) VALUES (?, ?, ?)',
+                    (record.id, json.dumps(record.to_dict(), ensure_ascii=False), record.created_at)
+                )
+                if cursor.rowcount:
+                    break
+            else:
+                raise ValueError(f'历史记录 ID 重复: {base_id}')
+            self._inserts += 1
+            should_prune = self._inserts >= Config.HISTORY_PRUNE_EVERY
+        if should_prune:
+            self.prune()
+        return record
+
+    def page(self, limit: int, cursor: Optional[str] = None) -> Tuple[List[HistoryRecord], Optional[str]]:
+        """Records newest first.
+
+        Args:
+            limit: Page size
+            cursor: nextCursor of the previous page, None for the first page
+
+        Returns:
+            (records, cursor of the next page or None if this is the last page)
+        """
+        try:
+            before = int(cursor) if cursor else None
+        except ValueError:
+            raise ValueError('cursor 无效')
+        with self._lock:
+            sql = 'SELECT seq, data FROM history WHERE deleted = 0 AND seq > ?'
+            params: list = [self._cleared_seq_locked()]
+            if before is not None:
+                sql += ' AND seq < ?'
+                params.append(before)
+            if self.retention_count:
+                # 与 retention_days 一样在读取时生效，不依赖下一次 prune
+                sql += (' AND seq >= COALESCE((SELECT seq FROM history WHERE deleted = 0 AND seq > ? '
+                        'ORDER BY seq DESC LIMIT 1 OFFSET ?), 0)')
+                params.extend([self._cleared_seq_locked(), self.retention_count - 1])
+            if self.retention_days:
+                sql += ' AND created_at >= ?'
+                params.append((datetime.now() - timedelta(days=self.retention_days)).isoformat())
+            rows = self._conn.execute(sql + ' ORDER BY seq DESC LIMIT ?', params + [limit + 1]).fetchall()
+
+        records = [HistoryRecord.from_dict(json.loads(data)) for _, data in rows[:limit]]
+        next_cursor = str(rows[limit - 1][0]) if len(rows) > limit and limit > 0 else None
+        return records, next_cursor
+
+    def delete(self, record_id: str) -> None:
+        """Tombstone a record."""
+        with self._lock:
+            self._conn.execute('UPDATE history SET deleted = 1 WHERE id = ?', (record_id,))
+
+    def clear(self) -> None:
+        """Tombstone every record by moving the clear watermark to the newest one."""
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO meta (key, value) '
+                'VALUES (?, (SELECT COALESCE(MAX(seq), 0) FROM history))', (_CLEARED_KEY,)
+            )
+        self.prune()
+
+    def prune(self) -> None:
+        """Physically remove tombstoned records and those outside the retention policy."""
+        with self._lock:
+            self._inserts = 0
+            self._conn.execute('BEGIN')
+            try:
+                removed = self._conn.execute(
+                    'DELETE FROM history WHERE deleted = 1 OR seq <= ?', (self._cleared_seq_locked(),)
+                ).rowcount
+                if self.retention_count:
+                    removed += self._conn.execute(
+                        'DELETE FROM history WHERE seq <= '
+                        '(SELECT seq FROM history ORDER BY seq DESC LIMIT 1 OFFSET ?)', (self.retention_count,)
+                    ).rowcount
+                if self.retention_days:
+                    cutoff = (datetime.now() - timedelta(days=self.retention_days)).isoformat()
+                    removed += self._conn.execute('DELETE FROM history WHERE created_at < ?', (cutoff,)).rowcount
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+        if removed:
+            log(f"已清理 {removed} 条历史记录")
+
+    def import_legacy(self, history_file: Path) -> None:
+        """Import a legacy history.json (newest first) once, then rename it."""
+        if not history_file.exists():
+            return
+        try:
+            records = json.loads(history_file.read_text(encoding='utf-8'))
+        except Exception as e:
+            log(f"读取旧历史文件失败: {e}", "ERROR")
+            return
+        with self._lock:
+            self._conn.execute('BEGIN')
+            try:
+                self._conn.executemany(
+                    'INSERT OR IGNORE INTO history (id, data, created_at) VALUES (?, ?, ?)',
+                    [
+                        (r.id, json.dumps(r.to_dict(), ensure_ascii=False), r.created_at)
+                        for r in (HistoryRecord.from_dict(d) for d in reversed(records) if isinstance(d, dict))
+                    ]
+                )
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+        try:
+            history_file.rename(history_file.with_name(history_file.name + '.migrated'))
+        except OSError:
+            pass  # 其他进程已导入并改名
+        log(f"已导入旧历史文件: {len(records)} 条")
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""Repair of malformed agent JSON output with a small, cheap LLM call."""
+
+import threading
+from datetime import datetime
+from typing import Optional, Dict, Any, Callable
+
+from app.services.llm_client import LLMClient
+from app.services.prompt_loader import load_prompt
+from app.utils.json_utils import parse_json_response
+
+
+def log(msg: str, level: str = "INFO"):
+    """打印带时间戳的日志"""
+    timestamp = datetime.now().strftime("%H:%M:%S.%f")[:-3]
+    print(f"[{timestamp}] [Repair] [{level}] {msg}", flush=True)
+
+
+# 各 Agent 期望的 JSON 结构（只发给修复模型，代替完整的 Agent 提示词）
+AGENT_SCHEMAS: Dict[str, str] = {
+    'analyzer': '{"system_name": str, "system_description": str, "domain": str, "target_user": str, '
+                '"use_cases": [str], "roles": [{"id": str, "name": str, "type": "core|quality|support", '
+                '"description": str, "responsibilities": [str], "inputs": [str], "outputs": [str], '
+                '"triggers": [str], "priority": int}]}',
+    'generator': '{"role_id": str, "role_name": str, "role_type": "core|quality|support", "description": str, '
+                 '"prompt": str, "input_template": str, "output_format": str, "triggers": [str]}',
+    'reviewer': '{"score": float, "strengths": [str], '
+                '"weaknesses": [{"issue": str, "severity": str, "location": str, "impact": str}], '
+                '"suggestions": [{"priority": str, "suggestion": str, "example": str}], '
+                '"verdict": str, "dimensions": object}',
+    'optimizer': '{"role_id": str, "role_name": str, "role_type": "core|quality|support", "description": str, '
+                 '"prompt": str, "input_template": str, "output_format": str, "triggers": [str]}',
+    'optimizer_patch': '{"operations": [{"op": "replace|insert_after|delete", "section": str, "content": str}], '
+                       '"input_template": str, "changes": [object]}',
+    'tester': '{"summary": {"total_tests": int, "passed": int, "failed": int, "warnings": int, '
+              '"pass_rate": float, "verdict": str}, "test_cases": [{"id": str, "category": str, "name": str, '
+              '"input": str, "expected": str, "actual": str, "status": str, "notes": str}], '
+              '"issues_found": [{"severity": str, "test_id": str, "description": str, "recommendation": str}], '
+              '"recommendations": [str]}',
+}
+
+
+class JsonRepairer:
+    """Fixes malformed agent JSON by sending only the output and schema to a fast model."""
+
+    def __init__(self, llm_client: LLMClient):
+        self.llm_client = llm_client
+        self._stats: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def repair(
+        self,
+        agent: str,
+        raw_output: str,
+        required_key: str,
+        model: str,
+        on_usage: Optional[Callable[[Dict[str, int]], None]] = None
+    ) -> Optional[Dict[str, Any]]:
+        """Try to repair an agent's malformed JSON output.
+
+        Args:
+            agent: Agent name, selects the expected schema
+            raw_output: The malformed output
+            required_key: Key the repaired object must contain
+            model: Model used for the repair call (ideally a fast, cheap one)
+            on_usage: Callback receiving the token usage of the repair call
+
+        Returns:
+            Repaired dictionary, or None if the repair failed
+        """
+        if not raw_output or not raw_output.strip():
+            return None
+
+        user_input = f"""## 期望的结构
+{AGENT_SCHEMAS.get(agent, '{}')}
+
+必须包含字段：{required_key}
+
+## 待修复的输出
+{raw_output}"""
+
+        data = None
+        try:
+            output = self.llm_client.run_agent(
+                load_prompt('repair'), user_input, model, on_stream=None, on_usage=on_usage
+            )
+            data = parse_json_response(output)
+        except Exception as e:
+            log(f"{agent} 修复调用失败: {e}", "ERROR")
+
+        success = isinstance(data, dict) and required_key in data and not data.get('_partial')
+        self._record(agent, success)
+        log(f"{agent} JSON 修复{'成功' if success else '失败'} (model={model})", "INFO" if success else "WARN")
+        return data if success else None
+
+    def _record(self, agent: str, success: bool) -> None:
+        with self._lock:
+            entry = self._stats.setdefault(agent, {'attempts': 0, 'repaired': 0})
+            entry['attempts'] += 1
+            if success:
+                entry['repaired'] += 1
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Repair attempts, successes and success rate per agent."""
+        with self._lock:
+            return {
+                agent: {**s, 'success_rate': s['repaired'] / s['attempts'] if s['attempts'] else 0.0}
+                for agent, s in self._stats.items()
+            }
+
+    def load_stats(self, stats: Optional[Dict[str, Dict[str, Any]]]) -> None:
+        """Restore counters saved with stats()."""
+        with self._lock:
+            self._stats = {
+                agent: {'attempts': s.get('attempts', 0), 'repaired': s.get('repaired', 0)}
+                for agent, s in (stats or {}).items()
+            }
@@ -1,10 +1,18 @@
 # -*- coding: utf-8 -*-
 """LLM client service for OpenAI API calls."""
 
-from typing import List, Optional, Callable, Dict, Any
+from typing import List, Optional, Callable, Dict, Any, Tuple
 from dataclasses import dataclass
 from datetime import datetime
-from openai import OpenAI
+from openai import OpenAI, BadRequestError
+
+from app.services.prompt_loader import get_language
+from app.utils.token_utils import (
+    ContextBudgetError, estimate_messages_tokens, find_model_limits, SAFETY_RATIO
+)
+
+# 已提示过“上下文上限未知”的模型
+_unknown_models = set()
 
 
 def log(msg: str, level: str = "INFO"):
@@ -20,9 +28,54 @@ class ChatMessage:
     content: str
 
 
+def extract_usage(usage: Any) -> Optional[Dict[str, int]]:
+    """Normalize a response ``usage`` block to prompt/completion/cached tokens."""
+    if usage is None:
+        return None
+    if not isinstance(usage, dict):
+        usage = usage.model_dump() if hasattr(usage, 'model_dump') else vars(usage)
+    
+    details = usage.get('prompt_tokens_details') or {}
+    cached = details.get('cached_tokens') if isinstance(details, dict) else None
+    if cached is None:
+        # Anthropic 兼容网关使用 cache_read_input_tokens
+        cached = usage.get('cache_read_input_tokens', 0)
+    
+    return {
+        'prompt_tokens': usage.get('prompt_tokens') or usage.get('input_tokens') or 0,
+        'completion_tokens': usage.get('completion_tokens') or usage.get('output_tokens') or 0,
+        'cached_tokens': cached or 0
+    }
+
+
+# 续写指令，按任务语言选择（与 prompts/{cn,en} 一致）
+CONTINUE_PROMPTS = {
+    'cn': "你的上一条回复因长度限制被截断。请从中断处直接继续输出剩余内容，不要重复已输出的部分，也不要添加任何说明。",
+    'en': ("Your previous reply was cut off by the length limit. Continue exactly where it stopped, "
+           "without repeating anything already written and without adding any explanation."),
+}
+
+
+def stitch_continuation(previous: str, continuation: str, min_overlap: int = 16, max_overlap: int = 200) -> str:
+    """Append a continuation, dropping text the model repeated from the end of the previous part.
+    
+    The shortest matching overlap wins, so ambiguous (repetitive) text is kept rather than lost.
+    """
+    limit = min(len(previous), len(continuation), max_overlap)
+    for k in range(min_overlap, limit + 1):
+        if previous.endswith(continuation[:k]):
+            return previous + continuation[k:]
+    return previous + continuation
+
+
 class LLMClient:
     """Client for LLM API calls."""
     
+    # 输出被截断时最多续写的次数
+    MAX_CONTINUATIONS = 3
+    # 'max_tokens' 为 Anthropic 兼容网关返回的截断原因
+    TRUNCATED_FINISH_REASONS = ('length', 'max_tokens')
+    
     def __init__(self, api_key: str, base_url: str = "https://api.openai.com"):
         """Initialize LLM client.
         
@@ -44,6 +97,7 @@ class LLMClient:
         )
         self.api_key = api_key
         self.base_url = base_url
+        self._stream_usage_supported = True  # 部分兼容网关不支持 stream_options
         log(f"LLMClient 初始化: base_url={base_url}, api_key={api_key[:10] if api_key else 'None'}...")
     
     def chat(
@@ -52,7 +106,8 @@ class LLMClient:
         model: str,
         stream: bool = False,
         max_tokens: Optional[int] = None,
-        on_stream: Optional[Callable[[str], None]] = None
+        on_stream: Optional[Callable[[str], None]] = None,
+        on_usage: Optional[Callable[[Dict[str, int]], None]] = None
     ) -> str:
         """Call LLM chat API.
         
@@ -62,19 +117,58 @@ class LLMClient:
             stream: Whether to stream response
             max_tokens: Maximum tokens in response
             on_stream: Callback for streaming chunks
+            on_usage: Callback receiving the token usage of the call
             
         Returns:
-            Complete response content
+            Complete response content, stitched from continuation requests
+            if the output hit the length limit
         """
         msg_dicts = [{"role": m.role, "content": m.content} for m in messages]
+        content, finish_reason = self._chat_once(msg_dicts, model, stream, max_tokens, on_stream, on_usage)
         
+        # 输出被截断时续写，保留已生成的内容而不是整体重跑
+        continuations = 0
+        while finish_reason in self.TRUNCATED_FINISH_REASONS and continuations < self.MAX_CONTINUATIONS:
+            continuations += 1
+            log(f"输出因长度限制被截断 ({len(content)} 字符)，第 {continuations} 次续写...", "WARN")
+            followup = msg_dicts + [
+                {"role": "assistant", "content": content},
+                {"role": "user", "content": CONTINUE_PROMPTS.get(get_language(), CONTINUE_PROMPTS['cn'])}
+            ]
+            try:
+                part, finish_reason = self._chat_once(followup, model, stream, max_tokens, on_stream, on_usage)
+            except Exception as e:
+                log(f"续写失败，返回已生成的部分: {e}", "WARN")
+                break
+            content = stitch_continuation(content, part)
+        
+        if finish_reason in self.TRUNCATED_FINISH_REASONS:
+            log(f"续写 {continuations} 次后输出仍被截断 ({len(content)} 字符)", "WARN")
+        return content
+    
+    def _chat_once(
+        self,
+        msg_dicts: List[Dict[str, str]],
+        model: str,
+        stream: bool,
+        max_tokens: Optional[int],
+        on_stream: Optional[Callable[[str], None]],
+        on_usage: Optional[Callable[[Dict[str, int]], None]]
+    ) -> Tuple[str, Optional[str]]:
+        """Send a single chat completion request.
+        
+        Returns:
+            (content, finish_reason)
+        """
         # 打印完整的请求 URL
         request_url = f"{self.base_url}/chat/completions"
         log(f"请求 URL: {request_url}")
-        log(f"调用 API: model={model}, stream={stream}, messages={len(messages)}条")
+        log(f"调用 API: model={model}, stream={stream}, messages={len(msg_dicts)}条")
         log(f"  api_key: {self.api_key[:15] if self.api_key else 'None'}...")
-        log(f"  system prompt 长度: {len(messages[0].content) if messages else 0}")
-        log(f"  user message 长度: {len(messages[1].content) if len(messages) > 1 else 0}")
+        log(f"  system prompt 长度: {len(msg_dicts[0]['content']) if msg_dicts else 0}")
+        log(f"  user message 长度: {len(msg_dicts[-1]['content']) if len(msg_dicts) > 1 else 0}")
+        
+        max_tokens = self._preflight(msg_dicts, model, max_tokens)
         
         kwargs: Dict[str, Any] = {
             "model": model,
@@ -84,10 +178,22 @@ class LLMClient:
         if max_tokens:
             kwargs["max_tokens"] = max_tokens
 
+        usage = None
+        finish_reason = None
         try:
             if stream:
                 log(f"开始流式请求...")
-                response = self.client.chat.completions.create(**kwargs)
+                if self._stream_usage_supported:
+                    kwargs["stream_options"] = {"include_usage": True}
+                try:
+                    response = self.client.chat.completions.create(**kwargs)
+                except BadRequestError:
+                    if "stream_options" not in kwargs:
+                        raise
+                    log("网关不支持 stream_options，关闭流式 usage 统计", "WARN")
+                    self._stream_usage_supported = False
+                    kwargs.pop("stream_options")
+                    response = self.client.chat.completions.create(**kwargs)
                 full_content = ""
                 chunk_count = 0
                 
@@ -102,7 +208,12 @@ class LLMClient:
                                 on_stream(chunk)
                             continue
                         
+                        # include_usage 时最后一个 chunk 携带 usage（choices 为空）
+                        if getattr(chunk, 'usage', None):
+                            usage = extract_usage(chunk.usage)
+                        
                         if hasattr(chunk, 'choices') and chunk.choices and len(chunk.choices) > 0:
+                            finish_reason = getattr(chunk.choices[0], 'finish_reason', None) or finish_reason
                             delta = chunk.choices[0].delta
                             content = ""
                             if hasattr(delta, 'content') and delta.content:
@@ -129,6 +240,7 @@ class LLMClient:
                 if not full_content:
                     log("流式响应为空，尝试同步请求...", "WARN")
                     kwargs["stream"] = False
+                    kwargs.pop("stream_options", None)
                     response = self.client.chat.completions.create(**kwargs)
                     log(f"同步响应类型: {type(response)}")
                     
@@ -139,13 +251,16 @@ class LLMClient:
                     elif hasattr(response, 'choices') and response.choices and len(response.choices) > 0:
                         msg = response.choices[0].message
                         full_content = msg.content or ""
+                        finish_reason = getattr(response.choices[0], 'finish_reason', None)
+                        usage = extract_usage(getattr(response, 'usage', None))
                         log(f"同步请求获取到: {len(full_content)} 字符")
                     else:
                         # 尝试其他方式获取内容
                         log(f"未知响应格式，尝试转换...")
                         full_content = str(response)
                 
-                return full_content
+                self._report_usage(usage, on_usage)
+                return full_content, finish_reason
             else:
                 log(f"开始同步请求...")
                 response = self.client.chat.completions.create(**kwargs)
@@ -156,24 +271,71 @@ class LLMClient:
                     content = response
                 elif hasattr(response, 'choices') and response.choices and len(response.choices) > 0:
                     content = response.choices[0].message.content or ""
+                    finish_reason = getattr(response.choices[0], 'finish_reason', None)
+                    usage = extract_usage(getattr(response, 'usage', None))
                 else:
                     content = str(response)
                     
                 log(f"同步请求完成: {len(content)} 字符")
-                return content
+                self._report_usage(usage, on_usage)
+                return content, finish_reason
         except Exception as e:
             log(f"API 调用失败: {type(e).__name__}: {e}", "ERROR")
             import traceback
             traceback.print_exc()
             raise
     
+    def _preflight(self, msg_dicts: List[Dict[str, str]], model: str, max_tokens: Optional[int]) -> Optional[int]:
+        """Check the estimated input against the model limits before sending.
+        
+        Returns the max_tokens to use; raises ContextBudgetError if the input
+        alone cannot fit the context window. Models with unknown limits are sent
+        unchanged (limits can be configured with MODEL_LIMITS).
+        """
+        limits = find_model_limits(model)
+        if limits is None:
+            if model not in _unknown_models:
+                _unknown_models.add(model)
+                log(f"模型 {model} 的上下文上限未知，不做预检（可通过 MODEL_LIMITS 配置）", "WARN")
+            return max_tokens
+        input_tokens = estimate_messages_tokens(msg_dicts)
+        usable = int(limits.context_window * SAFETY_RATIO)
+        log(f"  预估输入 tokens: {input_tokens} (上下文 {limits.context_window}, 最大输出 {limits.max_output})")
+        
+        if input_tokens >= usable:
+            log(f"预估输入 {input_tokens} tokens 超出模型 {model} 上下文窗口，跳过调用", "ERROR")
+            raise ContextBudgetError(f"输入过长: 预估 {input_tokens} tokens，模型上下文 {limits.context_window}")
+        
+        output_room = usable - input_tokens
+        requested = max_tokens or limits.max_output
+        if requested > output_room:
+            log(f"输出空间不足: 请求 {requested}，剩余 {output_room}，max_tokens 调整为 {output_room}", "WARN")
+            return output_room
+        return max_tokens
+    
+    def _report_usage(
+        self,
+        usage: Optional[Dict[str, int]],
+        on_usage: Optional[Callable[[Dict[str, int]], None]]
+    ) -> None:
+        """Log usage and hand it to the caller's callback."""
+        if not usage:
+            return
+        log(f"  token 用量: prompt={usage['prompt_tokens']}, completion={usage['completion_tokens']}, cached={usage['cached_tokens']}")
+        if on_usage:
+            try:
+                on_usage(usage)
+            except Exception as e:
+                log(f"  记录 token 用量失败: {e}", "WARN")
+    
     def run_agent(
         self,
         system_prompt: str,
         user_message: str,
         model: str,
         on_stream: Optional[Callable[[str], None]] = None,
-        max_tokens: Optional[int] = None
+        max_tokens: Optional[int] = None,
+        on_usage: Optional[Callable[[Dict[str, int]], None]] = None
     ) -> str:
         """Run an agent with system prompt and user message.
         
@@ -183,6 +345,7 @@ class LLMClient:
             model: Model name
             on_stream: Callback for streaming chunks
             max_tokens: Maximum tokens in response
+            on_usage: Callback receiving the token usage of the call
             
         Returns:
             Agent response
@@ -196,7 +359,8 @@ class LLMClient:
             model=model,
             stream=on_stream is not None,
             max_tokens=max_tokens,
-            on_stream=on_stream
+            on_stream=on_stream,
+            on_usage=on_usage
         )
 
 
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""Registry of in-process pipelines with eviction of finished ones."""
+
+import time
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Optional, Set, Tuple
+
+from app.config import Config
+from app.services.pipeline_service import PipelineService
+from app.services.storage_service import get_storage_service
+from app.services.task_broker import get_task_broker
+from app.services.usage_ledger import usage_from_progress
+
+
+def log(msg: str, level: str = "INFO"):
+    """打印带时间戳的日志"""
+    timestamp = datetime.now().strftime("%H:%M:%S.%f")[:-3]
+    print(f"[{timestamp}] [Registry] [{level}] {msg}", flush=True)
+
+
+class PipelineRegistry:
+    """Keeps running pipelines in memory and finished ones only for a while.
+
+    A finished pipeline is written to an on-disk snapshot right away. It stays in
+    memory for ``ttl`` seconds (so late SSE clients can still replay its events) and
+    at most ``max_finished`` finished pipelines are kept, least recently used first out.
+
+    Tasks running in other worker processes are reached through the task broker
+    (see ``lookup``).
+    """
+
+    def __init__(self, ttl: Optional[float] = None, max_finished: Optional[int] = None):
+        self.ttl = Config.PIPELINE_TTL_SECONDS if ttl is None else ttl
+        self.max_finished = Config.PIPELINE_MAX_FINISHED if max_finished is None else max_finished
+        self._running: Dict[str, PipelineService] = {}
+        self._finished: 'OrderedDict[str, tuple]' = OrderedDict()  # task_id -> (pipeline, finished_at)
+        self._claimed: Set[str] = set()  # 已预留、尚未注册的任务
+        self._lock = threading.Lock()
+
+    def claim(self, task_id: str) -> bool:
+        """Reserve a task ID before running it again (recovery).
+        
+        Returns:
+            False if the task is already running in this or another worker process
+        """
+        with self._lock:
+            if task_id in self._running or task_id in self._claimed:
+                return False
+            self._claimed.add(task_id)
+        broker = get_task_broker()
+        if broker and not broker.claim(task_id):
+            with self._lock:
+                self._claimed.discard(task_id)
+            return False
+        return True
+    
+    def release(self, task_id: str) -> None:
+        """Give up a claim whose pipeline was never registered."""
+        with self._lock:
+            self._claimed.discard(task_id)
+        broker = get_task_broker()
+        if broker:
+            broker.release(task_id)
+    
+    def register(self, task_id: str, pipeline: PipelineService) -> None:
+        """Add a running pipeline."""
+        with self._lock:
+            self._claimed.discard(task_id)
+            self._finished.pop(task_id, None)
+            self._running[task_id] = pipeline
+            self._evict_locked()
+
+        broker = get_task_broker()
+        if broker:
+            try:
+                broker.attach(task_id, pipeline)
+            except Exception as e:
+                log(f"注册到任务代理失败: {task_id}: {e}", "ERROR")
+
+    def get(self, task_id: str) -> Optional[PipelineService]:
+        """Get an in-memory pipeline (running or recently finished)."""
+        with self._lock:
+            self._evict_locked()
+            if task_id in self._running:
+                return self._running[task_id]
+            entry = self._finished.get(task_id)
+            if entry:
+                self._finished.move_to_end(task_id)
+                return entry[0]
+            return None
+
+    def lookup(self, task_id: str):
+        """Get a pipeline of this process, or a proxy for one running in another worker."""
+        pipeline = self.get(task_id)
+        if pipeline:
+            return pipeline
+        broker = get_task_broker()
+        return broker.get_remote(task_id) if broker else None
+
+    def finish(self, task_id: str) -> None:
+        """Mark a pipeline finished and save its snapshot to disk."""
+        with self._lock:
+            pipeline = self._running.pop(task_id, None)
+        if not pipeline:
+            return
+
+        try:
+            # 用量保存完整账本（含每次调用的记录），任务移出内存后 /usage 仍可查询
+            get_storage_service().save_task_snapshot(task_id, {
+                **pipeline.status_snapshot(),
+                'usage': pipeline.usage.to_dict(),
+                'state': pipeline.state_snapshot(),
+                'finishedAt': datetime.now().isoformat()
+            })
+        except Exception as e:
+            log(f"保存任务快照失败: {task_id}: {e}", "ERROR")
+
+        # 快照写入后再通知其他进程，它们改为从快照读取
+        broker = get_task_broker()
+        if broker:
+            broker.detach(task_id)
+
+        with self._lock:
+            self._finished[task_id] = (pipeline, time.monotonic())
+            self._evict_locked()
+
+    def get_snapshot(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """Status of a task: live from memory, otherwise from its on-disk snapshot."""
+        pipeline = self.lookup(task_id)
+        if pipeline:
+            return pipeline.status_snapshot()
+        snapshot = get_storage_service().load_task_snapshot(task_id)
+        if snapshot:
+            snapshot.pop('state', None)
+            # 状态中只返回用量汇总，逐次调用的记录由 /usage 提供
+            (snapshot.get('usage') or {}).pop('records', None)
+            (snapshot.get('usage') or {}).pop('task_id', None)
+        return snapshot
+
+    def get_usage(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """Usage ledger of a task with its per-call records and JSON repair stats.
+
+        Comes from the pipeline of this or another worker while it is known, otherwise
+        from the task's journal (interrupted tasks) or its finished snapshot.
+        """
+        pipeline = self.lookup(task_id)
+        usage = pipeline.usage_snapshot() if pipeline else None
+        if usage:
+            return usage
+        storage = get_storage_service()
+        usage = usage_from_progress(storage.load_task_progress(task_id), task_id)
+        if usage:
+            return usage
+        snapshot = storage.load_task_snapshot(task_id)
+        if snapshot and snapshot.get('usage'):
+            return {
+                'task_id': task_id,
+                'records': [],  # 旧版本的快照只保存了汇总
+                **snapshot['usage'],
+                'json_repair': snapshot.get('json_repair', {})
+            }
+        return None
+
+    def get_state(self, task_id: str) -> Tuple[Optional[Any], Optional[Dict[str, Any]]]:
+        """Serialized state of a task.
+
+        Returns:
+            (live pipeline or None, state dict or None); the state of an evicted
+            task comes from its on-disk snapshot
+        """
+        pipeline = self.lookup(task_id)
+        if pipeline:
+            return pipeline, pipeline.state_snapshot()
+        snapshot = get_storage_service().load_task_snapshot(task_id)
+        return None, (snapshot or {}).get('state')
+
+    def stats(self) -> Dict[str, int]:
+        """Number of running and finished in-memory pipelines."""
+        with self._lock:
+            return {'running': len(self._running), 'finished': len(self._finished)}
+
+    def _evict_locked(self) -> None:
+        now = time.monotonic()
+        expired = [tid for tid, (_, finished_at) in self._finished.items() if now - finished_at > self.ttl]
+        overflow = max(0, len(self._finished) - len(expired) - self.max_finished)
+        expired += [tid for tid in self._finished if tid not in expired][:overflow]
+        for task_id in expired:
+            pipeline, _ = self._finished.pop(task_id)
+            pipeline.shutdown()
+        if expired:
+            log(f"已从内存移除 {len(expired)} 个已结束的流水线")
+
+
+# Global instance
+_registry: Optional[PipelineRegistry] = None
+
+
+def get_pipeline_registry() -> PipelineRegistry:
+    """Get the global pipeline registry instance."""
+    global _registry
+    if _registry is None:
+        _registry = PipelineRegistry()
+    return _registry
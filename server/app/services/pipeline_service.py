@@ -4,8 +4,8 @@
 import uuid
 import asyncio
 import threading
+from dataclasses import asdict
 from pathlib import Path
-from queue import Queue
 from typing import Optional, List, Dict, Any, Callable
 from datetime import datetime
 from concurrent.futures import ThreadPoolExecutor
@@ -14,12 +14,19 @@ from app.config import Config
 from app.models.pipeline import (
     PipelineState, PipelineEvent, SystemArchitecture, SystemRole,
     RolePrompt, RoleProcessState, ReviewResult, TestResult, PromptSuite,
-    WeaknessItem, SuggestionItem
+    WeaknessItem, SuggestionItem, WorkflowInfo, WorkflowStep
 )
 from app.services.llm_client import LLMClient
-from app.services.prompt_loader import load_prompt
+from app.services.chunk_coalescer import ChunkCoalescer
+from app.services.event_bus import EventBus
+from app.services.json_repair import JsonRepairer
+from app.services.prompt_loader import get_language, load_prompt
+from app.services.result_writer import WriteTicket
 from app.services.storage_service import get_storage_service
+from app.services.usage_ledger import UsageLedger
 from app.utils.json_utils import parse_json_response
+from app.utils.token_utils import ContextBudgetError, ContextSection, fit_sections, input_budget
+from app.utils.prompt_patch import apply_patch, list_section_names, PatchError
 
 
 def log(msg: str, level: str = "INFO"):
@@ -34,20 +41,37 @@ class PipelineService:
     MAX_ITERATIONS = Config.MAX_ITERATIONS
     PASS_SCORE = Config.PASS_SCORE
     DEFAULT_MAX_PARALLEL = Config.DEFAULT_MAX_PARALLEL
+    GENERATOR_CONTEXT_MAX_TOKENS = Config.GENERATOR_CONTEXT_MAX_TOKENS
+    OPTIMIZER_MODE = Config.OPTIMIZER_MODE
     
-    def __init__(self, llm_client: LLMClient, use_stream: bool = True, max_parallel: int = None):
+    def __init__(
+        self,
+        llm_client: LLMClient,
+        use_stream: bool = True,
+        max_parallel: int = None,
+        repair_model: Optional[str] = None
+    ):
         self.llm_client = llm_client
         self.use_stream = use_stream
         self.state: Optional[PipelineState] = None
-        self.event_queue: Queue = Queue()
+        self.events = EventBus()  # 事件总线，支持多订阅者与断线回放
         self._paused = False
         self._cancelled = False
         self._max_parallel = max_parallel or self.DEFAULT_MAX_PARALLEL
         self._executor = ThreadPoolExecutor(max_workers=self._max_parallel)
         self._storage = get_storage_service()
         self._completed_prompts: Dict[int, RolePrompt] = {}  # 已完成的角色结果缓存
+        self._role_steps: Dict[int, List[Dict[str, Any]]] = {}  # 未完成角色的步骤检查点（恢复用）
         self._lock = threading.Lock()  # 线程锁，保护并发写入
         self._task_dir: Optional[Path] = None  # 任务结果目录
+        self._result_writes: List[WriteTicket] = []  # 本任务排队的结果文件写入，完成前等待落盘
+        self.usage = UsageLedger()  # token 用量账本
+        self._usage_saved = 0  # 已写入进度文件的用量记录数
+        self._repairer = JsonRepairer(llm_client)  # 损坏 JSON 的低成本修复
+        self._repair_model = repair_model
+        self._version = 0  # 状态版本号，状态变化时递增（/state 的 ETag）
+        self.run_id = uuid.uuid4().hex[:12]  # 本次运行的标识：恢复或重建后版本号从 0 开始，用它区分
+        self._version_cond = threading.Condition()
         log(f"PipelineService 初始化完成, use_stream={use_stream}, max_parallel={self._max_parallel}")
     
     def _emit_event(self, event_type: str, data: Dict[str, Any] = None) -> None:
@@ -57,7 +81,84 @@ class PipelineService:
             data=data or {},
             timestamp=datetime.now().isoformat()
         )
-        self.event_queue.put(event)
+        # 输出片段不改变状态，不递增版本
+        if event_type != 'agent_output':
+            self._touch()
+        self.events.publish(event)
+    
+    def _touch(self) -> None:
+        """Bump the state version and wake up long-polling readers."""
+        with self._version_cond:
+            self._version += 1
+            self._version_cond.notify_all()
+    
+    @property
+    def version(self) -> int:
+        """State version, increases whenever the pipeline state changes."""
+        return self._version
+    
+    def wait_for_change(self, version: int, timeout: float) -> int:
+        """Block until the state version differs from ``version`` or the timeout passes.
+        
+        Returns:
+            The current version
+        """
+        with self._version_cond:
+            self._version_cond.wait_for(lambda: self._version != version, timeout)
+            return self._version
+    
+    def repair_stats(self) -> Dict[str, Dict[str, Any]]:
+        """JSON repair attempts, successes and success rate per agent."""
+        return self._repairer.stats()
+    
+    def usage_snapshot(self) -> Dict[str, Any]:
+        """Token usage ledger with its per-call records and the JSON repair stats (for /usage)."""
+        return {**self.usage.to_dict(), 'json_repair': self._repairer.stats()}
+    
+    def _llm_call_failed(self, agent: str, error: Exception, role_index: Optional[int] = None, prefix: str = '') -> None:
+        """Log a failed agent call; a call skipped for exceeding the context budget is reported as such."""
+        if isinstance(error, ContextBudgetError):
+            log(f"{prefix}输入超出模型上下文，已跳过 LLM 调用: {error}", "ERROR")
+            self._emit_event('context_budget_exceeded', {'agent': agent, 'roleIndex': role_index, 'error': str(error)})
+        else:
+            log(f"{prefix}LLM 调用失败: {error}", "ERROR")
+    
+    def _usage_recorder(
+        self,
+        agent: str,
+        role_index: Optional[int] = None,
+        iteration: Optional[int] = None
+    ) -> Callable[[Dict[str, int]], None]:
+        """Build an on_usage callback tagging usage with agent/role/iteration."""
+        def record(usage: Dict[str, int]) -> None:
+            self.usage.record(
+                agent, usage,
+                model=self.state.model if self.state else '',
+                role_index=role_index,
+                iteration=iteration
+            )
+        return record
+    
+    def _parse_agent_json(
+        self,
+        agent: str,
+        output: str,
+        required_key: str,
+        role_index: Optional[int] = None,
+        iteration: Optional[int] = None
+    ) -> Optional[Dict[str, Any]]:
+        """Parse an agent's JSON output, falling back to a cheap repair call if it is malformed."""
+        data = parse_json_response(output)
+        if isinstance(data, dict) and required_key in data:
+            return data
+        
+        log(f"  [{agent}] JSON 解析失败或缺少 {required_key} 字段，尝试修复...", "WARN")
+        repaired = self._repairer.repair(
+            agent, output, required_key,
+            model=self._repair_model or self.state.model,
+            on_usage=self._usage_recorder('repair', role_index, iteration)
+        )
+        return repaired or data
     
     def _check_cancelled(self) -> bool:
         """Check if pipeline is cancelled."""
@@ -70,7 +171,7 @@ class PipelineService:
         return not self._cancelled
     
     def _save_progress(self) -> None:
-        """Save current pipeline progress for recovery."""
+        """Save a full progress snapshot for recovery."""
         if not self.state:
             return
         
@@ -86,11 +187,27 @@ class PipelineService:
             'role_results': {
                 str(idx): self._serialize_role_prompt(prompt)
                 for idx, prompt in self._completed_prompts.items()
-            }
+            },
+            'usage': self.usage.to_dict(),
+            'json_repair': self._repairer.stats()
         }
         self._storage.save_task_progress(self.state.task_id, progress)
+        self._usage_saved = len(progress['usage']['records'])
         log(f"进度已保存: {len(self._completed_prompts)}/{progress['total_roles']} 角色完成")
     
+    def _checkpoint(self, ops: List[Dict[str, Any]]) -> None:
+        """Append a checkpoint to the task journal, with usage recorded since the last one."""
+        if not self.state:
+            return
+        records = self.usage.records()
+        ops = ops + [
+            {'op': 'append', 'path': ['usage', 'records'], 'value': r.to_dict()}
+            for r in records[self._usage_saved:]
+        ]
+        ops.append({'op': 'put', 'path': ['json_repair'], 'value': self._repairer.stats()})
+        self._storage.append_task_progress(self.state.task_id, ops)
+        self._usage_saved = len(records)
+    
     def _serialize_architecture(self) -> Dict[str, Any]:
         """Serialize SystemArchitecture to dict."""
         arch = self.state.system_architecture
@@ -109,9 +226,28 @@ class PipelineService:
                     'inputs': r.inputs, 'outputs': r.outputs, 'triggers': r.triggers, 'priority': r.priority
                 }
                 for r in arch.roles
-            ]
+            ],
+            'workflow': {
+                'description': arch.workflow.description,
+                'steps': [
+                    {'step': s.step, 'role': s.role, 'action': s.action, 'next': s.next, 'condition': s.condition}
+                    for s in arch.workflow.steps
+                ]
+            } if arch.workflow else None
         }
     
+    def _parse_workflow(self, data: Optional[Dict[str, Any]]) -> Optional[WorkflowInfo]:
+        """Parse workflow dict from Analyzer output or saved progress."""
+        if not isinstance(data, dict):
+            return None
+        step_fields = {'step', 'role', 'action', 'next', 'condition'}
+        steps = [
+            WorkflowStep(**{k: v for k, v in s.items() if k in step_fields})
+            for s in data.get('steps', [])
+            if isinstance(s, dict) and {'step', 'role', 'action'} <= s.keys()
+        ]
+        return WorkflowInfo(description=data.get('description', ''), steps=steps)
+    
     def _serialize_role_prompt(self, prompt: RolePrompt) -> Dict[str, Any]:
         """Serialize RolePrompt to dict."""
         return {
@@ -171,26 +307,34 @@ class PipelineService:
     def _save_role_result(self, role_index: int, role_prompt: RolePrompt) -> None:
         """Save individual role result immediately after completion (线程安全).
         
-        立即将角色提示词写入 md 文件，同时更新进度文件用于断点恢复。
+        在进度日志中追加一条检查点用于断点恢复，角色提示词 md 文件由后台写线程写入。
         """
         with self._lock:
             self._completed_prompts[role_index] = role_prompt
-            self._save_progress()
-            
-            # 立即写入 md 文件到结果目录
-            if self._task_dir and self.state:
-                try:
-                    filename = self._storage.save_role_prompt_md(
-                        task_dir=self._task_dir,
-                        role_index=role_index,
-                        role_name=role_prompt.role_name,
-                        role_type=role_prompt.role_type,
-                        description=role_prompt.description,
-                        prompt_content=role_prompt.prompt  # 直接使用干净的 prompt 内容
-                    )
-                    log(f"  角色 {role_prompt.role_name} 已保存到: {self._task_dir / filename}")
-                except Exception as e:
-                    log(f"  保存角色 md 文件失败: {e}", "ERROR")
+            self._checkpoint([
+                {'op': 'put', 'path': ['role_results', str(role_index)],
+                 'value': self._serialize_role_prompt(role_prompt)},
+                # 角色已完成，清掉中间步骤
+                {'op': 'put', 'path': ['role_steps', str(role_index)], 'value': []}
+            ])
+            log(f"进度已保存: {len(self._completed_prompts)}/{len(self.state.role_states)} 角色完成")
+        
+        # md 文件交给后台写线程，不占用锁也不阻塞角色处理
+        if self._task_dir and self.state:
+            try:
+                ticket = self._storage.save_role_prompt_md(
+                    task_dir=self._task_dir,
+                    role_index=role_index,
+                    role_name=role_prompt.role_name,
+                    role_type=role_prompt.role_type,
+                    description=role_prompt.description,
+                    prompt_content=role_prompt.prompt  # 直接使用干净的 prompt 内容
+                )
+                with self._lock:
+                    self._result_writes.append(ticket)
+                log(f"  角色 {role_prompt.role_name} 已加入写入队列: {ticket.path}")
+            except Exception as e:
+                log(f"  保存角色 md 文件失败: {e}", "ERROR")
         
         self._emit_event('role_saved', {'roleIndex': role_index, 'roleName': role_prompt.role_name})
     
@@ -212,6 +356,9 @@ class PipelineService:
             model=progress.get('model', ''),
             current_step=progress.get('current_step', 0)
         )
+        self.usage = UsageLedger.from_dict(progress.get('usage'), task_id)
+        self._repairer.load_stats(progress.get('json_repair'))
+        self._usage_saved = len(self.usage.records())
         
         # Restore architecture
         arch_data = progress.get('system_architecture')
@@ -224,7 +371,8 @@ class PipelineService:
                 domain=arch_data.get('domain', ''),
                 target_user=arch_data.get('target_user', ''),
                 use_cases=arch_data.get('use_cases', []),
-                roles=roles
+                roles=roles,
+                workflow=self._parse_workflow(arch_data.get('workflow'))
             )
             # Initialize role states
             self.state.role_states = [
@@ -239,8 +387,16 @@ class PipelineService:
             self._completed_prompts[idx] = RolePrompt(**prompt_data)
             if self.state.role_states and idx < len(self.state.role_states):
                 self.state.role_states[idx].status = 'completed'
+                self.state.role_states[idx].prompt = self._completed_prompts[idx].prompt
+        
+        # Restore step checkpoints of unfinished roles
+        self._role_steps = {
+            int(idx_str): steps
+            for idx_str, steps in (progress.get('role_steps') or {}).items()
+            if steps and int(idx_str) not in self._completed_prompts
+        }
         
-        log(f"已恢复 {len(self._completed_prompts)} 个已完成的角色")
+        log(f"已恢复 {len(self._completed_prompts)} 个已完成的角色, {len(self._role_steps)} 个角色有中间检查点")
         return True
     
     def get_pending_role_indices(self) -> List[int]:
@@ -267,6 +423,7 @@ class PipelineService:
         )
         self._paused = False
         self._cancelled = False
+        self.usage = UsageLedger(task_id)
         
         # 创建任务结果目录（用于立即保存每个角色的 md 文件）
         self._task_dir = self._storage.get_or_create_task_dir(description, task_id)
@@ -300,6 +457,76 @@ class PipelineService:
             self.state.status = 'cancelled'
         self._emit_event('pipeline_cancelled')
     
+    def status_snapshot(self, event_limit: int = 200) -> Dict[str, Any]:
+        """Compact view of the pipeline state for status queries and finished-task snapshots.
+        
+        Args:
+            event_limit: Max number of buffered events to include (agent_output is skipped)
+        """
+        state = self.state
+        events = [
+            {'seq': e.seq, 'type': e.type, 'data': e.data, 'timestamp': e.timestamp}
+            for e in self.events.replay() if e.type != 'agent_output'
+        ][-event_limit:] if event_limit else []
+        return {
+            'taskId': state.task_id if state else None,
+            'status': state.status if state else 'idle',
+            'error': state.error if state else None,
+            'currentStep': state.current_step if state else 0,
+            'description': state.description if state else '',
+            'model': state.model if state else '',
+            'systemName': state.system_architecture.system_name if state and state.system_architecture else '',
+            'roles': [
+                {
+                    'roleId': rs.role_id,
+                    'roleName': rs.role_name,
+                    'roleType': rs.role_type,
+                    'status': rs.status,
+                    'iterations': rs.iterations,
+                    'score': rs.review.score if rs.review else None
+                }
+                for rs in (state.role_states if state else [])
+            ],
+            'folder': self._storage.suite_name(self._task_dir) if self._task_dir else None,
+            'lastEventId': self.events.last_seq,
+            'events': events,
+            'usage': self.usage.summary(),
+            'json_repair': self._repairer.stats()
+        }
+    
+    def state_snapshot(self) -> Dict[str, Any]:
+        """Compact serialized state with role statuses, scores and current prompts (for /state)."""
+        state = self.state
+        return {
+            'version': self._version,
+            'runId': self.run_id,
+            'taskId': state.task_id if state else None,
+            'status': state.status if state else 'idle',
+            'error': state.error if state else None,
+            'currentStep': state.current_step if state else 0,
+            'description': state.description if state else '',
+            'promptType': state.prompt_type if state else '',
+            'model': state.model if state else '',
+            'systemName': state.system_architecture.system_name if state and state.system_architecture else '',
+            'roles': [
+                {
+                    'roleId': rs.role_id,
+                    'roleName': rs.role_name,
+                    'roleType': rs.role_type,
+                    'status': rs.status,
+                    'iterations': rs.iterations,
+                    'score': rs.review.score if rs.review else None,
+                    'prompt': rs.prompt
+                }
+                for rs in (state.role_states if state else [])
+            ],
+            'folder': self._storage.suite_name(self._task_dir) if self._task_dir else None
+        }
+    
+    def shutdown(self) -> None:
+        """Release the worker pool of a finished pipeline."""
+        self._executor.shutdown(wait=False)
+    
     def run_analyzer(self, on_output: Optional[Callable[[str], None]] = None) -> Optional[SystemArchitecture]:
         """Run the Analyzer agent."""
         if not self.state:
@@ -324,6 +551,9 @@ class PipelineService:
         chunk_count = 0
         
         if self.use_stream:
+            coalescer = ChunkCoalescer(
+                lambda text: self._emit_event('agent_output', {'agent': 'analyzer', 'chunk': text})
+            )
             def stream_handler(chunk: str):
                 nonlocal output, chunk_count
                 output += chunk
@@ -332,29 +562,33 @@ class PipelineService:
                     log(f"Analyzer 已接收 {chunk_count} 个 chunks，输出长度: {len(output)}")
                 if on_output:
                     on_output(chunk)
-                self._emit_event('agent_output', {'agent': 'analyzer', 'chunk': chunk})
+                coalescer.add(chunk)
             
             log(f"开始调用 LLM (流式, 模型: {self.state.model})...")
             try:
-                self.llm_client.run_agent(prompt, user_input, self.state.model, on_stream=stream_handler)
+                output = self.llm_client.run_agent(prompt, user_input, self.state.model, on_stream=stream_handler,
+                                                   on_usage=self._usage_recorder('analyzer'))
                 log(f"LLM 调用完成，总输出长度: {len(output)} 字符，共 {chunk_count} 个 chunks")
             except Exception as e:
-                log(f"LLM 调用失败: {e}", "ERROR")
+                self._llm_call_failed('analyzer', e)
+                coalescer.flush()
                 self._emit_event('agent_completed', {'agent': 'analyzer', 'success': False})
                 return None
+            coalescer.flush()
         else:
             log(f"开始调用 LLM (同步, 模型: {self.state.model})...")
             try:
-                output = self.llm_client.run_agent(prompt, user_input, self.state.model, on_stream=None)
+                output = self.llm_client.run_agent(prompt, user_input, self.state.model, on_stream=None,
+                                                   on_usage=self._usage_recorder('analyzer'))
                 log(f"LLM 调用完成，总输出长度: {len(output)} 字符")
             except Exception as e:
-                log(f"LLM 调用失败: {e}", "ERROR")
+                self._llm_call_failed('analyzer', e)
                 self._emit_event('agent_completed', {'agent': 'analyzer', 'success': False})
                 return None
         
         # Parse response
         log("正在解析 JSON 响应...")
-        data = parse_json_response(output)
+        data = self._parse_agent_json('analyzer', output, 'roles')
         if not data or 'roles' not in data:
             log(f"JSON 解析失败或缺少 roles 字段", "ERROR")
             log(f"原始输出前500字符: {output[:500]}")
@@ -374,7 +608,8 @@ class PipelineService:
             domain=data.get('domain', ''),
             target_user=data.get('target_user', ''),
             use_cases=data.get('use_cases', []),
-            roles=roles
+            roles=roles,
+            workflow=self._parse_workflow(data.get('workflow'))
         )
         
         self.state.system_architecture = architecture
@@ -395,30 +630,114 @@ class PipelineService:
         self._emit_event('agent_completed', {'agent': 'analyzer', 'success': True})
         return architecture
 
-    def _build_generator_context(self, role: SystemRole) -> str:
-        """Build context for generator agent."""
+    def _fit_user_input(
+        self,
+        system_prompt: str,
+        sections: List[ContextSection],
+        label: str,
+        max_tokens: Optional[int] = None
+    ) -> str:
+        """Preflight a user message against the model budget, trimming low-value sections."""
+        budget = input_budget(self.state.model, system_prompt)
+        if max_tokens:
+            budget = max_tokens if budget is None else min(budget, max_tokens)
+        if budget is None:
+            return '\n\n'.join(s.text for s in sections if s.text)
+        text, trimmed = fit_sections(sections, budget)
+        if trimmed:
+            log(f"  [{label}] 输入超出预算 ({budget} tokens)，已裁剪: {', '.join(trimmed)}", "WARN")
+        return text
+    
+    def _find_collaborators(self, role: SystemRole) -> Dict[str, List[str]]:
+        """Find roles that directly exchange data with a role.
+        
+        Uses matching inputs/outputs and the Analyzer's workflow links.
+        
+        Returns:
+            Mapping of collaborator role id to relation descriptions
+        """
+        arch = self.state.system_architecture
+        
+        def norm(items: List[str]) -> set:
+            return {str(i).strip().lower() for i in items or [] if str(i).strip()}
+        
+        def linked(a: str, b: str) -> bool:
+            # 完全相同，或较短的一方足够长且被包含（如「需求文档」与「需求文档（Markdown）」）
+            short, long_ = sorted((a, b), key=len)
+            return a == b or (len(short) >= 4 and short in long_)
+        
+        def overlap(produced: set, consumed: set) -> List[str]:
+            return sorted(p for p in produced if any(linked(p, c) for c in consumed))
+        
+        relations: Dict[str, List[str]] = {}
+        my_inputs, my_outputs = norm(role.inputs), norm(role.outputs)
+        for other in arch.roles:
+            if other.id == role.id:
+                continue
+            upstream = overlap(norm(other.outputs), my_inputs)
+            downstream = overlap(my_outputs, norm(other.inputs))
+            if upstream:
+                relations.setdefault(other.id, []).append(f"上游，提供：{'、'.join(upstream)}")
+            if downstream:
+                relations.setdefault(other.id, []).append(f"下游，接收：{'、'.join(downstream)}")
+        
+        if arch.workflow:
+            ids = {r.id for r in arch.roles}
+            by_name = {r.name: r.id for r in arch.roles}
+            
+            def resolve(ref: str) -> Optional[str]:
+                return ref if ref in ids else by_name.get(ref)
+            
+            for step in arch.workflow.steps:
+                source = resolve(step.role)
+                targets = [t for t in (resolve(n) for n in step.next or []) if t]
+                if source == role.id:
+                    for t in targets:
+                        if t != role.id:
+                            relations.setdefault(t, []).append(f"流程下一步（{step.action}）")
+                elif source and role.id in targets:
+                    relations.setdefault(source, []).append(f"流程上一步（{step.action}）")
+        
+        return relations
+    
+    def _build_generator_context(self, role: SystemRole, system_prompt: str = '') -> str:
+        """Build context for generator agent.
+        
+        Collaborating roles get full details; the rest only a one-line digest,
+        so input size stays flat as the number of roles grows.
+        """
         arch = self.state.system_architecture
-        other_roles = [r for r in arch.roles if r.id != role.id]
-        other_roles_str = '\n'.join(
-            f"- {r.name} ({r.type}): {r.description}"
-            for r in other_roles
+        relations = self._find_collaborators(role)
+        collaborators = [r for r in arch.roles if r.id in relations]
+        others = [r for r in arch.roles if r.id != role.id and r.id not in relations]
+        
+        collaborators_str = '\n'.join(
+            f"- {r.name} ({r.type}): {r.description}\n"
+            f"  关系：{'；'.join(relations[r.id])}\n"
+            f"  输入：{'、'.join(r.inputs) or '无'}；输出：{'、'.join(r.outputs) or '无'}"
+            for r in collaborators
         ) or '无'
+        other_roles_str = '、'.join(f"{r.name}({r.type})" for r in others) or '无'
         
-        return f"""## 系统信息
+        sections = [
+            ContextSection('系统信息', f"""## 系统信息
 系统名称：{arch.system_name}
 系统描述：{arch.system_description}
 目标用户：{arch.target_user}
-使用场景：{'、'.join(arch.use_cases)}
-
-## 当前需要生成提示词的角色
+使用场景：{'、'.join(arch.use_cases)}""", priority=2),
+            ContextSection('当前角色', f"""## 当前需要生成提示词的角色
 ```json
 {{"id": "{role.id}", "name": "{role.name}", "type": "{role.type}", "description": "{role.description}", "responsibilities": {role.responsibilities}, "inputs": {role.inputs}, "outputs": {role.outputs}, "triggers": {role.triggers}}}
-```
-
-## 其他角色（用于理解协作关系）
-{other_roles_str}
-
-请为「{role.name}」生成完整的提示词。"""
+```""", required=True),
+            ContextSection('协作角色', f"""## 协作角色（与当前角色直接交互）
+{collaborators_str}""", priority=1),
+            ContextSection('其他角色', f"""## 其他角色（概要）
+{other_roles_str}""", priority=0),
+            ContextSection('指令', f"请为「{role.name}」生成完整的提示词。", required=True),
+        ]
+        return self._fit_user_input(
+            system_prompt, sections, 'Generator', max_tokens=self.GENERATOR_CONTEXT_MAX_TOKENS
+        )
     
     def run_generator(
         self,
@@ -446,7 +765,7 @@ class PipelineService:
             log(f"  [Generator] 提示词加载失败: {e}", "ERROR")
             return None
         
-        user_input = self._build_generator_context(role)
+        user_input = self._build_generator_context(role, prompt)
         
         output = ""
         
@@ -461,22 +780,24 @@ class PipelineService:
             
             log(f"  [Generator] 调用 LLM (流式)...")
             try:
-                self.llm_client.run_agent(prompt, user_input, self.state.model, on_stream=stream_handler)
+                output = self.llm_client.run_agent(prompt, user_input, self.state.model, on_stream=stream_handler,
+                                                   on_usage=self._usage_recorder('generator', role_index, 0))
                 log(f"  [Generator] LLM 完成，输出长度: {len(output)}")
             except Exception as e:
-                log(f"  [Generator] LLM 调用失败: {e}", "ERROR")
+                self._llm_call_failed('generator', e, role_index, '  [Generator] ')
                 return None
         else:
             log(f"  [Generator] 调用 LLM (同步)...")
             try:
-                output = self.llm_client.run_agent(prompt, user_input, self.state.model, on_stream=None)
+                output = self.llm_client.run_agent(prompt, user_input, self.state.model, on_stream=None,
+                                                   on_usage=self._usage_recorder('generator', role_index, 0))
                 log(f"  [Generator] LLM 完成，输出长度: {len(output)}")
             except Exception as e:
-                log(f"  [Generator] LLM 调用失败: {e}", "ERROR")
+                self._llm_call_failed('generator', e, role_index, '  [Generator] ')
                 return None
         
         # Parse response
-        data = parse_json_response(output)
+        data = self._parse_agent_json('generator', output, 'prompt', role_index, 0)
         if data:
             log(f"  [Generator] JSON 解析成功")
             # 清理 prompt 内容，确保是纯文本
@@ -513,7 +834,9 @@ class PipelineService:
     def run_reviewer(
         self,
         role_prompt: RolePrompt,
-        on_output: Optional[Callable[[str], None]] = None
+        on_output: Optional[Callable[[str], None]] = None,
+        role_index: Optional[int] = None,
+        iteration: Optional[int] = None
     ) -> Optional[ReviewResult]:
         """Run the Reviewer agent."""
         log(f"  [Reviewer] 开始审核: {role_prompt.role_name}")
@@ -524,25 +847,23 @@ class PipelineService:
             log(f"  [Reviewer] 提示词加载失败: {e}", "ERROR")
             return None
         
-        user_input = f"""## 待审核的角色提示词
+        user_input = self._fit_user_input(prompt, [
+            ContextSection('角色信息', f"""## 待审核的角色提示词
 
 角色ID：{role_prompt.role_id}
 角色名称：{role_prompt.role_name}
 角色类型：{role_prompt.role_type}
-角色描述：{role_prompt.description}
-
-## 完整提示词内容
+角色描述：{role_prompt.description}""", required=True),
+            ContextSection('提示词', f"""## 完整提示词内容
 ```
 {role_prompt.prompt}
-```
-
-## 输入模板
-{role_prompt.input_template or '无'}
-
-## 触发条件
-{'、'.join(role_prompt.triggers) or '无'}
-
-请审核这个角色的提示词质量。"""
+```""", required=True),
+            ContextSection('输入模板', f"""## 输入模板
+{role_prompt.input_template or '无'}""", priority=0),
+            ContextSection('触发条件', f"""## 触发条件
+{'、'.join(role_prompt.triggers) or '无'}""", priority=1),
+            ContextSection('指令', "请审核这个角色的提示词质量。", required=True),
+        ], 'Reviewer')
         
         output = ""
         
@@ -554,20 +875,22 @@ class PipelineService:
                     on_output(chunk)
             
             try:
-                self.llm_client.run_agent(prompt, user_input, self.state.model, on_stream=stream_handler)
+                output = self.llm_client.run_agent(prompt, user_input, self.state.model, on_stream=stream_handler,
+                                                   on_usage=self._usage_recorder('reviewer', role_index, iteration))
                 log(f"  [Reviewer] LLM 完成，输出长度: {len(output)}")
             except Exception as e:
-                log(f"  [Reviewer] LLM 调用失败: {e}", "ERROR")
+                self._llm_call_failed('reviewer', e, role_index, '  [Reviewer] ')
                 return ReviewResult(score=7.0, strengths=[], weaknesses=[], suggestions=[])
         else:
             try:
-                output = self.llm_client.run_agent(prompt, user_input, self.state.model, on_stream=None)
+                output = self.llm_client.run_agent(prompt, user_input, self.state.model, on_stream=None,
+                                                   on_usage=self._usage_recorder('reviewer', role_index, iteration))
                 log(f"  [Reviewer] LLM 完成，输出长度: {len(output)}")
             except Exception as e:
-                log(f"  [Reviewer] LLM 调用失败: {e}", "ERROR")
+                self._llm_call_failed('reviewer', e, role_index, '  [Reviewer] ')
                 return ReviewResult(score=7.0, strengths=[], weaknesses=[], suggestions=[])
         
-        data = parse_json_response(output)
+        data = self._parse_agent_json('reviewer', output, 'score', role_index, iteration)
         if not data:
             log(f"  [Reviewer] JSON 解析失败，使用默认评分 7.0", "WARN")
             return ReviewResult(score=7.0, strengths=[], weaknesses=[], suggestions=[])
@@ -603,35 +926,41 @@ class PipelineService:
         self,
         role_prompt: RolePrompt,
         review_output: str,
-        on_output: Optional[Callable[[str], None]] = None
+        on_output: Optional[Callable[[str], None]] = None,
+        role_index: Optional[int] = None,
+        iteration: Optional[int] = None
     ) -> Optional[RolePrompt]:
         """Run the Optimizer agent."""
         log(f"  [Optimizer] 开始优化: {role_prompt.role_name}")
         
+        if self.OPTIMIZER_MODE == 'patch':
+            patched = self._run_optimizer_patch(role_prompt, review_output, on_output, role_index, iteration)
+            if patched:
+                return patched
+            log(f"  [Optimizer] 补丁模式失败，回退到完整重写", "WARN")
+        
         try:
             prompt = load_prompt('optimizer')
         except Exception as e:
             log(f"  [Optimizer] 提示词加载失败: {e}", "ERROR")
             return None
         
-        user_input = f"""## 原始角色提示词
+        user_input = self._fit_user_input(prompt, [
+            ContextSection('角色信息', f"""## 原始角色提示词
 
 角色ID：{role_prompt.role_id}
 角色名称：{role_prompt.role_name}
-角色类型：{role_prompt.role_type}
-
-### 完整提示词
+角色类型：{role_prompt.role_type}""", required=True),
+            ContextSection('提示词', f"""### 完整提示词
 ```
 {role_prompt.prompt}
-```
-
-### 输入模板
-{role_prompt.input_template or '无'}
-
-## 审核报告
-{review_output}
-
-请根据审核报告优化这个角色的提示词。"""
+```""", required=True),
+            ContextSection('输入模板', f"""### 输入模板
+{role_prompt.input_template or '无'}""", priority=0),
+            ContextSection('审核报告', f"""## 审核报告
+{review_output}""", priority=1),
+            ContextSection('指令', "请根据审核报告优化这个角色的提示词。", required=True),
+        ], 'Optimizer')
         
         output = ""
         
@@ -643,20 +972,22 @@ class PipelineService:
                     on_output(chunk)
             
             try:
-                self.llm_client.run_agent(prompt, user_input, self.state.model, on_stream=stream_handler)
+                output = self.llm_client.run_agent(prompt, user_input, self.state.model, on_stream=stream_handler,
+                                                   on_usage=self._usage_recorder('optimizer', role_index, iteration))
                 log(f"  [Optimizer] LLM 完成，输出长度: {len(output)}")
             except Exception as e:
-                log(f"  [Optimizer] LLM 调用失败: {e}", "ERROR")
+                self._llm_call_failed('optimizer', e, role_index, '  [Optimizer] ')
                 return None
         else:
             try:
-                output = self.llm_client.run_agent(prompt, user_input, self.state.model, on_stream=None)
+                output = self.llm_client.run_agent(prompt, user_input, self.state.model, on_stream=None,
+                                                   on_usage=self._usage_recorder('optimizer', role_index, iteration))
                 log(f"  [Optimizer] LLM 完成，输出长度: {len(output)}")
             except Exception as e:
-                log(f"  [Optimizer] LLM 调用失败: {e}", "ERROR")
+                self._llm_call_failed('optimizer', e, role_index, '  [Optimizer] ')
                 return None
         
-        data = parse_json_response(output)
+        data = self._parse_agent_json('optimizer', output, 'prompt', role_index, iteration)
         
         # 如果 JSON 解析完全失败，尝试从输出中提取提示词内容
         if not data:
@@ -693,6 +1024,141 @@ class PipelineService:
             triggers=data.get('triggers', role_prompt.triggers)
         )
 
+    def _run_optimizer_patch(
+        self,
+        role_prompt: RolePrompt,
+        review_output: str,
+        on_output: Optional[Callable[[str], None]] = None,
+        role_index: Optional[int] = None,
+        iteration: Optional[int] = None
+    ) -> Optional[RolePrompt]:
+        """Run the Optimizer in patch mode: the model returns section edits that are applied locally."""
+        sections = list_section_names(role_prompt.prompt)
+        if not sections:
+            log(f"  [Optimizer] 提示词没有可定位的章节，跳过补丁模式")
+            return None
+        
+        try:
+            prompt = load_prompt('optimizer') + '\n\n' + load_prompt('optimizer_patch')
+        except Exception as e:
+            log(f"  [Optimizer] 提示词加载失败: {e}", "ERROR")
+            return None
+        
+        # 章节列表的标题须与 optimizer_patch.md 中的称呼一致
+        editable_label, separator = (
+            ('Editable sections', ', ') if get_language() == 'en' else ('可编辑章节', '、')
+        )
+        
+        user_input = self._fit_user_input(prompt, [
+            ContextSection('角色信息', f"""## 当前角色提示词
+
+角色ID：{role_prompt.role_id}
+角色名称：{role_prompt.role_name}
+角色类型：{role_prompt.role_type}""", required=True),
+            ContextSection('提示词', f"""### 完整提示词
+```
+{role_prompt.prompt}
+```""", required=True),
+            ContextSection('可编辑章节', f"""### {editable_label}
+{separator.join(sections)}""", required=True),
+            ContextSection('输入模板', f"""### 输入模板
+{role_prompt.input_template or '无'}""", priority=0),
+            ContextSection('审核报告', f"""## 审核报告
+{review_output}""", priority=1),
+            ContextSection('指令', "请根据审核报告输出编辑操作。", required=True),
+        ], 'Optimizer')
+        
+        output = ""
+        on_usage = self._usage_recorder('optimizer', role_index, iteration)
+        
+        if self.use_stream:
+            def stream_handler(chunk: str):
+                nonlocal output
+                output += chunk
+                if on_output:
+                    on_output(chunk)
+            
+            try:
+                output = self.llm_client.run_agent(prompt, user_input, self.state.model, on_stream=stream_handler,
+                                                   on_usage=on_usage)
+            except Exception as e:
+                self._llm_call_failed('optimizer', e, role_index, '  [Optimizer] ')
+                return None
+        else:
+            try:
+                output = self.llm_client.run_agent(prompt, user_input, self.state.model, on_stream=None,
+                                                   on_usage=on_usage)
+            except Exception as e:
+                self._llm_call_failed('optimizer', e, role_index, '  [Optimizer] ')
+                return None
+        log(f"  [Optimizer] 补丁输出长度: {len(output)} (原提示词 {len(role_prompt.prompt)})")
+        
+        data = self._parse_agent_json('optimizer_patch', output, 'operations', role_index, iteration)
+        if not data:
+            return None
+        
+        try:
+            new_prompt = apply_patch(role_prompt.prompt, data.get('operations'))
+        except PatchError as e:
+            log(f"  [Optimizer] 补丁应用失败: {e}", "WARN")
+            return None
+        
+        log(f"  [Optimizer] 已应用 {len(data['operations'])} 个编辑操作 ✓")
+        return RolePrompt(
+            role_id=role_prompt.role_id,
+            role_name=role_prompt.role_name,
+            role_type=role_prompt.role_type,
+            description=role_prompt.description,
+            prompt=new_prompt,
+            input_template=data.get('input_template') or role_prompt.input_template,
+            output_format=role_prompt.output_format,
+            triggers=role_prompt.triggers
+        )
+    
+    def _format_review_output(self, review: ReviewResult) -> str:
+        """Build review output string for optimizer."""
+        return f"""评分: {review.score}
+优点: {', '.join(review.strengths) if review.strengths else '无'}
+缺点: {'; '.join([f"{w.issue}({w.severity})" for w in review.weaknesses]) if review.weaknesses else '无'}
+建议: {'; '.join([f"{s.suggestion}({s.priority})" for s in review.suggestions]) if review.suggestions else '无'}
+结论: {review.verdict or '无'}"""
+    
+    def _save_role_step(self, role_index: int, step: Dict[str, Any]) -> None:
+        """Record a finished generate/review/optimize step of a role (线程安全)."""
+        step['saved_at'] = datetime.now().isoformat()
+        with self._lock:
+            self._checkpoint([{'op': 'append', 'path': ['role_steps', str(role_index)], 'value': step}])
+        self._touch()
+    
+    def _restore_role_steps(self, role_index: int):
+        """Rebuild (prompt, iteration, review, stage) from a role's recorded steps, or None."""
+        steps = self._role_steps.pop(role_index, None)
+        if not steps:
+            return None
+        
+        current_prompt, review = None, None
+        for step in steps:
+            if step.get('prompt'):
+                current_prompt = RolePrompt(**step['prompt'])
+            if step.get('review'):
+                review = self._deserialize_review(step['review'])
+        if not current_prompt:
+            return None
+        
+        last = steps[-1]
+        stage = last.get('stage', 'generated')
+        if stage == 'reviewed' and not review:
+            stage = 'generated'
+        return current_prompt, last.get('iteration', 0), review, stage
+    
+    def _deserialize_review(self, data: Dict[str, Any]) -> ReviewResult:
+        """Restore a ReviewResult saved with asdict."""
+        return ReviewResult(**{
+            **data,
+            'weaknesses': [WeaknessItem(**w) for w in data.get('weaknesses', [])],
+            'suggestions': [SuggestionItem(**s) for s in data.get('suggestions', [])]
+        })
+    
     def process_role(
         self,
         role_index: int,
@@ -706,39 +1172,57 @@ class PipelineService:
             log("流水线已取消", "WARN")
             return None
         
-        # Generate
-        role_prompt = self.run_generator(role_index, on_output)
-        if not role_prompt:
-            log(f"角色 {role_index+1} 生成失败", "ERROR")
-            self.state.role_states[role_index].status = 'error'
-            return None
+        # 断点恢复：从该角色最后完成的步骤继续
+        resumed = self._restore_role_steps(role_index)
+        if resumed:
+            current_prompt, iteration, review, stage = resumed
+            log(f"  从检查点恢复: 迭代 {iteration}, 阶段 {stage}")
+            self.state.role_states[role_index].prompt = current_prompt.prompt
+            if review:
+                self.state.role_states[role_index].review = review
+                self.state.role_states[role_index].iterations = iteration
+        else:
+            # Generate
+            role_prompt = self.run_generator(role_index, on_output)
+            if not role_prompt:
+                log(f"角色 {role_index+1} 生成失败", "ERROR")
+                self.state.role_states[role_index].status = 'error'
+                self._touch()
+                return None
+            self._save_role_step(role_index, {
+                'stage': 'generated', 'iteration': 0, 'prompt': self._serialize_role_prompt(role_prompt)
+            })
+            current_prompt, iteration, review, stage = role_prompt, 0, None, 'generated'
         
         # Review-Optimize cycle
-        current_prompt = role_prompt
-        iteration = 0
-        review = None
-        
-        while iteration < self.MAX_ITERATIONS:
+        while True:
             if self._check_cancelled():
                 log("流水线已取消", "WARN")
                 return None
             
-            iteration += 1
-            log(f"  迭代 {iteration}/{self.MAX_ITERATIONS}")
-            
-            self.state.role_states[role_index].status = 'reviewing'
-            self._emit_event('role_state_updated', {
-                'roleIndex': role_index,
-                'status': 'reviewing'
-            })
-            
-            review = self.run_reviewer(current_prompt, on_output)
-            if not review:
-                log(f"  审核失败，跳出循环", "WARN")
-                break
-            
-            self.state.role_states[role_index].review = review
-            self.state.role_states[role_index].iterations = iteration
+            if stage != 'reviewed':
+                if iteration >= self.MAX_ITERATIONS:
+                    break
+                iteration += 1
+                log(f"  迭代 {iteration}/{self.MAX_ITERATIONS}")
+                
+                self.state.role_states[role_index].status = 'reviewing'
+                self._emit_event('role_state_updated', {
+                    'roleIndex': role_index,
+                    'status': 'reviewing'
+                })
+                
+                review = self.run_reviewer(current_prompt, on_output, role_index=role_index, iteration=iteration)
+                if not review:
+                    log(f"  审核失败，跳出循环", "WARN")
+                    break
+                
+                self.state.role_states[role_index].review = review
+                self.state.role_states[role_index].iterations = iteration
+                self._save_role_step(role_index, {
+                    'stage': 'reviewed', 'iteration': iteration, 'review': asdict(review)
+                })
+                stage = 'reviewed'
             
             log(f"  评分: {review.score}, 通过阈值: {self.PASS_SCORE}")
             
@@ -760,17 +1244,15 @@ class PipelineService:
                 'status': 'optimizing'
             })
             
-            # Build review output string for optimizer
-            review_output = f"""评分: {review.score}
-优点: {', '.join(review.strengths) if review.strengths else '无'}
-缺点: {'; '.join([f"{w.issue}({w.severity})" for w in review.weaknesses]) if review.weaknesses else '无'}
-建议: {'; '.join([f"{s.suggestion}({s.priority})" for s in review.suggestions]) if review.suggestions else '无'}
-结论: {review.verdict or '无'}"""
-            
-            optimized = self.run_optimizer(current_prompt, review_output, on_output)
+            optimized = self.run_optimizer(current_prompt, self._format_review_output(review), on_output,
+                                           role_index=role_index, iteration=iteration)
             if optimized:
                 current_prompt = optimized
                 self.state.role_states[role_index].prompt = optimized.prompt
+                self._save_role_step(role_index, {
+                    'stage': 'optimized', 'iteration': iteration, 'prompt': self._serialize_role_prompt(optimized)
+                })
+            stage = 'optimized'
         
         # Mark completed
         self.state.role_states[role_index].status = 'completed'
@@ -825,33 +1307,40 @@ class PipelineService:
         
         if self.use_stream:
             chunk_count = 0
+            coalescer = ChunkCoalescer(
+                lambda text: self._emit_event('agent_output', {'agent': 'tester', 'chunk': text})
+            )
             def stream_handler(chunk: str):
                 nonlocal output, chunk_count
                 output += chunk
                 chunk_count += 1
                 if on_output:
                     on_output(chunk)
-                self._emit_event('agent_output', {'agent': 'tester', 'chunk': chunk})
+                coalescer.add(chunk)
             
             log(f"调用 LLM (流式)...")
             try:
-                self.llm_client.run_agent(prompt, user_input, self.state.model, on_stream=stream_handler)
+                output = self.llm_client.run_agent(prompt, user_input, self.state.model, on_stream=stream_handler,
+                                                   on_usage=self._usage_recorder('tester'))
                 log(f"LLM 完成，输出长度: {len(output)}")
             except Exception as e:
-                log(f"LLM 调用失败: {e}", "ERROR")
+                self._llm_call_failed('tester', e)
+                coalescer.flush()
                 self._emit_event('agent_completed', {'agent': 'tester', 'success': False})
                 return None
+            coalescer.flush()
         else:
             log(f"调用 LLM (同步)...")
             try:
-                output = self.llm_client.run_agent(prompt, user_input, self.state.model, on_stream=None)
+                output = self.llm_client.run_agent(prompt, user_input, self.state.model, on_stream=None,
+                                                   on_usage=self._usage_recorder('tester'))
                 log(f"LLM 完成，输出长度: {len(output)}")
             except Exception as e:
-                log(f"LLM 调用失败: {e}", "ERROR")
+                self._llm_call_failed('tester', e)
                 self._emit_event('agent_completed', {'agent': 'tester', 'success': False})
                 return None
         
-        data = parse_json_response(output)
+        data = self._parse_agent_json('tester', output, 'summary')
         self._emit_event('agent_completed', {'agent': 'tester', 'success': data is not None})
         
         if not data:
@@ -924,10 +1413,9 @@ class PipelineService:
             # 保存概览文件
             overview_content = self._generate_overview_md(suite)
             overview_file = self._task_dir / '0_概览.md'
-            overview_file.write_text(overview_content, encoding='utf-8')
-            log(f"概览文件已保存: {overview_file}")
+            tickets = [self._storage.write_result_file(overview_file, overview_content)]
             
-            # 保存 JSON 备份（用于导入/导出）
+            # 保存 JSON 备份（用于导入/导出），长文本存入 blob 库
             data = {
                 'requirement': {
                     'description': self.state.description,
@@ -941,15 +1429,27 @@ class PipelineService:
                     'workflow_summary': suite.workflow_summary,
                     'integration_notes': suite.integration_notes
                 },
+                'usage': self.usage.summary(),
+                'json_repair': self._repairer.stats(),
                 'savedAt': datetime.now().isoformat()
             }
             
             json_file = self._task_dir / '_data.json'
-            json_file.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding='utf-8')
-            log(f"JSON 备份已保存: {json_file}")
+            tickets.append(self._storage.write_result_file(
+                json_file, json.dumps(self._storage.pack_suite_data(data), ensure_ascii=False, indent=2)
+            ))
+            
+            # 写入屏障：本任务的结果文件（含各角色 md）落盘后才通知完成
+            with self._lock:
+                tickets.extend(self._result_writes)
+            if not self._storage.flush_results(tickets):
+                log("部分结果文件写入失败", "ERROR")
+            suite_name = self._storage.suite_name(self._task_dir)
+            self._storage.index_suite(suite_name, data)
+            log(f"结果文件已保存: {overview_file}, {json_file}")
             
             self._emit_event('suite_saved', {
-                'folder': self._task_dir.name,
+                'folder': suite_name,
                 'path': str(self._task_dir)
             })
         except Exception as e:
@@ -14,7 +14,9 @@ class PromptLoader:
         'generator': 'generator.md',
         'reviewer': 'reviewer.md',
         'optimizer': 'optimizer.md',
+        'optimizer_patch': 'optimizer_patch.md',
         'tester': 'tester.md',
+        'repair': 'repair.md',
     }
     
     SUPPORTED_LANGUAGES = ['cn', 'en']
@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""Sharded layout of the result directory.
+
+Suites are stored as result/YYYY/MM/<task_id>/ so no directory grows without bound and
+two tasks never share a folder. The human-readable suite name (``<keyword>_<date>``,
+made unique with a numeric suffix) is an alias kept in config/layout.db, which maps
+name <-> task ID <-> relative path. Each sharded folder also carries an _alias.json so
+the table can be rebuilt from disk.
+
+Folders of the old flat layout (result/<name>/) keep working until they are moved
+with ``python migrate_results.py``.
+"""
+
+import os
+import re
+import json
+import uuid
+import shutil
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+
+def log(msg: str, level: str = "INFO"):
+    """打印带时间戳的日志"""
+    timestamp = datetime.now().strftime("%H:%M:%S.%f")[:-3]
+    print(f"[{timestamp}] [Layout] [{level}] {msg}", flush=True)
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS aliases (
+    name TEXT PRIMARY KEY,
+    task_id TEXT NOT NULL UNIQUE,
+    rel_path TEXT NOT NULL UNIQUE,
+    created_at TEXT NOT NULL
+);
+"""
+
+ALIAS_FILE = '_alias.json'
+
+_YEAR_RE = re.compile(r'^\d{4}$')
+_MONTH_RE = re.compile(r'^\d{2}$')
+
+
+def _valid_name(name: str) -> bool:
+    """Reject names that could escape the result directory."""
+    return bool(name) and name not in ('.', '..') and '/' not in name and '\\' not in name
+
+
+class ResultLayout:
+    """Maps suite names and task IDs to sharded result folders."""
+
+    def __init__(self, db_path: Path, result_dir: Path):
+        self.db_path = db_path
+        self.result_dir = result_dir
+        self._conn = sqlite3.connect(str(db_path), timeout=10, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+
+    # ==================== Lookup ====================
+
+    def allocate(self, task_id: str, base_name: str, created: Optional[datetime] = None) -> Path:
+        """Folder of a task, created on first use.
+
+        The same task ID always maps to the same folder (a resumed task continues in it).
+
+        Args:
+            task_id: Task ID, used as the folder name
+            base_name: Human-readable name; a suffix is added if it is taken
+            created: Date for the YYYY/MM shard (default now)
+        """
+        if not _valid_name(task_id):
+            raise ValueError(f'无效的任务 ID: {task_id}')
+        with self._lock:
+            row = self._conn.execute('SELECT rel_path FROM aliases WHERE task_id = ?', (task_id,)).fetchone()
+            if row:
+                path = self.result_dir / row[0]
+                path.mkdir(parents=True, exist_ok=True)
+                return path
+
+            created = created or datetime.now()
+            rel_path = f'{created:%Y}/{created:%m}/{task_id}'
+            name = self._register_locked(base_name, task_id, rel_path, created)
+
+        path = self.result_dir / rel_path
+        path.mkdir(parents=True, exist_ok=True)
+        self._write_alias_file(path, name, task_id)
+        return path
+
+    def resolve(self, name: str) -> Optional[Path]:
+        """Folder of a suite by name (sharded alias or legacy flat folder)."""
+        if not _valid_name(name):
+            return None
+        with self._lock:
+            row = self._conn.execute('SELECT rel_path FROM aliases WHERE name = ?', (name,)).fetchone()
+        if row:
+            return self.result_dir / row[0]
+        legacy = self.result_dir / name
+        if not _YEAR_RE.match(name) and legacy.is_dir():
+            return legacy
+        return None
+
+    def name_of(self, path: Path) -> str:
+        """Suite name of a result folder."""
+        try:
+            rel_path = path.relative_to(self.result_dir).as_posix()
+        except ValueError:
+            return path.name
+        with self._lock:
+            row = self._conn.execute('SELECT name FROM aliases WHERE rel_path = ?', (rel_path,)).fetchone()
+        return row[0] if row else path.name
+
+    def suite_dirs(self) -> List[Tuple[str, Path]]:
+        """All suite folders as (name, path): legacy flat folders and sharded ones.
+
+        Sharded folders missing from the alias table (copied in by hand) are registered
+        under the name in their _alias.json, or their task ID.
+        """
+        suites, shards = [], []
+        for entry in self.result_dir.iterdir():
+            if not entry.is_dir():
+                continue
+            if _YEAR_RE.match(entry.name):
+                shards.extend(m for m in entry.iterdir() if m.is_dir() and _MONTH_RE.match(m.name))
+            else:
+                suites.append((entry.name, entry))
+
+        with self._lock:
+            known = dict(self._conn.execute('SELECT rel_path, name FROM aliases').fetchall())
+        for month_dir in shards:
+            for folder in month_dir.iterdir():
+                if not folder.is_dir():
+                    continue
+                rel_path = folder.relative_to(self.result_dir).as_posix()
+                name = known.get(rel_path)
+                if name is None:
+                    name = self._adopt(folder, rel_path)
+                suites.append((name, folder))
+        return suites
+
+    def signature(self) -> str:
+        """Changes whenever a suite folder is added to or removed from the layout."""
+        parts = []
+        for directory in [self.result_dir] + sorted(
+            d for d in self.result_dir.iterdir() if d.is_dir() and _YEAR_RE.match(d.name)
+        ):
+            parts.append(str(directory.stat().st_mtime_ns))
+            if directory != self.result_dir:
+                parts.extend(
+                    f'{m.name}:{m.stat().st_mtime_ns}' for m in sorted(directory.iterdir())
+                    if m.is_dir() and _MONTH_RE.match(m.name)
+                )
+        return ','.join(parts)
+
+    # ==================== Registration ====================
+
+    def release(self, path: Path) -> None:
+        """Delete a folder and its alias (e.g. after a failed import)."""
+        try:
+            rel_path = path.relative_to(self.result_dir).as_posix()
+        except ValueError:
+            return
+        with self._lock:
+            self._conn.execute('DELETE FROM aliases WHERE rel_path = ?', (rel_path,))
+        shutil.rmtree(path, ignore_errors=True)
+
+    def _register_locked(self, base_name: str, task_id: str, rel_path: str, created: datetime) -> str:
+        """Insert an alias row under a free name derived from base_name (needs _lock)."""
+        base_name = base_name if _valid_name(base_name) else task_id
+        for n in range(1, 10000):
+            name = base_name if n == 1 else f'{base_name}_{n}'
+            # 也不能与未迁移的旧目录同名
+            if (self.result_dir / name).is_dir() and not _YEAR_RE.match(name):
+                continue
+            cursor = self._conn.execute(
+                'INSERT OR IGNORE INTO aliases (name, task_id, rel_path, created_at) VALUES (?, ?, ?, ?)',
+                (name, task_id, rel_path, created.isoformat())
+            )
+            if cursor.rowcount:
+                return name
+        raise ValueError(f'无法为 {base_name} 分配名称')
+
+    def _adopt(self, folder: Path, rel_path: str) -> str:
+        """Register a sharded folder found on disk but missing from the alias table."""
+        info: Dict[str, Any] = {}
+        try:
+            info = json.loads((folder / ALIAS_FILE).read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            pass
+        task_id = info.get('taskId') or folder.name
+        with self._lock:
+            row = self._conn.execute('SELECT name FROM aliases WHERE task_id = ?', (task_id,)).fetchone()
+            if row:
+                task_id = f'{task_id}-{uuid.uuid4().hex[:8]}'  # 同一任务的副本
+            name = self._register_locked(info.get('name') or folder.name, task_id, rel_path, datetime.now())
+        log(f"登记目录: {rel_path} -> {name}")
+        return name
+
+    @staticmethod
+    def _write_alias_file(path: Path, name: str, task_id: str) -> None:
+        (path / ALIAS_FILE).write_text(
+            json.dumps({'name': name, 'taskId': task_id}, ensure_ascii=False), encoding='utf-8'
+        )
+
+    # ==================== Migration ====================
+
+    def migrate(self, dry_run: bool = False) -> List[Tuple[str, str]]:
+        """Move legacy flat folders into the sharded layout, keeping their names.
+
+        The shard date comes from savedAt in _data.json, else the folder's mtime.
+        Run it while the server is stopped.
+
+        Returns:
+            (name, new relative path) of every moved folder
+        """
+        moved = []
+        for folder in sorted(self.result_dir.iterdir()):
+            if not folder.is_dir() or _YEAR_RE.match(folder.name):
+                continue
+            created = None
+            try:
+                saved_at = json.loads((folder / '_data.json').read_text(encoding='utf-8')).get('savedAt')
+                created = datetime.fromisoformat(saved_at) if saved_at else None
+            except (OSError, ValueError, AttributeError):
+                pass
+            created = created or datetime.fromtimestamp(folder.stat().st_mtime)
+            task_id = uuid.uuid4().hex
+            rel_path = f'{created:%Y}/{created:%m}/{task_id}'
+            moved.append((folder.name, rel_path))
+            if dry_run:
+                continue
+
+            target = self.result_dir / rel_path
+            target.parent.mkdir(parents=True, exist_ok=True)
+            # 移动前先写入 _alias.json：移动后、登记前中断时，suite_dirs 仍能按原名称登记该目录
+            self._write_alias_file(folder, folder.name, task_id)
+            # 先移动再登记：登记时旧目录已不存在，名称保持不变
+            os.rename(folder, target)
+            with self._lock:
+                name = self._register_locked(folder.name, task_id, rel_path, created)
+            if name != folder.name:
+                self._write_alias_file(target, name, task_id)
+        return moved
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""Background writer for result files (write-behind)."""
+
+import os
+import atexit
+import threading
+from pathlib import Path
+from collections import OrderedDict
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+from datetime import datetime
+
+from app.config import Config
+
+
+def log(msg: str, level: str = "INFO"):
+    """打印带时间戳的日志"""
+    timestamp = datetime.now().strftime("%H:%M:%S.%f")[:-3]
+    print(f"[{timestamp}] [Writer] [{level}] {msg}", flush=True)
+
+
+class WriteTicket(NamedTuple):
+    """Handle of a queued write, passed to ResultWriter.flush()."""
+    path: Path
+    seq: int
+
+
+class ResultWriter:
+    """Writes result files on a dedicated thread.
+
+    Pending writes to the same path are coalesced (only the latest content is written),
+    and files whose content is unchanged on disk are skipped.
+    Each batch is written to fsynced temp files and renamed into place, with one
+    directory fsync per batch.
+    The pending set is bounded: producers block when it is full.
+
+    Every write gets an increasing sequence number. A batch takes all pending writes,
+    so once it is done every write numbered up to the last one queued before it
+    started is on disk; flush() waits for that watermark, not for an empty queue.
+    """
+
+    MAX_ERRORS = 256  # 保留的失败记录数
+
+    def __init__(self, max_pending: Optional[int] = None):
+        self.max_pending = max_pending or Config.RESULT_WRITER_MAX_PENDING
+        self._pending: Dict[Path, Tuple[str, int]] = {}
+        self._cond = threading.Condition()
+        self._seq = 0  # 最近一次写入的序号
+        self._done_seq = 0  # 不大于此序号的写入都已完成（成功或失败）
+        self._errors: 'OrderedDict[Path, Tuple[int, str]]' = OrderedDict()  # 路径 -> (失败的序号, 错误)
+        self._thread: Optional[threading.Thread] = None
+
+    def _ensure_thread(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='result-writer', daemon=True)
+            self._thread.start()
+
+    def write(self, path: Path, content: str) -> WriteTicket:
+        """Queue a file write and return immediately (blocks only while the queue is full).
+
+        Returns:
+            Ticket to wait for this write with flush()
+        """
+        path = Path(path)
+        with self._cond:
+            while path not in self._pending and len(self._pending) >= self.max_pending:
+                self._cond.wait()
+            self._seq += 1
+            self._pending[path] = (content, self._seq)
+            self._ensure_thread()
+            self._cond.notify_all()
+            return WriteTicket(path, self._seq)
+
+    def flush(self, tickets: Optional[Iterable[WriteTicket]] = None, timeout: Optional[float] = None) -> bool:
+        """Wait until the given writes are on disk.
+
+        Args:
+            tickets: Writes to wait for; None waits for everything queued so far
+            timeout: Maximum seconds to wait, None waits forever
+
+        Returns:
+            True if those writes finished without error, False on timeout or if one of
+            them failed (a later write to the same path counts in its place)
+        """
+        with self._cond:
+            tickets = None if tickets is None else list(tickets)
+            target = self._seq if tickets is None else max((t.seq for t in tickets), default=0)
+            done = self._cond.wait_for(lambda: self._done_seq >= target, timeout)
+            if tickets is None:
+                failed = [path for path, (seq, _) in self._errors.items() if seq <= target]
+            else:
+                failed = [t.path for t in tickets if t.path in self._errors and self._errors[t.path][0] >= t.seq]
+        if not done:
+            log("等待结果文件写入超时", "WARN")
+        return done and not failed
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending)
+                batch, self._pending = self._pending, {}
+                batch_seq = self._seq
+                self._cond.notify_all()  # 队列已腾空，唤醒被阻塞的生产者
+            try:
+                self._write_batch(batch)
+            finally:
+                with self._cond:
+                    self._done_seq = batch_seq
+                    self._cond.notify_all()
+
+    def _write_batch(self, batch: Dict[Path, Tuple[str, int]]) -> None:
+        """Write temp files, fsync them as one batch, then rename into place."""
+        staged: List[Tuple[Path, Path]] = []
+        written: List[Path] = []
+        for path, (content, seq) in batch.items():
+            data = content.encode('utf-8')
+            if self._unchanged(path, data):
+                written.append(path)
+                continue  # 内容相同，跳过写入
+            tmp = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+            try:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                with open(tmp, 'wb') as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                staged.append((tmp, path))
+            except OSError as e:
+                self._fail(path, seq, e)
+
+        dirs = set()
+        for tmp, path in staged:
+            try:
+                os.replace(tmp, path)
+                dirs.add(path.parent)
+                written.append(path)
+            except OSError as e:
+                self._fail(path, batch[path][1], e)
+
+        # 成功写入的路径清除之前的失败记录
+        with self._cond:
+            for path in written:
+                self._errors.pop(path, None)
+
+        # 每个目录只 fsync 一次，让重命名持久化
+        if hasattr(os, 'O_DIRECTORY'):
+            for directory in dirs:
+                try:
+                    fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+                    try:
+                        os.fsync(fd)
+                    finally:
+                        os.close(fd)
+                except OSError:
+                    pass
+
+    @staticmethod
+    def _unchanged(path: Path, data: bytes) -> bool:
+        """True if the file already holds exactly this content."""
+        try:
+            if path.stat().st_size != len(data):
+                return False
+            return path.read_bytes() == data
+        except OSError:
+            return False
+
+    def _fail(self, path: Path, seq: int, error: Exception) -> None:
+        log(f"写入失败: {path}: {error}", "ERROR")
+        with self._cond:
+            self._errors.pop(path, None)
+            self._errors[path] = (seq, str(error))
+            while len(self._errors) > self.MAX_ERRORS:
+                self._errors.popitem(last=False)
+
+
+# Global instance
+_writer: Optional[ResultWriter] = None
+_writer_lock = threading.Lock()
+
+
+def get_result_writer() -> ResultWriter:
+    """Get the global result writer instance."""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = ResultWriter()
+            atexit.register(_writer.flush, None, Config.RESULT_FLUSH_TIMEOUT)
+    return _writer
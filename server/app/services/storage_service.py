@@ -1,16 +1,31 @@
 # -*- coding: utf-8 -*-
 """Storage service for file-based persistence."""
 
+import os
 import json
 import re
+import threading
+import uuid
 from pathlib import Path
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 from datetime import datetime
 
 from app.config import Config
 from app.models.settings import Settings
 from app.models.history import HistoryRecord
-from app.utils.crypto import encrypt, decrypt
+from app.services.blob_store import BlobStore, is_blob_ref
+from app.services.history_store import HistoryStore
+from app.services.result_layout import ResultLayout
+from app.services.result_writer import WriteTicket, get_result_writer
+from app.services.suite_catalog import SuiteCatalog
+from app.utils.crypto import encrypt, decrypt, get_salt, is_legacy
+from app.utils.projection import project
+
+
+def log(msg: str, level: str = "INFO"):
+    """打印带时间戳的日志"""
+    timestamp = datetime.now().strftime("%H:%M:%S.%f")[:-3]
+    print(f"[{timestamp}] [Storage] [{level}] {msg}", flush=True)
 
 
 class StorageService:
@@ -29,6 +44,21 @@ class StorageService:
         # Ensure directories exist
         self.config_dir.mkdir(parents=True, exist_ok=True)
         self.result_dir.mkdir(parents=True, exist_ok=True)
+        
+        # 配置缓存：(文件 mtime/大小, 配置数据, 盐)
+        self._settings_cache: Optional[Tuple[Tuple[int, int], Dict[str, Any], Optional[bytes]]] = None
+        self._settings_lock = threading.RLock()
+        
+        # 任务进度日志状态
+        self._journal_lock = threading.RLock()
+        self._journal_seq: Dict[str, int] = {}
+        self._journal_lines: Dict[str, int] = {}
+        
+        self._layout: Optional[ResultLayout] = None
+        self._blobs: Optional[BlobStore] = None
+        self._catalog: Optional[SuiteCatalog] = None
+        self._history: Optional[HistoryStore] = None
+        self._stores_lock = threading.RLock()
     
     # ==================== Settings ====================
     
@@ -36,22 +66,45 @@ class StorageService:
         """Save settings with encryption."""
         settings_file = self.config_dir / "settings.enc"
         json_str = json.dumps(settings.to_dict(), ensure_ascii=False)
-        encrypted = encrypt(json_str, self.encryption_key)
-        settings_file.write_text(encrypted, encoding='utf-8')
+        with self._settings_lock:
+            # 沿用当前文件的盐，派生密钥命中缓存
+            salt = self._settings_cache[2] if self._settings_cache else None
+            encrypted = encrypt(json_str, self.encryption_key, salt)
+            self._write_atomic(settings_file, encrypted)
+            stat = settings_file.stat()
+            self._settings_cache = ((stat.st_mtime_ns, stat.st_size), settings.to_dict(), get_salt(encrypted))
     
     def load_settings(self) -> Settings:
-        """Load and decrypt settings."""
+        """Load and decrypt settings (cached until the file changes)."""
         settings_file = self.config_dir / "settings.enc"
-        if not settings_file.exists():
-            return Settings()
-        
         try:
-            encrypted = settings_file.read_text(encoding='utf-8')
-            decrypted = decrypt(encrypted, self.encryption_key)
-            data = json.loads(decrypted)
-            return Settings.from_dict(data)
-        except Exception:
+            stat = settings_file.stat()
+        except FileNotFoundError:
             return Settings()
+        
+        with self._settings_lock:
+            signature = (stat.st_mtime_ns, stat.st_size)
+            if self._settings_cache and self._settings_cache[0] == signature:
+                # 每次返回新对象，调用方修改不会影响缓存
+                return Settings.from_dict(self._settings_cache[1])
+            
+            try:
+                encrypted = settings_file.read_text(encoding='utf-8')
+                decrypted = decrypt(encrypted, self.encryption_key)
+                data = json.loads(decrypted)
+            except Exception:
+                return Settings()
+            self._settings_cache = (signature, data, get_salt(encrypted))
+        
+        settings = Settings.from_dict(data)
+        if is_legacy(encrypted):
+            # 旧格式（固定盐、无认证）升级为当前格式
+            try:
+                self.save_settings(settings)
+                log("配置文件已升级为新加密格式")
+            except OSError as e:
+                log(f"升级配置文件失败: {e}", "ERROR")
+        return settings
 
     # ==================== Suites ====================
     
@@ -89,18 +142,16 @@ class StorageService:
         test_result = data.get('testResult')
         versions = data.get('versions', [])
         
-        # Create folder name
-        keyword = self._extract_keyword(requirement.get('description', ''))
-        timestamp = datetime.now().strftime('%Y-%m-%d')
-        folder_name = f"{keyword}_{timestamp}"
-        suite_dir = self.result_dir / folder_name
-        suite_dir.mkdir(parents=True, exist_ok=True)
+        # 每次保存使用新的目录，同名时别名自动加后缀
+        suite_dir = self.get_or_create_task_dir(requirement.get('description', ''))
+        folder_name = self.suite_name(suite_dir)
         
         saved_files = []
+        tickets = []
         
         # Save overview markdown
         overview = self._generate_overview_md(prompt_suite, requirement, review, test_result, versions)
-        (suite_dir / '0_概览.md').write_text(overview, encoding='utf-8')
+        tickets.append(self.write_result_file(suite_dir / '0_概览.md', overview))
         saved_files.append('0_概览.md')
         
         # Save each role prompt
@@ -108,16 +159,19 @@ class StorageService:
         for i, role_prompt in enumerate(prompts):
             filename = self._generate_role_filename(i, role_prompt)
             content = self._generate_role_md(role_prompt, prompt_suite.get('system_name', ''))
-            (suite_dir / filename).write_text(content, encoding='utf-8')
+            tickets.append(self.write_result_file(suite_dir / filename, content))
             saved_files.append(filename)
         
-        # Save full JSON data
+        # Save full JSON data (long texts go to the blob store)
         full_data = {**data, 'savedAt': datetime.now().isoformat()}
-        (suite_dir / '_data.json').write_text(
-            json.dumps(full_data, ensure_ascii=False, indent=2),
-            encoding='utf-8'
-        )
+        tickets.append(self.write_result_file(
+            suite_dir / '_data.json',
+            json.dumps(self.pack_suite_data(full_data), ensure_ascii=False, indent=2)
+        ))
         saved_files.append('_data.json')
+        if not self.flush_results(tickets):
+            raise IOError('部分结果文件写入失败')
+        self.index_suite(folder_name, full_data)
         
         return {
             'folder': folder_name,
@@ -131,14 +185,27 @@ class StorageService:
         safe_name = re.sub(r'[<>:"/\\|?*]', '_', role_name)
         return f"{index + 1}_{safe_name}.md"
     
+    @property
+    def layout(self) -> ResultLayout:
+        """Sharded result layout (config/layout.db)."""
+        with self._stores_lock:
+            if self._layout is None:
+                self._layout = ResultLayout(self.config_dir / 'layout.db', self.result_dir)
+            return self._layout
+    
     def get_or_create_task_dir(self, description: str, task_id: str = None) -> Path:
-        """Get or create a directory for task results."""
+        """Get or create the directory for task results (result/YYYY/MM/<task_id>/).
+        
+        The same task ID always gets the same directory; its readable name
+        (<keyword>_<date>) is registered as an alias, see suite_name().
+        """
         keyword = self._extract_keyword(description)
         timestamp = datetime.now().strftime('%Y-%m-%d')
-        folder_name = f"{keyword}_{timestamp}"
-        task_dir = self.result_dir / folder_name
-        task_dir.mkdir(parents=True, exist_ok=True)
-        return task_dir
+        return self.layout.allocate(task_id or uuid.uuid4().hex, f"{keyword}_{timestamp}")
+    
+    def suite_name(self, task_dir: Path) -> str:
+        """Readable suite name of a result directory (used by the suites API)."""
+        return self.layout.name_of(task_dir)
     
     def save_role_prompt_md(
         self, 
@@ -148,7 +215,7 @@ class StorageService:
         role_type: str,
         description: str,
         prompt_content: str
-    ) -> str:
+    ) -> WriteTicket:
         """Save a single role prompt as markdown file immediately.
         
         Args:
@@ -160,7 +227,7 @@ class StorageService:
             prompt_content: The actual prompt content (clean, ready to use)
             
         Returns:
-            The filename that was saved
+            Ticket of the queued write (its path is the saved file)
         """
         # Generate filename
         safe_name = re.sub(r'[<>:"/\\|?*]', '_', role_name)
@@ -176,11 +243,24 @@ class StorageService:
 {prompt_content}
 """
         
-        # Write file
-        filepath = task_dir / filename
-        filepath.write_text(content, encoding='utf-8')
+        # 交给后台写线程，调用方不等待磁盘
+        return self.write_result_file(task_dir / filename, content)
+    
+    def write_result_file(self, path: Path, content: str) -> WriteTicket:
+        """Queue a result file for the background writer (atomic, coalesced per path).
         
-        return filename
+        Returns:
+            Ticket for flush_results()
+        """
+        return get_result_writer().write(path, content)
+    
+    def flush_results(self, tickets: List[WriteTicket], timeout: Optional[float] = None) -> bool:
+        """Wait until the given result file writes are on disk.
+        
+        Returns:
+            True if they were all written, False on timeout or write errors
+        """
+        return get_result_writer().flush(tickets, Config.RESULT_FLUSH_TIMEOUT if timeout is None else timeout)
     
     def _generate_role_md(self, role_prompt: Dict, system_name: str) -> str:
         """Generate markdown content for a role prompt - 直接可复制使用的格式."""
@@ -286,95 +366,149 @@ class StorageService:
 {prompt_suite.get('integration_notes', '')}
 """
 
-    def list_suites(self) -> List[Dict[str, Any]]:
-        """List all saved suites."""
-        if not self.result_dir.exists():
-            return []
+    @property
+    def catalog(self) -> SuiteCatalog:
+        """Suite catalog index (config/catalog.db)."""
+        with self._stores_lock:
+            if self._catalog is None:
+                self._catalog = SuiteCatalog(self.config_dir / 'catalog.db', self.layout, self.read_suite_data)
+            return self._catalog
+    
+    def index_suite(self, folder_name: str, data: Dict[str, Any]) -> None:
+        """Update the catalog entry of a suite whose _data.json was just written."""
+        try:
+            self.catalog.upsert(folder_name, data)
+        except Exception as e:
+            # 索引失败不影响保存，下次对账时补上
+            log(f"更新套件索引失败: {folder_name}: {e}", "ERROR")
+    
+    def query_suites(self, refresh: bool = False, **filters) -> Tuple[List[Dict[str, Any]], int]:
+        """List saved suites from the catalog with sorting, filtering and paging.
         
-        suites = []
-        for folder in self.result_dir.iterdir():
-            if not folder.is_dir():
-                continue
-            
-            data_file = folder / '_data.json'
-            metadata = {'name': folder.name}
-            
-            if data_file.exists():
-                try:
-                    data = json.loads(data_file.read_text(encoding='utf-8'))
-                    prompt_suite = data.get('promptSuite', {})
-                    metadata = {
-                        'name': folder.name,
-                        'systemName': prompt_suite.get('system_name'),
-                        'description': data.get('requirement', {}).get('description'),
-                        'score': data.get('review', {}).get('score') if data.get('review') else None,
-                        'rolesCount': prompt_suite.get('total_roles') or len(prompt_suite.get('prompts', [])),
-                        'savedAt': data.get('savedAt')
-                    }
-                except Exception:
-                    pass
+        Args:
+            refresh: Re-check every folder on disk before querying
+            **filters: See SuiteCatalog.query
             
-            suites.append(metadata)
-        
-        # Sort by savedAt descending
-        suites.sort(key=lambda x: x.get('savedAt', ''), reverse=True)
-        return suites
+        Returns:
+            (suites, total number of matching suites)
+        """
+        if not self.result_dir.exists():
+            return [], 0
+        self.catalog.reconcile(force=refresh)
+        return self.catalog.query(**filters)
+    
+    def search_suites(self, query: str, limit: int = 20, offset: int = 0) -> Tuple[List[Dict[str, Any]], int]:
+        """Full-text search over saved suites (see SuiteCatalog.search)."""
+        if not self.result_dir.exists():
+            return [], 0
+        self.catalog.reconcile()
+        return self.catalog.search(query, limit=limit, offset=offset)
+    
+    def list_suites(self) -> List[Dict[str, Any]]:
+        """List all saved suites, newest first."""
+        return self.query_suites()[0]
     
     def get_suite(self, name: str) -> Optional[Dict[str, Any]]:
         """Get suite details by name."""
-        suite_dir = self.result_dir / name
-        data_file = suite_dir / '_data.json'
-        
-        if not data_file.exists():
+        suite_dir = self.layout.resolve(name)
+        if not suite_dir or not (suite_dir / '_data.json').exists():
             return None
+        return self.read_suite_data(suite_dir)
+    
+    # ==================== Blobs ====================
+    
+    @property
+    def blobs(self) -> BlobStore:
+        """Content-addressed store for long texts of suites (config/blobs)."""
+        with self._stores_lock:
+            if self._blobs is None:
+                self._blobs = BlobStore(self.config_dir / 'blobs')
+            return self._blobs
+    
+    def pack_suite_data(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Suite data for _data.json: long texts replaced by blob references.
         
-        return json.loads(data_file.read_text(encoding='utf-8'))
+        Prompt texts shared with other suites are stored once, and each entry of
+        ``versions`` is delta-encoded against the previous one.
+        """
+        packed = {k: self.blobs.pack(v) for k, v in data.items() if k != 'versions'}
+        if isinstance(data.get('versions'), list):
+            packed['versions'] = self.blobs.pack_chain(data['versions'])
+        return packed
     
-    # ==================== History ====================
+    def read_suite_data(self, suite_dir: Path) -> Dict[str, Any]:
+        """Read a suite's _data.json with blob references resolved."""
+        return self.blobs.unpack(self._read_packed(suite_dir))
     
-    def _get_history_file(self) -> Path:
-        return self.config_dir / 'history.json'
+    def read_suite_fields(self, suite_dir: Path, paths: List[List[str]]) -> Dict[str, Any]:
+        """Selected fields of a suite (see utils.projection).
+        
+        _data.json only holds blob references for long texts, so projecting it
+        before unpacking reads just the blobs of the requested fields.
+        """
+        return self.blobs.unpack(project(self._read_packed(suite_dir), paths, is_leaf=is_blob_ref))
     
-    def _load_history(self) -> List[Dict]:
-        history_file = self._get_history_file()
-        if not history_file.exists():
-            return []
-        try:
-            return json.loads(history_file.read_text(encoding='utf-8'))
-        except Exception:
-            return []
+    def suite_roles(self, suite_dir: Path) -> List[Dict[str, Any]]:
+        """Roles of a suite without their prompt texts, with their index."""
+        return [
+            {'index': i, **self.blobs.unpack({k: v for k, v in p.items() if k != 'prompt'})}
+            for i, p in enumerate(self._packed_prompts(suite_dir))
+        ]
     
-    def _save_history(self, history: List[Dict]) -> None:
-        history_file = self._get_history_file()
-        history_file.write_text(
-            json.dumps(history, ensure_ascii=False, indent=2),
-            encoding='utf-8'
-        )
+    def suite_role(self, suite_dir: Path, role: str) -> Optional[Dict[str, Any]]:
+        """One role of a suite with its prompt, by role_id, role_name or index."""
+        prompts = self._packed_prompts(suite_dir)
+        for key in ('role_id', 'role_name'):
+            for i, p in enumerate(prompts):
+                if p.get(key) == role:
+                    return {'index': i, **self.blobs.unpack(p)}
+        if role.isdigit() and int(role) < len(prompts):
+            return {'index': int(role), **self.blobs.unpack(prompts[int(role)])}
+        return None
+    
+    def _read_packed(self, suite_dir: Path) -> Dict[str, Any]:
+        return json.loads((suite_dir / '_data.json').read_text(encoding='utf-8'))
+    
+    def _packed_prompts(self, suite_dir: Path) -> List[Dict[str, Any]]:
+        prompts = (self._read_packed(suite_dir).get('promptSuite') or {}).get('prompts') or []
+        return [p for p in prompts if isinstance(p, dict)]
+    
+    # ==================== History ====================
+    
+    @property
+    def history(self) -> HistoryStore:
+        """History store (config/history.db); imports a legacy history.json on first use."""
+        with self._stores_lock:
+            if self._history is None:
+                self._history = HistoryStore(self.config_dir / 'history.db')
+                self._history.import_legacy(self.config_dir / 'history.json')
+            return self._history
     
     def add_history(self, record: HistoryRecord) -> HistoryRecord:
         """Add a history record."""
-        history = self._load_history()
-        history.insert(0, record.to_dict())
-        history = history[:100]  # Keep max 100 records
-        self._save_history(history)
-        return record
+        return self.history.add(record)
     
     def get_history(self, limit: int = 50) -> List[HistoryRecord]:
-        """Get history records."""
-        history = self._load_history()
-        return [HistoryRecord.from_dict(h) for h in history[:limit]]
+        """Get the newest history records."""
+        return self.history.page(limit)[0]
+    
+    def page_history(self, limit: int, cursor: Optional[str] = None) -> Tuple[List[HistoryRecord], Optional[str]]:
+        """Get a page of history records, newest first, and the cursor of the next page."""
+        return self.history.page(limit, cursor)
     
     def delete_history(self, record_id: str) -> None:
         """Delete a history record."""
-        history = self._load_history()
-        history = [h for h in history if h.get('id') != record_id]
-        self._save_history(history)
+        self.history.delete(record_id)
     
     def clear_history(self) -> None:
         """Clear all history records."""
-        self._save_history([])
+        self.history.clear()
     
     # ==================== Task Progress (断点恢复) ====================
+    #
+    # 每个任务由快照 <id>.json 和追加日志 <id>.jsonl 组成。检查点只追加一行
+    # 变更记录，日志行数达到阈值时合并为新快照。快照通过临时文件 + rename
+    # 原子替换，并记录已合并的日志序号，合并中途崩溃也不会重复回放。
     
     def _get_tasks_dir(self) -> Path:
         """Get tasks directory for progress tracking."""
@@ -382,30 +516,154 @@ class StorageService:
         tasks_dir.mkdir(parents=True, exist_ok=True)
         return tasks_dir
     
+    def _get_task_files(self, task_id: str) -> Tuple[Path, Path]:
+        """Snapshot and journal paths of a task."""
+        tasks_dir = self._get_tasks_dir()
+        return tasks_dir / f'{task_id}.json', tasks_dir / f'{task_id}.jsonl'
+    
+    def _write_atomic(self, path: Path, content: str) -> None:
+        """Write a file via temp file + fsync + rename so readers never see a partial file."""
+        tmp = path.with_name(f'.{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    
+    def _read_journal(self, journal_file: Path) -> List[Dict[str, Any]]:
+        """Read journal records, skipping a torn last line left by a crash."""
+        if not journal_file.exists():
+            return []
+        records = []
+        with open(journal_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+        return records
+    
+    @staticmethod
+    def _apply_journal_ops(progress: Dict[str, Any], ops: List[Dict[str, Any]]) -> None:
+        """Apply journal ops: put (set value at path) or append (append value to list at path)."""
+        for op in ops:
+            path = op.get('path') or []
+            if not path:
+                continue
+            target = progress
+            for key in path[:-1]:
+                if not isinstance(target.get(key), dict):
+                    target[key] = {}
+                target = target[key]
+            if op.get('op') == 'append':
+                if not isinstance(target.get(path[-1]), list):
+                    target[path[-1]] = []
+                target[path[-1]].append(op.get('value'))
+            else:
+                target[path[-1]] = op.get('value')
+    
     def save_task_progress(self, task_id: str, progress: Dict[str, Any]) -> None:
-        """Save task progress for recovery."""
-        task_file = self._get_tasks_dir() / f'{task_id}.json'
-        progress['updated_at'] = datetime.now().isoformat()
-        task_file.write_text(
-            json.dumps(progress, ensure_ascii=False, indent=2),
-            encoding='utf-8'
-        )
+        """Save a full progress snapshot for recovery (supersedes the journal)."""
+        snapshot_file, journal_file = self._get_task_files(task_id)
+        with self._journal_lock:
+            progress['updated_at'] = datetime.now().isoformat()
+            progress['journal_seq'] = self._journal_seq.get(task_id, progress.get('journal_seq', 0))
+            self._journal_seq[task_id] = progress['journal_seq']
+            self._write_atomic(snapshot_file, json.dumps(progress, ensure_ascii=False))
+            if journal_file.exists():
+                journal_file.unlink()
+            self._journal_lines[task_id] = 0
+    
+    def append_task_progress(self, task_id: str, ops: List[Dict[str, Any]]) -> None:
+        """Append a checkpoint to the task journal (增量保存).
+        
+        Args:
+            task_id: Task ID
+            ops: Journal ops, e.g. {'op': 'put', 'path': ['role_results', '2'], 'value': {...}}
+                 or {'op': 'append', 'path': ['usage', 'records'], 'value': {...}}
+        """
+        if not ops:
+            return
+        snapshot_file, journal_file = self._get_task_files(task_id)
+        with self._journal_lock:
+            if task_id not in self._journal_seq:
+                self._load_journal_state(task_id)
+            seq = self._journal_seq[task_id] + 1
+            record = {'seq': seq, 'ts': datetime.now().isoformat(), 'ops': ops}
+            with open(journal_file, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            self._journal_seq[task_id] = seq
+            self._journal_lines[task_id] = self._journal_lines.get(task_id, 0) + 1
+            should_compact = self._journal_lines[task_id] >= Config.TASK_JOURNAL_COMPACT_LINES
+        
+        if should_compact:
+            self.compact_task_progress(task_id)
+    
+    def _load_journal_state(self, task_id: str) -> None:
+        """Initialize the in-memory journal sequence and line count from disk (needs _journal_lock)."""
+        snapshot_file, journal_file = self._get_task_files(task_id)
+        seq = 0
+        if snapshot_file.exists():
+            try:
+                seq = json.loads(snapshot_file.read_text(encoding='utf-8')).get('journal_seq', 0)
+            except Exception:
+                pass
+        
+        # 截掉崩溃留下的半行，避免后续追加的记录与其粘连
+        if journal_file.exists():
+            with open(journal_file, 'rb+') as f:
+                data = f.read()
+                if data and not data.endswith(b'\n'):
+                    f.truncate(data.rfind(b'\n') + 1)
+        
+        records = self._read_journal(journal_file)
+        self._journal_seq[task_id] = max([seq] + [r.get('seq', 0) for r in records])
+        self._journal_lines[task_id] = len(records)
+    
+    def compact_task_progress(self, task_id: str) -> None:
+        """Merge the journal into a new snapshot."""
+        with self._journal_lock:
+            progress = self.load_task_progress(task_id)
+            if progress is None:
+                return
+            lines = self._journal_lines.get(task_id, 0)
+            self.save_task_progress(task_id, progress)
+        log(f"任务 {task_id} 进度日志已合并 ({lines} 条)")
     
     def load_task_progress(self, task_id: str) -> Optional[Dict[str, Any]]:
-        """Load task progress for recovery."""
-        task_file = self._get_tasks_dir() / f'{task_id}.json'
-        if not task_file.exists():
-            return None
-        try:
-            return json.loads(task_file.read_text(encoding='utf-8'))
-        except Exception:
+        """Load task progress for recovery (snapshot + journal replay)."""
+        snapshot_file, journal_file = self._get_task_files(task_id)
+        with self._journal_lock:
+            progress = None
+            if snapshot_file.exists():
+                try:
+                    progress = json.loads(snapshot_file.read_text(encoding='utf-8'))
+                except Exception:
+                    progress = None
+            records = self._read_journal(journal_file)
+        
+        if progress is None and not records:
             return None
+        progress = progress or {}
+        applied_seq = progress.get('journal_seq', 0)
+        for record in records:
+            if record.get('seq', 0) <= applied_seq:
+                continue  # 已合并进快照
+            self._apply_journal_ops(progress, record.get('ops', []))
+            progress['updated_at'] = record.get('ts', progress.get('updated_at'))
+            progress['journal_seq'] = record.get('seq', 0)
+        return progress
     
     def delete_task_progress(self, task_id: str) -> None:
-        """Delete task progress file after completion."""
-        task_file = self._get_tasks_dir() / f'{task_id}.json'
-        if task_file.exists():
-            task_file.unlink()
+        """Delete task progress files after completion."""
+        with self._journal_lock:
+            for task_file in self._get_task_files(task_id):
+                if task_file.exists():
+                    task_file.unlink()
+            self._journal_seq.pop(task_id, None)
+            self._journal_lines.pop(task_id, None)
     
     def list_incomplete_tasks(self) -> List[Dict[str, Any]]:
         """List all incomplete tasks that can be resumed."""
@@ -413,13 +671,14 @@ class StorageService:
         if not tasks_dir.exists():
             return []
         
+        task_ids = {f.stem for f in tasks_dir.glob('*.json')} | {f.stem for f in tasks_dir.glob('*.jsonl')}
         tasks = []
-        for task_file in tasks_dir.glob('*.json'):
+        for task_id in task_ids:
             try:
-                data = json.loads(task_file.read_text(encoding='utf-8'))
-                if data.get('status') not in ('completed', 'cancelled'):
+                data = self.load_task_progress(task_id)
+                if data and data.get('status') not in ('completed', 'cancelled'):
                     tasks.append({
-                        'task_id': task_file.stem,
+                        'task_id': task_id,
                         'description': data.get('description', ''),
                         'status': data.get('status', 'unknown'),
                         'completed_roles': len([r for r in data.get('role_results', {}).values() if r]),
@@ -434,11 +693,40 @@ class StorageService:
     
     def save_role_result(self, task_id: str, role_index: int, role_prompt: Dict) -> None:
         """Save individual role result (增量保存)."""
-        progress = self.load_task_progress(task_id) or {}
-        if 'role_results' not in progress:
-            progress['role_results'] = {}
-        progress['role_results'][str(role_index)] = role_prompt
-        self.save_task_progress(task_id, progress)
+        self.append_task_progress(task_id, [
+            {'op': 'put', 'path': ['role_results', str(role_index)], 'value': role_prompt}
+        ])
+
+    
+    # ==================== Finished Task Snapshots ====================
+    
+    def _get_finished_dir(self) -> Path:
+        """Get directory for snapshots of finished tasks."""
+        finished_dir = self.config_dir / 'finished'
+        finished_dir.mkdir(parents=True, exist_ok=True)
+        return finished_dir
+    
+    def save_task_snapshot(self, task_id: str, snapshot: Dict[str, Any]) -> None:
+        """Save the final state of a finished task, keeping the newest PIPELINE_SNAPSHOT_KEEP."""
+        finished_dir = self._get_finished_dir()
+        self._write_atomic(finished_dir / f'{task_id}.json', json.dumps(snapshot, ensure_ascii=False))
+        
+        files = sorted(finished_dir.glob('*.json'), key=lambda f: f.stat().st_mtime, reverse=True)
+        for old in files[Config.PIPELINE_SNAPSHOT_KEEP:]:
+            try:
+                old.unlink()
+            except OSError:
+                pass
+    
+    def load_task_snapshot(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """Load the final state of a finished task."""
+        snapshot_file = self._get_finished_dir() / f'{task_id}.json'
+        if not snapshot_file.exists():
+            return None
+        try:
+            return json.loads(snapshot_file.read_text(encoding='utf-8'))
+        except (json.JSONDecodeError, OSError):
+            return None
 
 
 # Global instance
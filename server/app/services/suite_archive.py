@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+"""Streaming ZIP export and import of suites.
+
+Export writes the archive into a small in-memory sink and yields its bytes after every
+chunk, so memory stays at about one chunk no matter how many suites are exported and
+nothing is staged on disk. Entries use data descriptors (sizes after the data), which
+zipfile does by itself for a non-seekable output.
+
+Import parses the local file headers of an uploaded archive as it arrives and writes
+each entry straight into a newly allocated result folder; the central directory at the
+end is not needed. Archives from the export (deflated entries) and from common zip
+tools are supported.
+"""
+
+import io
+import os
+import json
+import uuid
+import zlib
+import struct
+import zipfile
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, IO, Iterable, Iterator, List, Optional, Tuple
+
+from app.config import Config
+from app.services.result_layout import ALIAS_FILE
+
+
+def log(msg: str, level: str = "INFO"):
+    """打印带时间戳的日志"""
+    timestamp = datetime.now().strftime("%H:%M:%S.%f")[:-3]
+    print(f"[{timestamp}] [Archive] [{level}] {msg}", flush=True)
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only, non-seekable buffer drained by the export generator."""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks: List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def drain(self) -> bytes:
+        data, self._chunks = b''.join(self._chunks), []
+        return data
+
+
+def _export_files(storage, name: str, folder: Path) -> Iterator[Tuple[str, Optional[Path], Optional[bytes]]]:
+    """(archive path, file to copy or None, in-memory content or None) of one suite."""
+    for path in sorted(folder.iterdir()):
+        if not path.is_file() or path.name.startswith('.') or path.name == ALIAS_FILE:
+            continue
+        if path.name == '_data.json':
+            # 导出完整数据（解析 blob 引用），压缩包可独立使用
+            data = storage.read_suite_data(folder)
+            yield f'{name}/_data.json', None, json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8')
+        else:
+            yield f'{name}/{path.name}', path, None
+
+
+def iter_export(storage, names: Iterable[str], chunk_size: Optional[int] = None) -> Iterator[bytes]:
+    """Stream a ZIP archive of suites, one folder per suite.
+
+    Args:
+        storage: StorageService
+        names: Suite names; unknown names are skipped
+        chunk_size: Bytes read from disk at a time (default EXPORT_CHUNK_SIZE)
+
+    Yields:
+        Consecutive pieces of the archive
+    """
+    chunk_size = chunk_size or Config.EXPORT_CHUNK_SIZE
+    sink = _ChunkSink()
+    count = 0
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for name in names:
+            folder = storage.layout.resolve(name)
+            if not folder or not folder.is_dir():
+                continue
+            for arcname, path, content in _export_files(storage, name, folder):
+                if content is not None:
+                    archive.writestr(arcname, content)
+                    yield sink.drain()
+                    continue
+                info = zipfile.ZipInfo.from_file(path, arcname)
+                info.compress_type = zipfile.ZIP_DEFLATED
+                with open(path, 'rb') as src, archive.open(info, 'w', force_zip64=info.file_size > 2**31) as dest:
+                    while True:
+                        block = src.read(chunk_size)
+                        if not block:
+                            break
+                        dest.write(block)
+                        data = sink.drain()
+                        if data:
+                            yield data
+                yield sink.drain()
+            count += 1
+    # 中央目录在 close 时写出
+    yield sink.drain()
+    log(f"已导出 {count} 个套件")
+
+
+# ==================== Import ====================
+
+_LOCAL_HEADER = b'PK\x03\x04'
+_DESCRIPTOR = b'PK\x07\x08'
+_CENTRAL_HEADERS = (b'PK\x01\x02', b'PK\x05\x06', b'PK\x06\x06')
+
+
+class _StreamReader:
+    """Exact reads from a request stream, with push-back of over-read bytes."""
+
+    def __init__(self, stream: IO[bytes], chunk_size: int):
+        self._stream = stream
+        self._chunk_size = chunk_size
+        self._buffer = b''
+
+    def read(self, n: int) -> bytes:
+        """Up to n bytes (fewer only at end of stream)."""
+        while len(self._buffer) < n:
+            chunk = self._stream.read(max(self._chunk_size, n - len(self._buffer)))
+            if not chunk:
+                break
+            self._buffer += chunk
+        data, self._buffer = self._buffer[:n], self._buffer[n:]
+        return data
+
+    def read_exact(self, n: int) -> bytes:
+        data = self.read(n)
+        if len(data) != n:
+            raise ValueError('压缩包不完整')
+        return data
+
+    def read_some(self) -> bytes:
+        """Buffered bytes, or the next chunk of the stream."""
+        if self._buffer:
+            data, self._buffer = self._buffer, b''
+            return data
+        return self._stream.read(self._chunk_size)
+
+    def unread(self, data: bytes) -> None:
+        self._buffer = data + self._buffer
+
+
+def _iter_entries(reader: _StreamReader) -> Iterator[Tuple[str, Iterator[bytes]]]:
+    """Entries of a ZIP stream as (name, iterator over decompressed chunks).
+
+    Each chunk iterator must be consumed before advancing to the next entry.
+    """
+    while True:
+        signature = reader.read(4)
+        if not signature or signature in _CENTRAL_HEADERS:
+            return
+        if signature != _LOCAL_HEADER:
+            raise ValueError('不是有效的 ZIP 文件')
+
+        (_, flags, method, _, _, _, comp_size, size, name_len, extra_len) = struct.unpack(
+            '<HHHHHIIIHH', reader.read_exact(26)
+        )
+        raw_name = reader.read_exact(name_len)
+        extra = reader.read_exact(extra_len)
+        name = raw_name.decode('utf-8' if flags & 0x800 else 'cp437')
+        zip64 = _zip64_extra(extra)
+        if zip64 and (comp_size == 0xFFFFFFFF or size == 0xFFFFFFFF):
+            size, comp_size = struct.unpack('<QQ', zip64[:16])
+        has_descriptor = bool(flags & 0x08)
+
+        if flags & 0x01:
+            raise ValueError(f'不支持加密的文件: {name}')
+        if method not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+            raise ValueError(f'不支持的压缩方式: {name}')
+        if method == zipfile.ZIP_STORED and has_descriptor:
+            raise ValueError(f'不支持的存储格式: {name}')
+
+        yield name, _iter_data(reader, method, comp_size, has_descriptor)
+        if has_descriptor:
+            _skip_descriptor(reader, bool(zip64))
+
+
+def _zip64_extra(extra: bytes) -> Optional[bytes]:
+    """Body of the zip64 extra field (header ID 1), if present."""
+    pos = 0
+    while pos + 4 <= len(extra):
+        header_id, length = struct.unpack('<HH', extra[pos:pos + 4])
+        if header_id == 1:
+            return extra[pos + 4:pos + 4 + length] or b'\0'
+        pos += 4 + length
+    return None
+
+
+def _iter_data(reader: _StreamReader, method: int, comp_size: int, has_descriptor: bool) -> Iterator[bytes]:
+    if method == zipfile.ZIP_STORED:
+        remaining = comp_size
+        while remaining:
+            data = reader.read(min(remaining, Config.EXPORT_CHUNK_SIZE))
+            if not data:
+                raise ValueError('压缩包不完整')
+            remaining -= len(data)
+            yield data
+        return
+
+    # deflate 流自带结束标记，用它确定条目边界（带数据描述符时头部没有长度）
+    decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+    remaining = None if has_descriptor else comp_size
+    while not decompressor.eof:
+        data = reader.read_some() if remaining is None else reader.read(min(remaining, Config.EXPORT_CHUNK_SIZE))
+        if not data:
+            raise ValueError('压缩包不完整')
+        if remaining is not None:
+            remaining -= len(data)
+        out = decompressor.decompress(data)
+        if out:
+            yield out
+    if decompressor.unused_data:
+        reader.unread(decompressor.unused_data)
+
+
+def _skip_descriptor(reader: _StreamReader, zip64: bool) -> None:
+    head = reader.read_exact(4)
+    if head != _DESCRIPTOR:
+        reader.unread(head)  # 签名可省略
+    reader.read_exact(4 + (16 if zip64 else 8))
+
+
+def _safe_parts(name: str) -> Optional[Tuple[str, str]]:
+    """(suite folder, file name) of an archive path, None for anything else."""
+    parts = [p for p in name.replace('\\', '/').split('/') if p]
+    if len(parts) != 2 or any(p in ('.', '..') for p in parts) or parts[1].startswith('.'):
+        return None
+    if parts[1] == ALIAS_FILE:
+        return None
+    return parts[0], parts[1]
+
+
+def import_stream(storage, stream: IO[bytes]) -> List[Dict[str, Any]]:
+    """Import suites from a ZIP stream (layout of the export: <suite>/<file>).
+
+    Every suite gets a new result folder; its name is kept unless it is taken, in
+    which case a suffix is added. Suites are indexed once their files are written.
+
+    Returns:
+        {'name': original name, 'folder': imported name, 'files': count} per suite
+    """
+    reader = _StreamReader(stream, Config.EXPORT_CHUNK_SIZE)
+    folders: Dict[str, Path] = {}
+    counts: Dict[str, int] = {}
+    total = 0
+
+    try:
+        for name, chunks in _iter_entries(reader):
+            parts = _safe_parts(name)
+            if not parts:
+                for _ in chunks:  # 跳过目录和无关条目
+                    pass
+                continue
+            suite, filename = parts
+            if suite not in folders:
+                folders[suite] = storage.layout.allocate(uuid.uuid4().hex, suite)
+            target = folders[suite] / filename
+            tmp = target.with_name(f'.{filename}.{os.getpid()}.tmp')
+            try:
+                with open(tmp, 'wb') as f:
+                    for chunk in chunks:
+                        total += len(chunk)
+                        if total > Config.IMPORT_MAX_BYTES:
+                            raise ValueError('导入内容超过大小限制')
+                        f.write(chunk)
+                os.replace(tmp, target)
+            finally:
+                if tmp.exists():
+                    tmp.unlink()
+            counts[suite] = counts.get(suite, 0) + 1
+    except Exception:
+        # 导入失败：撤销已创建的目录
+        for folder in folders.values():
+            storage.layout.release(folder)
+        raise
+
+    results = []
+    for suite, folder in folders.items():
+        folder_name = storage.layout.name_of(folder)
+        data_file = folder / '_data.json'
+        if data_file.exists():
+            try:
+                data = storage.read_suite_data(folder)
+                # 与本机保存的套件一样把长文本放入 blob 库
+                ticket = storage.write_result_file(
+                    data_file, json.dumps(storage.pack_suite_data(data), ensure_ascii=False, indent=2)
+                )
+                if not storage.flush_results([ticket]):
+                    raise IOError(f'写入失败: {data_file}')
+                storage.index_suite(folder_name, data)
+            except (ValueError, KeyError) as e:
+                log(f"套件数据无效: {suite}: {e}", "WARN")
+        results.append({'name': suite, 'folder': folder_name, 'files': counts.get(suite, 0)})
+    log(f"已导入 {len(results)} 个套件")
+    return results
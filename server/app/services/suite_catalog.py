@@ -0,0 +1,360 @@
+# -*- coding: utf-8 -*-
+"""Indexed catalog of saved suites (SQLite).
+
+Listing suites used to parse every result/<folder>/_data.json on each request. The
+catalog keeps one row of list metadata per suite in config/catalog.db. Saving a suite
+updates its row directly. Folders added, edited or removed by hand are picked up by
+reconciliation: it runs when the layout's directory mtimes change (or every
+CATALOG_RECONCILE_INTERVAL seconds) and re-parses only the folders whose _data.json
+mtime differs from the indexed one.
+
+The same database holds an FTS5 full-text index over system names, descriptions, role
+names and prompt bodies. Text is pre-tokenized (CJK bigrams, English words, see
+app.utils.text_search) so Chinese search works without a custom SQLite tokenizer.
+"""
+
+import json
+import time
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.config import Config
+from app.services.result_layout import ResultLayout
+from app.utils.text_search import highlight, match_expression, query_terms, tokenize
+
+
+def log(msg: str, level: str = "INFO"):
+    """打印带时间戳的日志"""
+    timestamp = datetime.now().strftime("%H:%M:%S.%f")[:-3]
+    print(f"[{timestamp}] [Catalog] [{level}] {msg}", flush=True)
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS suites (
+    name TEXT PRIMARY KEY,
+    system_name TEXT,
+    description TEXT,
+    score REAL,
+    roles_count INTEGER,
+    saved_at TEXT,
+    data_mtime INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_suites_saved_at ON suites (saved_at);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# 全文索引：rowid 与 suites 表的 rowid 对应；分词后的文本用于匹配，原文（JSON，不索引）用于生成高亮片段
+_SEARCH_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS suite_search USING fts5(
+    name UNINDEXED, system_name, description, roles, prompts, raw UNINDEXED,
+    tokenize = 'unicode61'
+);
+"""
+
+# bm25 列权重，顺序与 suite_search 的列一致
+_SEARCH_WEIGHTS = (0.0, 5.0, 3.0, 3.0, 1.0, 0.0)
+
+# API 排序字段 -> 列名
+SORT_COLUMNS = {
+    'savedAt': 'saved_at',
+    'name': 'name',
+    'systemName': 'system_name',
+    'score': 'score',
+    'rolesCount': 'roles_count'
+}
+
+
+def suite_metadata(name: str, data: Dict[str, Any]) -> Dict[str, Any]:
+    """List metadata of a suite from its _data.json content."""
+    prompt_suite = data.get('promptSuite') or {}
+    return {
+        'name': name,
+        'systemName': prompt_suite.get('system_name'),
+        'description': (data.get('requirement') or {}).get('description'),
+        'score': data.get('review', {}).get('score') if data.get('review') else None,
+        'rolesCount': prompt_suite.get('total_roles') or len(prompt_suite.get('prompts', [])),
+        'savedAt': data.get('savedAt')
+    }
+
+
+def _data_mtime(folder: Path) -> int:
+    """mtime (ns) of a folder's _data.json, 0 if it has none."""
+    try:
+        return (folder / '_data.json').stat().st_mtime_ns
+    except OSError:
+        return 0
+
+
+class SuiteCatalog:
+    """Suite list metadata indexed in SQLite, kept in sync with the result directory."""
+
+    def __init__(
+        self,
+        db_path: Path,
+        layout: ResultLayout,
+        load_data: Optional[Callable[[Path], Optional[Dict[str, Any]]]] = None
+    ):
+        self.db_path = db_path
+        self.layout = layout
+        # 读取文件夹的 _data.json（默认直接解析；存储服务会传入解析 blob 引用的版本）
+        self._load_data = load_data or (lambda folder: json.loads((folder / '_data.json').read_text(encoding='utf-8')))
+        self._conn = sqlite3.connect(str(db_path), timeout=10, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(_SCHEMA)
+        if not self._conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'suite_search'").fetchone():
+            self._conn.executescript(_SEARCH_SCHEMA)
+            # 新建的全文索引为空：让下次对账重新解析所有文件夹
+            self._conn.execute('UPDATE suites SET data_mtime = -1')
+        self._lock = threading.Lock()
+        self._checked_at = 0.0  # 上次对账时间（monotonic）
+
+    def upsert(self, name: str, data: Optional[Dict[str, Any]], data_mtime: Optional[int] = None) -> None:
+        """Index or re-index one suite folder.
+
+        Args:
+            name: Suite name (see ResultLayout)
+            data: Parsed _data.json, or None for a folder without one
+            data_mtime: mtime (ns) of the _data.json the data came from; read from disk if None
+        """
+        if data_mtime is None:
+            folder = self.layout.resolve(name)
+            data_mtime = _data_mtime(folder) if folder else 0
+        with self._lock:
+            self._write_locked(lambda: self._upsert_locked(name, data, data_mtime))
+
+    def _write_locked(self, apply) -> None:
+        self._conn.execute('BEGIN')
+        try:
+            apply()
+            self._conn.execute('COMMIT')
+        except Exception:
+            self._conn.execute('ROLLBACK')
+            raise
+
+    def _upsert_locked(self, name: str, data: Optional[Dict[str, Any]], data_mtime: int) -> None:
+        meta = suite_metadata(name, data) if data else {'name': name}
+        self._delete_search_locked([name])
+        rowid = self._conn.execute(
+            'INSERT OR REPLACE INTO suites (name, system_name, description, score, roles_count, saved_at, data_mtime) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (name, meta.get('systemName'), meta.get('description'), meta.get('score'),
+             meta.get('rolesCount'), meta.get('savedAt'), data_mtime)
+        ).lastrowid
+        if data:
+            self._conn.execute('INSERT INTO suite_search (rowid, name, system_name, description, roles, prompts, raw) '
+                               'VALUES (?, ?, ?, ?, ?, ?, ?)', (rowid,) + self._search_row(name, data))
+
+    @staticmethod
+    def _search_row(name: str, data: Dict[str, Any]) -> tuple:
+        """Full-text index row of a suite: tokenized columns plus the raw text for snippets."""
+        prompt_suite = data.get('promptSuite') or {}
+        roles = [
+            {'name': p.get('role_name') or p.get('role_id') or '', 'prompt': p.get('prompt') or ''}
+            for p in prompt_suite.get('prompts') or [] if isinstance(p, dict)
+        ]
+        raw = {
+            'systemName': prompt_suite.get('system_name') or '',
+            'description': (data.get('requirement') or {}).get('description') or '',
+            'roles': roles
+        }
+        return (
+            name,
+            tokenize(raw['systemName']),
+            tokenize(raw['description']),
+            tokenize(' '.join(r['name'] for r in roles)),
+            tokenize('\n'.join(r['prompt'] for r in roles)),
+            json.dumps(raw, ensure_ascii=False)
+        )
+
+    def _delete_search_locked(self, names: List[str]) -> None:
+        # 按 rowid 删除；按 name（不索引的列）删除需要扫描整个全文索引
+        self._conn.executemany(
+            'DELETE FROM suite_search WHERE rowid = (SELECT rowid FROM suites WHERE name = ?)', [(n,) for n in names]
+        )
+
+    def remove(self, name: str) -> None:
+        """Drop a suite from the index."""
+        with self._lock:
+            self._delete_search_locked([name])
+            self._conn.execute('DELETE FROM suites WHERE name = ?', (name,))
+
+    def reconcile(self, force: bool = False) -> None:
+        """Sync the index with folders changed outside the app.
+
+        Skipped unless forced, a directory of the layout changed, or
+        CATALOG_RECONCILE_INTERVAL seconds passed since the last check.
+        """
+        try:
+            signature = self.layout.signature()
+        except OSError:
+            return
+        now = time.monotonic()
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'layout_signature'").fetchone()
+            stale = now - self._checked_at > Config.CATALOG_RECONCILE_INTERVAL
+            if not force and not stale and row and row[0] == signature:
+                return
+            indexed = dict(self._conn.execute('SELECT name, data_mtime FROM suites').fetchall())
+            self._checked_at = now
+
+        # 只比较 _data.json 的 mtime，变化的文件夹才重新解析
+        changed: List[Tuple[str, Optional[Dict[str, Any]], int]] = []
+        present = set()
+        for name, folder in self.layout.suite_dirs():
+            present.add(name)
+            mtime = _data_mtime(folder)
+            if indexed.get(name) == mtime:
+                continue
+            data = None
+            if mtime:
+                try:
+                    data = self._load_data(folder)
+                except Exception:
+                    data = None
+            changed.append((name, data, mtime))
+        removed = [name for name in indexed if name not in present]
+
+        def apply():
+            for name, data, mtime in changed:
+                self._upsert_locked(name, data, mtime)
+            self._delete_search_locked(removed)
+            self._conn.executemany('DELETE FROM suites WHERE name = ?', [(name,) for name in removed])
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('layout_signature', ?)", (signature,))
+
+        # 一个事务写入所有变更
+        with self._lock:
+            self._write_locked(apply)
+        if changed or removed:
+            log(f"套件目录对账: 更新 {len(changed)} 个, 移除 {len(removed)} 个")
+
+    def query(
+        self,
+        sort: str = 'savedAt',
+        order: str = 'desc',
+        q: Optional[str] = None,
+        min_score: Optional[float] = None,
+        saved_from: Optional[str] = None,
+        saved_to: Optional[str] = None,
+        limit: Optional[int] = None,
+        offset: int = 0
+    ) -> Tuple[List[Dict[str, Any]], int]:
+        """List suites from the index.
+
+        Args:
+            sort: One of SORT_COLUMNS
+            order: 'asc' or 'desc'; suites missing the sort value always come last
+            q: Case-insensitive substring of the name, system name or description
+            min_score: Only suites reviewed with at least this score
+            saved_from: Only suites saved at or after this ISO date/time
+            saved_to: Only suites saved before this ISO date/time
+            limit: Page size, None for all
+            offset: Number of suites to skip
+
+        Returns:
+            (page of suite metadata, total number of matching suites)
+        """
+        column = SORT_COLUMNS.get(sort)
+        if not column:
+            raise ValueError(f'不支持的排序字段: {sort}')
+        direction = 'ASC' if order == 'asc' else 'DESC'
+
+        where, params = [], []
+        if q:
+            pattern = '%' + q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            where.append("(name LIKE ? ESCAPE '\\' OR system_name LIKE ? ESCAPE '\\' OR description LIKE ? ESCAPE '\\')")
+            params += [pattern] * 3
+        if min_score is not None:
+            where.append('score >= ?')
+            params.append(min_score)
+        if saved_from:
+            where.append('saved_at >= ?')
+            params.append(saved_from)
+        if saved_to:
+            where.append('saved_at < ?')
+            params.append(saved_to)
+        clause = f" WHERE {' AND '.join(where)}" if where else ''
+
+        with self._lock:
+            total = self._conn.execute(f'SELECT COUNT(*) FROM suites{clause}', params).fetchone()[0]
+            rows = self._conn.execute(
+                f'SELECT name, system_name, description, score, roles_count, saved_at FROM suites{clause} '
+                f'ORDER BY {column} IS NULL, {column} {direction}, name LIMIT ? OFFSET ?',
+                params + [-1 if limit is None else limit, offset]
+            ).fetchall()
+
+        suites = []
+        for name, system_name, description, score, roles_count, saved_at in rows:
+            if roles_count is None:
+                suites.append({'name': name})  # 没有 _data.json 的文件夹
+                continue
+            suites.append({
+                'name': name,
+                'systemName': system_name,
+                'description': description,
+                'score': score,
+                'rolesCount': roles_count,
+                'savedAt': saved_at
+            })
+        return suites, total
+
+    def search(self, query: str, limit: int = 20, offset: int = 0) -> Tuple[List[Dict[str, Any]], int]:
+        """Full-text search, best matches first.
+
+        Every term of the query must occur in the suite (system name, description,
+        role names or prompts). Each result carries the suite's list metadata plus
+        ``highlights``: HTML-escaped snippets with matches wrapped in <mark>, one per
+        matching field or role prompt.
+
+        Returns:
+            (page of results, total number of matching suites)
+        """
+        expression = match_expression(query)
+        if not expression:
+            return [], 0
+        weights = ', '.join(str(w) for w in _SEARCH_WEIGHTS)
+        with self._lock:
+            total = self._conn.execute(
+                'SELECT COUNT(*) FROM suite_search WHERE suite_search MATCH ?', (expression,)
+            ).fetchone()[0]
+            rows = self._conn.execute(
+                f'SELECT f.name, f.raw, s.system_name, s.description, s.score, s.roles_count, s.saved_at, '
+                f'bm25(suite_search, {weights}) AS rank '
+                f'FROM suite_search f JOIN suites s ON s.rowid = f.rowid '
+                f'WHERE suite_search MATCH ? ORDER BY rank LIMIT ? OFFSET ?',
+                (expression, limit, offset)
+            ).fetchall()
+
+        terms = query_terms(query)
+        results = []
+        for name, raw, system_name, description, score, roles_count, saved_at, rank in rows:
+            raw = json.loads(raw)
+            highlights = []
+            for field in ('systemName', 'description'):
+                snippet = highlight(raw[field], terms)
+                if snippet:
+                    highlights.append({'field': field, 'snippet': snippet})
+            for role in raw['roles']:
+                snippet = highlight(role['name'], terms)
+                if snippet:
+                    highlights.append({'field': 'roleName', 'role': role['name'], 'snippet': snippet})
+                snippet = highlight(role['prompt'], terms)
+                if snippet:
+                    highlights.append({'field': 'prompt', 'role': role['name'], 'snippet': snippet})
+            results.append({
+                'name': name,
+                'systemName': system_name,
+                'description': description,
+                'score': score,
+                'rolesCount': roles_count,
+                'savedAt': saved_at,
+                'rank': round(-rank, 4),
+                'highlights': highlights[:Config.SEARCH_MAX_HIGHLIGHTS]
+            })
+        return results, total
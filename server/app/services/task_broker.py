@@ -0,0 +1,489 @@
+# -*- coding: utf-8 -*-
+"""Task state and events shared between worker processes (SQLite broker).
+
+With several server workers (e.g. gunicorn -w 4) a task runs in the worker that
+received /start. That worker mirrors the task's events and state into a local SQLite
+database; any other worker serves status, streams and control for the task through a
+RemotePipeline proxy that reads the database and queues control commands for the owner.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from app.config import Config
+from app.models.pipeline import PipelineEvent
+from app.services.event_bus import EventBus
+from app.services.storage_service import get_storage_service
+from app.services.usage_ledger import usage_from_progress
+
+
+def log(msg: str, level: str = "INFO"):
+    """打印带时间戳的日志"""
+    timestamp = datetime.now().strftime("%H:%M:%S.%f")[:-3]
+    print(f"[{timestamp}] [Broker] [{level}] {msg}", flush=True)
+
+
+TERMINAL_EVENTS = ('pipeline_completed', 'pipeline_error', 'pipeline_cancelled')
+CONTROL_ACTIONS = ('pause', 'resume', 'cancel')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    task_id TEXT PRIMARY KEY,
+    owner_pid INTEGER NOT NULL,
+    version INTEGER NOT NULL DEFAULT 0,
+    state TEXT,
+    status TEXT,
+    finished INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS events (
+    task_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    data TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    PRIMARY KEY (task_id, seq)
+);
+CREATE TABLE IF NOT EXISTS prompts (
+    task_id TEXT NOT NULL,
+    role_index INTEGER NOT NULL,
+    prompt TEXT,
+    PRIMARY KEY (task_id, role_index)
+);
+CREATE TABLE IF NOT EXISTS commands (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    task_id TEXT NOT NULL,
+    action TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class TaskBroker:
+    """SQLite-backed task registry shared by all worker processes on one host."""
+
+    POLL_INTERVAL = 0.2  # 跨进程事件、命令的轮询间隔（秒）
+
+    def __init__(self, db_path: Optional[Path] = None):
+        self.db_path = Path(db_path or Config.CONFIG_DIR / 'broker.db')
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.db_path), timeout=10, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+        self._owned: Dict[str, Any] = {}  # 本进程运行的任务
+        self._remotes: Dict[str, 'RemotePipeline'] = {}
+        self._poll_thread: Optional[threading.Thread] = None  # 所有远程任务共用一个轮询线程
+        self._command_thread: Optional[threading.Thread] = None
+        # 事件与状态写入队列，由 broker-writer 线程批量写入（不阻塞发布事件的线程）
+        self._queue: List[tuple] = []
+        self._queue_cond = threading.Condition()
+        self._writer_thread: Optional[threading.Thread] = None
+        self._written_prompts: Dict[str, Dict[int, Optional[str]]] = {}  # 已写入的提示词，变化时才重写
+
+    def _query(self, sql: str, params: tuple = ()) -> List[tuple]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    # ==================== Owner side ====================
+
+    def claim(self, task_id: str) -> bool:
+        """Reserve a task for this process unless a live worker is already running it.
+        
+        The check and the reservation happen in one write transaction, so two workers
+        recovering the same task cannot both succeed.
+        """
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._conn.execute(
+                    'SELECT owner_pid, finished FROM tasks WHERE task_id = ?', (task_id,)
+                ).fetchone()
+                if row and not row[1] and row[0] != os.getpid() and _pid_alive(row[0]):
+                    self._conn.execute('ROLLBACK')
+                    return False
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO tasks (task_id, owner_pid, version, state, status, finished, updated_at) '
+                    'VALUES (?, ?, 0, NULL, NULL, 0, ?)',
+                    (task_id, os.getpid(), time.time())
+                )
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+        return True
+    
+    def release(self, task_id: str) -> None:
+        """Drop a reservation made by claim() when the task did not start."""
+        self._query('DELETE FROM tasks WHERE task_id = ? AND owner_pid = ? AND finished = 0', (task_id, os.getpid()))
+    
+    def attach(self, task_id: str, pipeline) -> None:
+        """Publish a pipeline running in this process to the other workers."""
+        # 写入由后台线程按顺序完成；replay 在写入时读取，与监听到的事件按序号去重
+        self._enqueue(('attach', task_id, pipeline, None))
+        pipeline.events.add_listener(lambda event: self._enqueue(('event', task_id, pipeline, event)))
+        with self._lock:
+            self._owned[task_id] = pipeline
+            if self._command_thread is None:
+                self._command_thread = threading.Thread(target=self._command_loop, name='broker-commands', daemon=True)
+                self._command_thread.start()
+
+    def detach(self, task_id: str) -> None:
+        """Mark a task finished (its final state is then served from the on-disk snapshot)."""
+        with self._lock:
+            pipeline = self._owned.pop(task_id, None)
+        if pipeline:
+            self._enqueue(('detach', task_id, pipeline, None))
+
+    def _enqueue(self, item: tuple) -> None:
+        """Hand a write to the writer thread (called on the publishing thread, must stay cheap)."""
+        with self._queue_cond:
+            self._queue.append(item)
+            if self._writer_thread is None:
+                self._writer_thread = threading.Thread(target=self._write_loop, name='broker-writer', daemon=True)
+                self._writer_thread.start()
+            self._queue_cond.notify()
+
+    def _write_loop(self) -> None:
+        """Write queued events in batches; task state at most every BROKER_STATE_INTERVAL."""
+        dirty: Dict[str, Any] = {}  # 状态有变化、尚未写入的任务
+        last_state = 0.0
+        while True:
+            with self._queue_cond:
+                if not self._queue:
+                    timeout = None
+                    if dirty:
+                        timeout = max(0.0, last_state + Config.BROKER_STATE_INTERVAL - time.monotonic())
+                    self._queue_cond.wait(timeout)
+                items, self._queue = self._queue, []
+            try:
+                with self._lock:
+                    self._conn.execute('BEGIN')
+                    try:
+                        for kind, task_id, pipeline, event in items:
+                            self._apply_locked(kind, task_id, pipeline, event, dirty)
+                        if dirty and time.monotonic() - last_state >= Config.BROKER_STATE_INTERVAL:
+                            for task_id, pipeline in dirty.items():
+                                self._write_state_locked(task_id, pipeline)
+                            dirty.clear()
+                            last_state = time.monotonic()
+                        self._conn.execute('COMMIT')
+                    except Exception:
+                        self._conn.execute('ROLLBACK')
+                        raise
+            except sqlite3.Error as e:
+                log(f"写入任务数据失败: {e}", "ERROR")
+
+    def _apply_locked(self, kind: str, task_id: str, pipeline, event: Optional[PipelineEvent],
+                      dirty: Dict[str, Any]) -> None:
+        if kind == 'attach':
+            # 同一任务重新运行（恢复）时序号从 1 重新开始，先清掉上一次运行的数据
+            for table in ('events', 'commands', 'prompts'):
+                self._conn.execute(f'DELETE FROM {table} WHERE task_id = ?', (task_id,))
+            self._conn.execute(
+                'INSERT OR REPLACE INTO tasks (task_id, owner_pid, version, finished, updated_at) VALUES (?, ?, 0, 0, ?)',
+                (task_id, os.getpid(), time.time())
+            )
+            self._written_prompts.pop(task_id, None)
+            self._write_state_locked(task_id, pipeline)
+            for replayed in pipeline.events.replay():
+                self._insert_event_locked(task_id, replayed)
+        elif kind == 'event':
+            self._insert_event_locked(task_id, event)
+            if event.type != 'agent_output':
+                dirty[task_id] = pipeline
+            # 只保留最近的事件，与内存缓冲区大小一致
+            if event.seq % 100 == 0:
+                self._conn.execute('DELETE FROM events WHERE task_id = ? AND seq <= ?',
+                                   (task_id, event.seq - Config.EVENT_BUFFER_SIZE))
+        elif kind == 'detach':
+            dirty.pop(task_id, None)
+            self._write_state_locked(task_id, pipeline, finished=True)
+            self._written_prompts.pop(task_id, None)
+
+    def _insert_event_locked(self, task_id: str, event: PipelineEvent) -> None:
+        self._conn.execute(
+            'INSERT OR IGNORE INTO events (task_id, seq, type, data, timestamp) VALUES (?, ?, ?, ?, ?)',
+            (task_id, event.seq, event.type, json.dumps(event.data, ensure_ascii=False), event.timestamp)
+        )
+
+    def _write_state_locked(self, task_id: str, pipeline, finished: bool = False) -> None:
+        """Write the task row; prompt texts go to the prompts table, only when changed."""
+        state = pipeline.state_snapshot()
+        written = self._written_prompts.setdefault(task_id, {})
+        for index, role in enumerate(state.get('roles', [])):
+            prompt = role.pop('prompt', None)
+            if written.get(index) != prompt:
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO prompts (task_id, role_index, prompt) VALUES (?, ?, ?)',
+                    (task_id, index, prompt)
+                )
+                written[index] = prompt
+        self._conn.execute(
+            'UPDATE tasks SET version = ?, state = ?, status = ?, finished = ?, updated_at = ? WHERE task_id = ?',
+            (state.get('version', pipeline.version), json.dumps(state, ensure_ascii=False),
+             json.dumps(pipeline.status_snapshot(event_limit=0), ensure_ascii=False),
+             int(finished), time.time(), task_id)
+        )
+
+    def _command_loop(self) -> None:
+        """Run control commands sent by other workers for tasks owned by this process."""
+        last_cleanup = 0.0
+        while True:
+            time.sleep(self.POLL_INTERVAL)
+            try:
+                with self._lock:
+                    owned = dict(self._owned)
+                if owned:
+                    marks = ','.join('?' * len(owned))
+                    rows = self._query(f'SELECT id, task_id, action FROM commands WHERE task_id IN ({marks}) ORDER BY id',
+                                       tuple(owned))
+                    for command_id, task_id, action in rows:
+                        self._query('DELETE FROM commands WHERE id = ?', (command_id,))
+                        if action in CONTROL_ACTIONS:
+                            log(f"执行来自其他进程的命令: {action} {task_id}")
+                            getattr(owned[task_id], action)()
+
+                if time.time() - last_cleanup > 60:
+                    last_cleanup = time.time()
+                    self._cleanup()
+            except Exception as e:
+                log(f"处理命令失败: {e}", "ERROR")
+
+    def _cleanup(self) -> None:
+        """Drop finished tasks after PIPELINE_TTL_SECONDS and tasks of dead owner processes."""
+        expired = time.time() - Config.PIPELINE_TTL_SECONDS
+        rows = self._query('SELECT task_id, owner_pid, finished, updated_at FROM tasks')
+        stale = [
+            task_id for task_id, owner_pid, finished, updated_at in rows
+            if (finished and updated_at < expired) or not _pid_alive(owner_pid)
+        ]
+        for task_id in stale:
+            self._query('DELETE FROM events WHERE task_id = ?', (task_id,))
+            self._query('DELETE FROM commands WHERE task_id = ?', (task_id,))
+            self._query('DELETE FROM prompts WHERE task_id = ?', (task_id,))
+            self._query('DELETE FROM tasks WHERE task_id = ?', (task_id,))
+
+    # ==================== Other workers ====================
+
+    def read_task(self, task_id: str, with_prompts: bool = False) -> Optional[Dict[str, Any]]:
+        """Row of a task; ``with_prompts`` puts the role prompts back into the state."""
+        rows = self._query('SELECT owner_pid, version, state, status, finished FROM tasks WHERE task_id = ?', (task_id,))
+        if not rows:
+            return None
+        owner_pid, version, state, status, finished = rows[0]
+        state = json.loads(state) if state else None
+        if state and with_prompts:
+            prompts = dict(self._query('SELECT role_index, prompt FROM prompts WHERE task_id = ?', (task_id,)))
+            for index, role in enumerate(state.get('roles', [])):
+                role['prompt'] = prompts.get(index)
+        return {
+            'owner_pid': owner_pid,
+            'version': version,
+            'state': state,
+            'status': json.loads(status) if status else None,
+            'finished': bool(finished)
+        }
+
+    def read_events(self, task_id: str, after_seq: int, limit: int = 500) -> List[PipelineEvent]:
+        rows = self._query(
+            'SELECT seq, type, data, timestamp FROM events WHERE task_id = ? AND seq > ? ORDER BY seq LIMIT ?',
+            (task_id, after_seq, limit)
+        )
+        return [PipelineEvent(type=t, data=json.loads(d), timestamp=ts, seq=seq) for seq, t, d, ts in rows]
+
+    def send_command(self, task_id: str, action: str) -> None:
+        self._query('INSERT INTO commands (task_id, action, created_at) VALUES (?, ?, ?)', (task_id, action, time.time()))
+
+    def get_remote(self, task_id: str) -> Optional['RemotePipeline']:
+        """Proxy for a task running in another live worker process, or None.
+
+        Reads the database when the proxy is first created; call it off the event loop.
+        """
+        with self._lock:
+            remote = self._remotes.get(task_id)
+            if remote and not remote.stopped:
+                return remote
+        info = self.read_task(task_id)
+        if not info or info['finished'] or info['owner_pid'] == os.getpid() or not _pid_alive(info['owner_pid']):
+            return None
+        remote = RemotePipeline(self, task_id)
+        with self._lock:
+            existing = self._remotes.get(task_id)
+            if existing and not existing.stopped:
+                remote.stopped = True  # 并发创建时保留先创建的代理
+                return existing
+            self._remotes[task_id] = remote
+            if self._poll_thread is None:
+                self._poll_thread = threading.Thread(target=self._poll_loop, name='broker-remotes', daemon=True)
+                self._poll_thread.start()
+            return remote
+
+    def _poll_loop(self) -> None:
+        """Refresh every remote proxy of this process each POLL_INTERVAL."""
+        while True:
+            time.sleep(self.POLL_INTERVAL)
+            with self._lock:
+                remotes = [r for r in self._remotes.values() if not r.stopped]
+                if not remotes:
+                    self._poll_thread = None
+                    return
+            try:
+                # 所有代理的版本号一次查询读取，不解析整个状态
+                rows = self._query(
+                    f"SELECT task_id, version, json_extract(state, '$.runId') FROM tasks "
+                    f"WHERE task_id IN ({','.join('?' * len(remotes))})",
+                    tuple(r.task_id for r in remotes)
+                )
+            except Exception as e:
+                log(f"读取远程任务失败: {e}", "ERROR")
+                continue
+            versions = {task_id: (version, run_id) for task_id, version, run_id in rows}
+            for remote in remotes:
+                try:
+                    remote._refresh(*versions.get(remote.task_id, (0, None)))
+                except Exception as e:
+                    log(f"读取远程事件失败: {remote.task_id}: {e}", "ERROR")
+                    remote.shutdown()
+
+    def _forget_remote(self, task_id: str) -> None:
+        with self._lock:
+            self._remotes.pop(task_id, None)
+
+
+class RemotePipeline:
+    """Stand-in for a PipelineService running in another worker process.
+
+    Events are mirrored from the broker into a local EventBus (keeping their sequence
+    IDs) and the state version is cached by the broker's shared polling thread, so
+    SSE/WebSocket code can subscribe as usual and version reads do not touch the database.
+    """
+
+    remote = True
+    IDLE_TIMEOUT = 60  # 没有订阅者多久后停止轮询（秒）
+
+    def __init__(self, broker: TaskBroker, task_id: str):
+        self.broker = broker
+        self.task_id = task_id
+        self.events = EventBus()
+        self.stopped = False
+        self._last_seq = 0
+        self._version = 0
+        self._run_id: Optional[str] = None
+        self._waiters = 0  # 正在 wait_for_change 的线程数
+        self._idle_since = time.monotonic()
+        self._cond = threading.Condition()
+        # 先同步读取已有事件和版本，订阅者可以立即按 Last-Event-ID 回放
+        info = broker.read_task(task_id) or {'version': 0, 'state': None}
+        self._version, self._run_id = info['version'], (info['state'] or {}).get('runId')
+        self._pull()
+
+    def _pull(self) -> bool:
+        """Copy new events into the local bus. Returns False once the task has ended."""
+        for event in self.broker.read_events(self.task_id, self._last_seq):
+            self.events.publish(event)
+            self._last_seq = event.seq
+            if event.type in TERMINAL_EVENTS:
+                return False
+        return True
+
+    def _refresh(self, version: int, run_id: Optional[str]) -> None:
+        """Called by the broker's polling thread with the task's current version."""
+        with self._cond:
+            if (version, run_id) != (self._version, self._run_id):
+                self._version, self._run_id = version, run_id
+                self._cond.notify_all()
+            waiting = self._waiters
+        if not self._pull():
+            self.shutdown()
+        elif self.events.subscriber_count() or waiting:
+            self._idle_since = time.monotonic()
+        elif time.monotonic() - self._idle_since > self.IDLE_TIMEOUT:
+            self.shutdown()
+
+    def _info(self) -> Dict[str, Any]:
+        return self.broker.read_task(self.task_id) or {'version': 0, 'state': None, 'status': None}
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    @property
+    def run_id(self) -> Optional[str]:
+        return self._run_id
+
+    def wait_for_change(self, version: int, timeout: float) -> int:
+        with self._cond:
+            run_id = self._run_id
+            self._waiters += 1
+            try:
+                # 所有者重新运行该任务（新的 runId）也算变化
+                self._cond.wait_for(
+                    lambda: self.stopped or self._version != version or self._run_id != run_id, timeout
+                )
+            finally:
+                self._waiters -= 1
+            return self._version
+
+    def state_snapshot(self) -> Dict[str, Any]:
+        info = self.broker.read_task(self.task_id, with_prompts=True)
+        return (info or {}).get('state') or {}
+
+    def status_snapshot(self, event_limit: int = 200) -> Dict[str, Any]:
+        events = [
+            {'seq': e.seq, 'type': e.type, 'data': e.data, 'timestamp': e.timestamp}
+            for e in self.events.replay() if e.type != 'agent_output'
+        ][-event_limit:] if event_limit else []
+        return {**(self._info()['status'] or {}), 'events': events}
+
+    def usage_snapshot(self) -> Optional[Dict[str, Any]]:
+        """Usage as of the owner's last checkpoint (the task journal is on the shared disk)."""
+        return usage_from_progress(get_storage_service().load_task_progress(self.task_id), self.task_id)
+
+    def pause(self) -> None:
+        self.broker.send_command(self.task_id, 'pause')
+
+    def resume(self) -> None:
+        self.broker.send_command(self.task_id, 'resume')
+
+    def cancel(self) -> None:
+        self.broker.send_command(self.task_id, 'cancel')
+
+    def shutdown(self) -> None:
+        with self._cond:
+            self.stopped = True
+            self._cond.notify_all()
+        self.broker._forget_remote(self.task_id)
+
+
+# Global instance
+_broker: Optional[TaskBroker] = None
+_broker_lock = threading.Lock()
+
+
+def get_task_broker() -> Optional[TaskBroker]:
+    """Get the global task broker, or None if TASK_BROKER is disabled."""
+    global _broker
+    if Config.TASK_BROKER != 'sqlite':
+        return None
+    with _broker_lock:
+        if _broker is None:
+            _broker = TaskBroker()
+    return _broker
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""Per-task token usage ledger."""
+
+import threading
+from typing import List, Optional, Dict, Any
+
+from app.models.usage import UsageRecord
+
+
+class UsageLedger:
+    """Thread-safe collection of token usage records for one task."""
+
+    def __init__(self, task_id: str = ""):
+        self.task_id = task_id
+        self._records: List[UsageRecord] = []
+        self._lock = threading.Lock()
+
+    def record(
+        self,
+        agent: str,
+        usage: Dict[str, int],
+        model: str = "",
+        role_index: Optional[int] = None,
+        iteration: Optional[int] = None
+    ) -> UsageRecord:
+        """Record the usage block of one LLM call.
+
+        Args:
+            agent: Agent name (analyzer, generator, ...)
+            usage: Dict with prompt_tokens / completion_tokens / cached_tokens
+            model: Model name
+            role_index: Role index for per-role agents
+            iteration: Review/optimize iteration (0 for the generator)
+        """
+        entry = UsageRecord(
+            task_id=self.task_id,
+            agent=agent,
+            model=model,
+            role_index=role_index,
+            iteration=iteration,
+            prompt_tokens=usage.get('prompt_tokens', 0) or 0,
+            completion_tokens=usage.get('completion_tokens', 0) or 0,
+            cached_tokens=usage.get('cached_tokens', 0) or 0
+        )
+        with self._lock:
+            self._records.append(entry)
+        return entry
+
+    def records(self) -> List[UsageRecord]:
+        with self._lock:
+            return list(self._records)
+
+    def summary(self) -> Dict[str, Any]:
+        """Aggregate records into totals, per-agent and per-role buckets."""
+        def empty() -> Dict[str, int]:
+            return {'calls': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'cached_tokens': 0, 'total_tokens': 0}
+
+        def add(bucket: Dict[str, int], r: UsageRecord) -> None:
+            bucket['calls'] += 1
+            bucket['prompt_tokens'] += r.prompt_tokens
+            bucket['completion_tokens'] += r.completion_tokens
+            bucket['cached_tokens'] += r.cached_tokens
+            bucket['total_tokens'] += r.total_tokens
+
+        totals = empty()
+        by_agent: Dict[str, Dict[str, int]] = {}
+        by_role: Dict[str, Dict[str, int]] = {}
+        for r in self.records():
+            add(totals, r)
+            add(by_agent.setdefault(r.agent, empty()), r)
+            if r.role_index is not None:
+                add(by_role.setdefault(str(r.role_index), empty()), r)
+
+        return {'totals': totals, 'by_agent': by_agent, 'by_role': by_role}
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Serialize ledger (records + summary) for persistence."""
+        return {
+            'task_id': self.task_id,
+            'records': [r.to_dict() for r in self.records()],
+            **self.summary()
+        }
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]], task_id: str = "") -> "UsageLedger":
+        """Restore a ledger saved with to_dict."""
+        data = data or {}
+        ledger = cls(task_id or data.get('task_id', ''))
+        ledger._records = [UsageRecord.from_dict(r) for r in data.get('records', [])]
+        return ledger
+
+
+def usage_from_progress(progress: Optional[Dict[str, Any]], task_id: str) -> Optional[Dict[str, Any]]:
+    """/usage payload (ledger + JSON repair stats) from a task journal, or None if it has no usage."""
+    if not progress or not progress.get('usage'):
+        return None
+    return {
+        **UsageLedger.from_dict(progress['usage'], task_id).to_dict(),
+        'json_repair': progress.get('json_repair', {})
+    }
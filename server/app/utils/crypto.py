@@ -1,16 +1,32 @@
 # -*- coding: utf-8 -*-
-"""Encryption utilities using AES-256-CBC."""
+"""Encryption utilities (AES-256-GCM, legacy AES-256-CBC)."""
 
 import os
 import base64
+from functools import lru_cache
+from typing import Optional
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.hazmat.primitives import padding
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
 
+# 当前格式：v2:<salt>:<nonce>:<ciphertext+tag>（base64），每个文件随机盐 + AES-GCM 认证加密
+FORMAT_PREFIX = 'v2:'
+SALT_SIZE = 16
+NONCE_SIZE = 12
 
-def _derive_key(password: str, salt: bytes = b'salt') -> bytes:
-    """Derive a 32-byte key from password using scrypt."""
+# 旧格式 iv_hex:ciphertext_hex 使用的固定盐
+_LEGACY_SALT = b'salt'
+
+
+@lru_cache(maxsize=32)
+def _derive_key(password: str, salt: bytes = _LEGACY_SALT) -> bytes:
+    """Derive a 32-byte key from password using scrypt.
+    
+    scrypt (n=2^14) costs ~16 MB and tens of milliseconds, so results are memoized
+    per (password, salt); with a per-file salt only the first read derives.
+    """
     kdf = Scrypt(
         salt=salt,
         length=32,
@@ -22,49 +38,64 @@ def _derive_key(password: str, salt: bytes = b'salt') -> bytes:
     return kdf.derive(password.encode())
 
 
-def encrypt(plaintext: str, key: str) -> str:
-    """Encrypt plaintext using AES-256-CBC.
+def new_salt() -> bytes:
+    """Random salt for a new encrypted file."""
+    return os.urandom(SALT_SIZE)
+
+
+def get_salt(ciphertext: str) -> Optional[bytes]:
+    """Salt of a v2 ciphertext (None for the legacy format)."""
+    if not ciphertext.startswith(FORMAT_PREFIX):
+        return None
+    return base64.b64decode(ciphertext[len(FORMAT_PREFIX):].split(':')[0])
+
+
+def is_legacy(ciphertext: str) -> bool:
+    """True if the ciphertext uses the old unauthenticated CBC format."""
+    return not ciphertext.startswith(FORMAT_PREFIX)
+
+
+def encrypt(plaintext: str, key: str, salt: Optional[bytes] = None) -> str:
+    """Encrypt plaintext using AES-256-GCM.
     
     Args:
         plaintext: Text to encrypt
         key: Encryption key/password
-        
+        salt: KDF salt; pass the salt of the file being overwritten to reuse its
+            (memoized) key, None for a new random salt
+    
     Returns:
-        Encrypted string in format: iv_hex:ciphertext_hex
+        Encrypted string in format: v2:salt_b64:nonce_b64:ciphertext_b64
     """
-    iv = os.urandom(16)
-    derived_key = _derive_key(key)
-    
-    cipher = Cipher(
-        algorithms.AES(derived_key),
-        modes.CBC(iv),
-        backend=default_backend()
-    )
-    encryptor = cipher.encryptor()
-    
-    # Pad the plaintext
-    padder = padding.PKCS7(128).padder()
-    padded_data = padder.update(plaintext.encode()) + padder.finalize()
-    
-    # Encrypt
-    ciphertext = encryptor.update(padded_data) + encryptor.finalize()
-    
-    return iv.hex() + ':' + ciphertext.hex()
+    salt = salt or new_salt()
+    nonce = os.urandom(NONCE_SIZE)
+    ciphertext = AESGCM(_derive_key(key, salt)).encrypt(nonce, plaintext.encode(), None)
+    return FORMAT_PREFIX + ':'.join(base64.b64encode(part).decode() for part in (salt, nonce, ciphertext))
 
 
 def decrypt(ciphertext: str, key: str) -> str:
-    """Decrypt ciphertext using AES-256-CBC.
+    """Decrypt ciphertext (v2 AES-256-GCM or legacy AES-256-CBC).
     
     Args:
-        ciphertext: Encrypted string in format: iv_hex:ciphertext_hex
+        ciphertext: Encrypted string from encrypt(), or legacy iv_hex:ciphertext_hex
         key: Encryption key/password
-        
+    
     Returns:
         Decrypted plaintext
-        
+    
     Raises:
-        ValueError: If ciphertext format is invalid
+        ValueError: If ciphertext format is invalid or authentication fails
     """
+    if not is_legacy(ciphertext):
+        parts = ciphertext[len(FORMAT_PREFIX):].split(':')
+        if len(parts) != 3:
+            raise ValueError("Invalid ciphertext format")
+        salt, nonce, data = (base64.b64decode(part) for part in parts)
+        try:
+            return AESGCM(_derive_key(key, salt)).decrypt(nonce, data, None).decode()
+        except Exception:
+            raise ValueError("Decryption failed: wrong key or tampered data")
+    
     parts = ciphertext.split(':')
     if len(parts) != 2:
         raise ValueError("Invalid ciphertext format")
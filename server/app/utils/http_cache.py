@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""HTTP caching and compression for the JSON read endpoints.
+
+GET responses of the registered blueprints get a weak ETag (a hash of the body unless
+the view set one from file metadata), ``Cache-Control: no-cache`` so clients always
+revalidate, and a 304 when If-None-Match / If-Modified-Since match. Bodies are
+compressed with br (when the brotli package is installed) or gzip, as negotiated by
+Accept-Encoding. Serialized and compressed bodies are kept in a small in-process LRU
+keyed by ETag, so an unchanged document is neither re-read nor re-compressed.
+"""
+
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Callable, Hashable, Optional
+
+from flask import Blueprint, Response, current_app, request
+from werkzeug.http import is_resource_modified
+
+from app.config import Config
+
+try:
+    import brotli
+except ImportError:  # br 为可选项，未安装时只提供 gzip
+    brotli = None
+
+
+class ResponseCache:
+    """LRU of response bodies bounded by entry count and total bytes."""
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: 'OrderedDict[Hashable, bytes]' = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[bytes]:
+        with self._lock:
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+            return body
+
+    def put(self, key: Hashable, body: bytes) -> None:
+        if len(body) > self.max_bytes // 4:
+            return  # 过大的响应不缓存，避免挤掉其他条目
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._entries[key] = body
+            self._size += len(body)
+            while self._entries and (len(self._entries) > self.max_entries or self._size > self.max_bytes):
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+_cache = ResponseCache(Config.HTTP_CACHE_SIZE, Config.HTTP_CACHE_MAX_BYTES)
+
+
+def make_etag(*parts: Any) -> str:
+    """ETag value (unquoted) for the given identifying parts."""
+    return hashlib.sha1('\0'.join(str(p) for p in parts).encode('utf-8')).hexdigest()[:32]
+
+
+def cached_json(etag: str, last_modified: Optional[float], build: Callable[[], Any]) -> Response:
+    """JSON response for a document identified by ``etag``.
+
+    ``build`` runs only when the client's copy is stale and the serialized body is
+    not in the LRU, so unchanged documents are not read from disk again.
+
+    Args:
+        etag: Validator of the document (e.g. from file path, mtime and size)
+        last_modified: Modification time (timestamp) sent as Last-Modified
+        build: Returns the JSON-compatible payload
+    """
+    if last_modified is not None:
+        last_modified = datetime.fromtimestamp(int(last_modified), timezone.utc)
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = current_app.response_class(status=304)
+    else:
+        key = ('body', etag)
+        body = _cache.get(key)
+        if body is None:
+            body = current_app.json.dumps(build()).encode('utf-8')
+            _cache.put(key, body)
+        response = current_app.response_class(body, mimetype='application/json')
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    return response
+
+
+def _encode(body: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6, mtime=0)
+
+
+def _finalize(response: Response, private: bool) -> Response:
+    """ETag, conditional 304 and compression for a GET response."""
+    if request.method not in ('GET', 'HEAD') or response.status_code not in (200, 304):
+        return response
+    if response.is_streamed or response.direct_passthrough or 'Content-Encoding' in response.headers:
+        return response  # 流式下载（如 ZIP 导出）原样返回
+
+    response.headers['Cache-Control'] = 'private, no-cache' if private else 'no-cache'
+    response.vary.add('Accept-Encoding')
+    if response.status_code == 304:
+        return response
+
+    body = response.get_data()
+    etag, _ = response.get_etag()
+    if not etag:
+        etag = hashlib.sha1(body).hexdigest()[:32]
+        response.set_etag(etag, weak=True)
+    response.make_conditional(request)
+    if response.status_code != 200 or len(body) < Config.HTTP_COMPRESS_MIN_BYTES:
+        return response
+
+    offered = ['br', 'gzip'] if brotli else ['gzip']
+    encoding = request.accept_encodings.best_match(offered)
+    if not encoding:
+        return response
+    key = (encoding, etag)
+    encoded = _cache.get(key)
+    if encoded is None:
+        encoded = _encode(body, encoding)
+        _cache.put(key, encoded)
+    response.set_data(encoded)
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def register(bp: Blueprint, private: bool = False) -> None:
+    """Enable caching and compression for the GET routes of a blueprint.
+
+    Call it where the blueprint is defined, before it is registered on the app.
+
+    Args:
+        bp: Blueprint
+        private: Forbid shared caches (responses with credentials)
+    """
+    bp.after_request(lambda response: _finalize(response, private))
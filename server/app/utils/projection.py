@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""Field projection of JSON documents (``?fields=a.b,c``)."""
+
+from typing import Any, Callable, Dict, List, Optional
+
+# 投影结果中不存在的路径
+_MISSING = object()
+
+
+def parse_fields(spec: Optional[str]) -> List[List[str]]:
+    """Split a comma-separated field list into dotted paths.
+
+    Raises:
+        ValueError: If a path has an empty segment
+    """
+    paths = []
+    for field in (spec or '').split(','):
+        field = field.strip()
+        if not field:
+            continue
+        parts = field.split('.')
+        if not all(parts):
+            raise ValueError(f'无效的字段: {field}')
+        paths.append(parts)
+    return paths
+
+
+def project(value: Any, paths: List[List[str]], is_leaf: Optional[Callable[[Any], bool]] = None) -> Any:
+    """Subset of a JSON value containing only the given paths.
+
+    A path continues through lists element-wise, so ``prompts.role_name`` keeps the
+    role_name of every entry of ``prompts``. Paths that do not exist are left out.
+
+    Args:
+        value: JSON-compatible value
+        paths: Paths from parse_fields
+        is_leaf: Dicts for which it returns True are not descended into
+            (e.g. blob references)
+    """
+    result = _project(value, paths, is_leaf or (lambda v: False))
+    return {} if result is _MISSING else result
+
+
+def _project(value: Any, paths: List[List[str]], is_leaf: Callable[[Any], bool]) -> Any:
+    if any(not path for path in paths):
+        return value  # 整个值都被选中
+    if isinstance(value, list):
+        items = (_project(v, paths, is_leaf) for v in value)
+        return [None if item is _MISSING else item for item in items]
+    if not isinstance(value, dict) or is_leaf(value):
+        return _MISSING
+
+    branches: Dict[str, List[List[str]]] = {}
+    for path in paths:
+        branches.setdefault(path[0], []).append(path[1:])
+    out = {}
+    for key, rest in branches.items():
+        if key in value:
+            sub = _project(value[key], rest, is_leaf)
+            if sub is not _MISSING:
+                out[key] = sub
+    return out
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""Section-level edit operations on role prompts (optimizer patch mode)."""
+
+import re
+from dataclasses import dataclass
+from typing import List, Dict, Any, Optional
+
+_TAG_RE = re.compile(r'<(/?)([A-Za-z_][\w\-]*)(?:\s[^<>]*)?(/?)>')
+_HEADING_RE = re.compile(r'^(#{1,6})\s+(.+?)\s*#*\s*$')
+
+PATCH_OPS = ('replace', 'insert_after', 'delete')
+
+
+class PatchError(ValueError):
+    """Raised when edit operations cannot be applied safely."""
+
+
+@dataclass
+class Section:
+    """A locatable section of a prompt: an XML element or a markdown heading block."""
+    name: str
+    start: int
+    end: int
+    depth: int
+
+
+def _xml_sections(text: str) -> List[Section]:
+    sections: List[Section] = []
+    stack: List[tuple] = []  # (name, start)
+    for m in _TAG_RE.finditer(text):
+        closing, name, self_closing = m.group(1), m.group(2), m.group(3)
+        if self_closing:
+            continue
+        if not closing:
+            stack.append((name, m.start()))
+            continue
+        # 弹出到匹配的开始标签，忽略无法匹配的结束标签
+        for i in range(len(stack) - 1, -1, -1):
+            if stack[i][0] == name:
+                sections.append(Section(name, stack[i][1], m.end(), i))
+                del stack[i:]
+                break
+    return sections
+
+
+def _markdown_sections(text: str) -> List[Section]:
+    headings = []  # (level, name, start)
+    in_fence = False
+    pos = 0
+    for line in text.splitlines(keepends=True):
+        if line.lstrip().startswith('```'):
+            in_fence = not in_fence
+        elif not in_fence:
+            m = _HEADING_RE.match(line.rstrip('\n'))
+            if m:
+                headings.append((len(m.group(1)), m.group(2), pos))
+        pos += len(line)
+
+    sections = []
+    for i, (level, name, start) in enumerate(headings):
+        end = len(text)
+        for next_level, _, next_start in headings[i + 1:]:
+            if next_level <= level:
+                end = next_start
+                break
+        sections.append(Section(name, start, end, level - 1))
+    return sections
+
+
+def find_sections(text: str) -> List[Section]:
+    """List all XML elements and markdown heading blocks of a prompt."""
+    return _xml_sections(text) + _markdown_sections(text)
+
+
+def list_section_names(text: str, max_depth: int = 1) -> List[str]:
+    """Names of the outer sections, in document order (for the optimizer's reference)."""
+    names: List[str] = []
+    for s in sorted(find_sections(text), key=lambda s: s.start):
+        if s.depth <= max_depth and s.name not in names:
+            names.append(s.name)
+    return names
+
+
+def _locate(text: str, name: str) -> Section:
+    key = (name or '').strip().strip('<>/#').strip().lower()
+    if not key:
+        raise PatchError("缺少 section")
+    matches = [s for s in find_sections(text) if s.name.strip().lower() == key]
+    if not matches:
+        raise PatchError(f"找不到章节: {name}")
+    if len(matches) > 1:
+        raise PatchError(f"章节不唯一: {name} ({len(matches)} 处)")
+    return matches[0]
+
+
+def _tag_balance(text: str) -> Dict[str, int]:
+    balance: Dict[str, int] = {}
+    for m in _TAG_RE.finditer(text):
+        if m.group(3):
+            continue
+        balance[m.group(2)] = balance.get(m.group(2), 0) + (-1 if m.group(1) else 1)
+    return {k: v for k, v in balance.items() if v}
+
+
+def _wrap_like(original: str, content: str) -> str:
+    """Keep the section's own tag or heading when the replacement only gives its body."""
+    if original.startswith('<'):
+        open_tag = original[:original.index('>') + 1]
+        name = _TAG_RE.match(open_tag).group(2)
+        if not content.lstrip().startswith(f'<{name}'):
+            return f"{open_tag}\n{content}\n</{name}>"
+    elif original.startswith('#'):
+        heading = original.split('\n', 1)[0]
+        if not content.lstrip().startswith('#'):
+            return f"{heading}\n{content}"
+    return content
+
+
+def apply_patch(prompt: str, operations: Optional[List[Dict[str, Any]]]) -> str:
+    """Apply edit operations to a prompt.
+
+    Each operation is ``{"op": "replace" | "insert_after" | "delete", "section": <XML tag
+    or heading>, "content": <new text>}``. Operations apply in order.
+
+    Raises:
+        PatchError: If an operation is malformed, its section is missing or ambiguous,
+            or the result breaks the prompt's XML structure
+    """
+    if not isinstance(operations, list) or not operations:
+        raise PatchError("没有编辑操作")
+
+    result = prompt
+    for op in operations:
+        if not isinstance(op, dict) or op.get('op') not in PATCH_OPS:
+            raise PatchError(f"无效的编辑操作: {op}")
+        section = _locate(result, op.get('section', ''))
+        content = op.get('content')
+        if op['op'] != 'delete' and not (isinstance(content, str) and content.strip()):
+            raise PatchError(f"{op['op']} 缺少 content: {op.get('section')}")
+
+        before, original, after = result[:section.start], result[section.start:section.end], result[section.end:]
+        if op['op'] == 'replace':
+            # 保留原章节末尾的换行（markdown 章节到下一个标题为止）
+            tail = original[len(original.rstrip('\n')):]
+            result = before + _wrap_like(original, content.strip('\n')) + tail + after
+        elif op['op'] == 'insert_after':
+            block = content.strip('\n')
+            if original.endswith('\n'):
+                sep = '' if original.endswith('\n\n') else '\n'
+                result = before + original + sep + block + '\n' + after
+            else:
+                result = before + original + '\n\n' + block + after
+        else:
+            result = result[:section.start] + result[section.end:].lstrip('\n')
+
+    if not result.strip():
+        raise PatchError("编辑后提示词为空")
+    # 原提示词标签平衡时，结果也必须平衡
+    if not _tag_balance(prompt) and _tag_balance(result):
+        raise PatchError(f"编辑后 XML 标签不匹配: {_tag_balance(result)}")
+    return result
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""Tokenization and highlighting for full-text search (CJK bigrams + English words)."""
+
+import re
+import html
+from typing import List, Optional
+
+# 中日韩字符连续段 / 英文与数字单词
+_CJK_RUN = '[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af]+'
+_TOKEN_RE = re.compile(rf'({_CJK_RUN})|([A-Za-z0-9]+)')
+
+
+def _cjk_tokens(run: str) -> List[str]:
+    """Overlapping bigrams of a CJK run plus its last character.
+
+    The trailing single character lets one-character queries match it via a prefix
+    query; every other character already starts a bigram.
+    """
+    if len(run) == 1:
+        return [run]
+    return [run[i:i + 2] for i in range(len(run) - 1)] + [run[-1]]
+
+
+def tokenize(text: Optional[str]) -> str:
+    """Turn text into space-separated index terms: CJK bigrams and lowercase words."""
+    if not text:
+        return ''
+    tokens = []
+    for cjk, word in _TOKEN_RE.findall(text):
+        if cjk:
+            tokens.extend(_cjk_tokens(cjk))
+        else:
+            tokens.append(word.lower())
+    return ' '.join(tokens)
+
+
+def query_terms(query: str) -> List[str]:
+    """Search terms of a query as typed: CJK runs and lowercase words."""
+    return [cjk or word.lower() for cjk, word in _TOKEN_RE.findall(query or '')]
+
+
+def match_expression(query: str) -> Optional[str]:
+    """FTS5 MATCH expression for a query (all terms must match).
+
+    A CJK run becomes a phrase of its consecutive bigrams, which matches it as a
+    substring; a single CJK character and the last English word match as prefixes.
+
+    Returns:
+        The expression, or None if the query has no searchable terms
+    """
+    terms = query_terms(query)
+    parts = []
+    for i, term in enumerate(terms):
+        if _TOKEN_RE.match(term).group(1):
+            if len(term) == 1:
+                parts.append(f'"{term}"*')
+            else:
+                parts.append('"' + ' '.join(term[j:j + 2] for j in range(len(term) - 1)) + '"')
+        elif i == len(terms) - 1:
+            parts.append(f'"{term}"*')
+        else:
+            parts.append(f'"{term}"')
+    return ' AND '.join(parts) or None
+
+
+def highlight(text: Optional[str], terms: List[str], context: int = 40) -> Optional[str]:
+    """Snippet around the first match of any term, HTML-escaped, matches in <mark>.
+
+    Returns:
+        The snippet, or None if no term occurs in the text
+    """
+    if not text or not terms:
+        return None
+    pattern = re.compile('|'.join(re.escape(t) for t in sorted(terms, key=len, reverse=True)), re.IGNORECASE)
+    first = pattern.search(text)
+    if not first:
+        return None
+
+    start = max(0, first.start() - context)
+    end = min(len(text), first.end() + context * 2)
+    window = text[start:end]
+    parts, pos = [], 0
+    for m in pattern.finditer(window):
+        parts.append(html.escape(window[pos:m.start()]))
+        parts.append(f'<mark>{html.escape(m.group(0))}</mark>')
+        pos = m.end()
+    parts.append(html.escape(window[pos:]))
+    snippet = ' '.join(''.join(parts).split())  # 合并换行和多余空白
+    return ('…' if start > 0 else '') + snippet + ('…' if end < len(text) else '')
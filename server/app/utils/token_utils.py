@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""Local token estimation and context budget utilities."""
+
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import List, Tuple, Dict, Any, Optional
+
+from app.config import Config
+
+# CJK 字符（汉字、假名、韩文、全角标点）基本一字一 token，其余文本约 3.5 字符一 token
+_CJK_RE = re.compile(r'[\u3000-\u303f\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uff00-\uffef]')
+CJK_TOKENS_PER_CHAR = 1.0
+CHARS_PER_TOKEN = 3.5
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# 预估误差的安全余量
+SAFETY_RATIO = 0.9
+
+
+@dataclass(frozen=True)
+class ModelLimits:
+    """Context window and maximum output tokens of a model."""
+    context_window: int
+    max_output: int
+
+
+# 按模型名前缀匹配，最长前缀优先
+MODEL_LIMITS: Dict[str, ModelLimits] = {
+    'claude-opus-4': ModelLimits(200000, 32000),
+    'claude-sonnet-4': ModelLimits(200000, 64000),
+    'claude-haiku-4': ModelLimits(200000, 64000),
+    'claude-3-7-sonnet': ModelLimits(200000, 64000),
+    'claude-3-5': ModelLimits(200000, 8192),
+    'claude': ModelLimits(200000, 4096),
+    'gpt-4.1': ModelLimits(1047576, 32768),
+    'gpt-4o': ModelLimits(128000, 16384),
+    'gpt-4-turbo': ModelLimits(128000, 4096),
+    'gpt-4': ModelLimits(8192, 4096),
+    'gpt-5': ModelLimits(400000, 128000),
+    'gpt-3.5-turbo': ModelLimits(16385, 4096),
+    'o1': ModelLimits(200000, 100000),
+    'o3': ModelLimits(200000, 100000),
+    'o4-mini': ModelLimits(200000, 100000),
+    'gemini': ModelLimits(1048576, 8192),
+    'deepseek': ModelLimits(64000, 8192),
+    'qwen': ModelLimits(32768, 8192),
+}
+
+
+class ContextBudgetError(ValueError):
+    """Raised when a request cannot fit the model's context window."""
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate token count of text without a tokenizer.
+
+    Slightly overestimates for typical mixed Chinese/English prompts.
+    """
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    other = len(text) - cjk
+    return int(cjk * CJK_TOKENS_PER_CHAR + other / CHARS_PER_TOKEN) + 1
+
+
+def estimate_messages_tokens(messages: List[Dict[str, Any]]) -> int:
+    """Estimate prompt tokens of a chat message list."""
+    return sum(estimate_tokens(m.get('content') or '') + MESSAGE_OVERHEAD_TOKENS for m in messages)
+
+
+@lru_cache(maxsize=8)
+def _parse_limits(spec: str) -> Dict[str, ModelLimits]:
+    """Parse ``name=context:max_output,...`` (the MODEL_LIMITS setting)."""
+    limits = {}
+    for item in spec.split(','):
+        name, _, values = item.partition('=')
+        context, _, output = values.partition(':')
+        try:
+            limits[name.strip().lower()] = ModelLimits(int(context), int(output))
+        except ValueError:
+            continue  # 忽略格式错误的条目
+    return limits
+
+
+def find_model_limits(model: str) -> Optional[ModelLimits]:
+    """Limits of a known model, None if unknown.
+
+    Names configured in MODEL_LIMITS take precedence over the built-in table; the
+    longest matching prefix wins and provider prefixes like 'openai/' are ignored.
+    """
+    name = (model or '').lower().rsplit('/', 1)[-1]
+    for table in (_parse_limits(Config.MODEL_LIMITS), MODEL_LIMITS):
+        for prefix in sorted(table, key=len, reverse=True):
+            if name.startswith(prefix):
+                return table[prefix]
+    return None
+
+
+def input_budget(model: str, system_prompt: str = '') -> Optional[int]:
+    """Tokens available for the user message after system prompt and output reserve.
+
+    None for an unknown model (no model-based limit).
+    """
+    limits = find_model_limits(model)
+    if limits is None:
+        return None
+    usable = int(limits.context_window * SAFETY_RATIO)
+    return usable - limits.max_output - estimate_tokens(system_prompt) - 2 * MESSAGE_OVERHEAD_TOKENS
+
+
+@dataclass
+class ContextSection:
+    """A section of an agent's user message.
+
+    Sections with a lower priority are trimmed first; required sections are never trimmed.
+    """
+    name: str
+    text: str
+    priority: int = 0
+    required: bool = False
+
+
+TRUNCATED_MARK = '\n…（内容过长，已截断）'
+
+
+def fit_sections(sections: List[ContextSection], budget: int) -> Tuple[str, List[str]]:
+    """Join sections, trimming low-priority ones until the estimate fits the budget.
+
+    Args:
+        sections: Sections in output order
+        budget: Token budget for the joined text
+
+    Returns:
+        (joined text, names of trimmed sections)
+    """
+    texts = [s.text for s in sections]
+    costs = [estimate_tokens(t) for t in texts]
+    over = sum(costs) - budget
+    trimmed: List[str] = []
+
+    order = sorted(
+        (i for i, s in enumerate(sections) if not s.required),
+        key=lambda i: sections[i].priority
+    )
+    for i in order:
+        if over <= 0:
+            break
+        keep_tokens = costs[i] - over - estimate_tokens(TRUNCATED_MARK)
+        if keep_tokens > 50:
+            # 按比例截断字符，保留段落开头（通常是标题和最重要的内容）
+            keep_chars = int(len(texts[i]) * keep_tokens / costs[i])
+            while keep_chars > 0 and estimate_tokens(texts[i][:keep_chars]) > keep_tokens:
+                keep_chars = int(keep_chars * 0.98)
+            texts[i] = texts[i][:keep_chars] + TRUNCATED_MARK
+        else:
+            texts[i] = ''
+        new_cost = estimate_tokens(texts[i])
+        over -= costs[i] - new_cost
+        costs[i] = new_cost
+        trimmed.append(sections[i].name)
+
+    return '\n\n'.join(t for t in texts if t), trimmed
@@ -0,0 +1,7 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""ASGI application entry point (uvicorn asgi:app)."""
+
+from app.asgi import create_asgi_app
+
+app = create_asgi_app()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmark: many concurrent SSE watchers on one pipeline.
+
+Starts the server in-process (ASGI via uvicorn, or Flask's threaded WSGI server for
+comparison), connects N watchers to /api/pipeline/stream, publishes events and
+reports delivery time, event counts and the number of server threads.
+
+Usage:
+    python benchmarks/stream_watchers.py --mode asgi --watchers 2000 --events 200
+    python benchmarks/stream_watchers.py --mode wsgi --watchers 500 --events 200
+"""
+
+import os
+import sys
+import time
+import socket
+import asyncio
+import argparse
+import threading
+import types
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+# 基准测试的假任务不需要跨进程共享
+os.environ.setdefault('TASK_BROKER', 'none')
+
+from app.models.pipeline import PipelineEvent
+from app.services.event_bus import EventBus
+from app.services.pipeline_registry import get_pipeline_registry
+
+TASK_ID = 'bench-task'
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def serve_asgi(port: int):
+    import uvicorn
+    from app.asgi import create_asgi_app
+    config = uvicorn.Config(create_asgi_app(), host='127.0.0.1', port=port, log_level='error',
+                            backlog=8192, timeout_keep_alive=60)
+    server = uvicorn.Server(config)
+    threading.Thread(target=server.run, daemon=True).start()
+    return server
+
+
+def serve_wsgi(port: int):
+    from werkzeug.serving import make_server
+    from app import create_app
+    server = make_server('127.0.0.1', port, create_app(), threaded=True)
+    server.socket.listen(8192)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+async def watch(port: int, stats: dict) -> None:
+    reader, writer = await asyncio.open_connection('127.0.0.1', port, limit=1 << 20)
+    writer.write(f'GET /api/pipeline/stream?taskId={TASK_ID}&compact=1 HTTP/1.1\r\n'
+                 f'Host: localhost\r\nAccept: text/event-stream\r\n\r\n'.encode())
+    await writer.drain()
+    buffer = b''
+    while b'pipeline_completed' not in buffer:
+        chunk = await reader.read(65536)
+        if not chunk:
+            break
+        stats['bytes'] += len(chunk)
+        buffer = buffer[-64:] + chunk
+        stats['events'] += chunk.count(b'\nid: ') + chunk.startswith(b'id: ')
+    stats['done'] += 1
+    writer.close()
+
+
+async def run(args) -> None:
+    port = free_port()
+    bus = EventBus()
+    # 只需要 events 属性：基准测试只测推送路径，不调用 LLM
+    get_pipeline_registry().register(TASK_ID, types.SimpleNamespace(events=bus))
+    server = serve_asgi(port) if args.mode == 'asgi' else serve_wsgi(port)
+    await asyncio.sleep(1.0)
+
+    stats = {'events': 0, 'bytes': 0, 'done': 0}
+    t0 = time.perf_counter()
+    tasks = []
+    for i in range(args.watchers):
+        tasks.append(asyncio.create_task(watch(port, stats)))
+        if i % 200 == 199:
+            await asyncio.sleep(0.05)
+    while bus.subscriber_count() < args.watchers and time.perf_counter() - t0 < args.timeout:
+        await asyncio.sleep(0.05)
+    connected = bus.subscriber_count()
+    connect_time = time.perf_counter() - t0
+    threads_connected = threading.active_count()
+
+    def publish():
+        for i in range(args.events):
+            bus.publish(PipelineEvent('agent_output', {'agent': 'analyzer', 'chunk': f'chunk {i} ' * 8}))
+            time.sleep(args.interval)
+        bus.publish(PipelineEvent('pipeline_completed', {'suite': 'bench'}))
+
+    t1 = time.perf_counter()
+    publisher = threading.Thread(target=publish)
+    publisher.start()
+    await asyncio.wait(tasks, timeout=args.timeout)
+    deliver_time = time.perf_counter() - t1
+    publisher.join()
+
+    expected = args.watchers * (args.events + 1)
+    print(f"mode={args.mode} watchers={args.watchers} connected={connected} connect_time={connect_time:.2f}s")
+    print(f"threads while connected={threads_connected}")
+    print(f"completed={stats['done']}/{args.watchers} events={stats['events']}/{expected} "
+          f"bytes={stats['bytes']} deliver_time={deliver_time:.2f}s "
+          f"(publishing alone takes {args.events * args.interval:.2f}s)")
+
+    if args.mode == 'asgi':
+        server.should_exit = True
+    else:
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mode', choices=('asgi', 'wsgi'), default='asgi')
+    parser.add_argument('--watchers', type=int, default=2000)
+    parser.add_argument('--events', type=int, default=200)
+    parser.add_argument('--interval', type=float, default=0.005, help='seconds between published events')
+    parser.add_argument('--timeout', type=float, default=120)
+    args = parser.parse_args()
+
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(hard, max(soft, args.watchers * 2 + 256)), hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
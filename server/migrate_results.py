@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Move result folders of the old flat layout (result/<name>/) to result/YYYY/MM/<id>/.
+
+Suite names stay the same (they become aliases), so saved links and history entries
+keep working. Stop the server before running it.
+
+Usage:
+    python migrate_results.py --dry-run
+    python migrate_results.py
+"""
+
+import argparse
+
+from app.services.storage_service import get_storage_service
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dry-run', action='store_true', help='only list what would be moved')
+    args = parser.parse_args()
+
+    storage = get_storage_service()
+    moved = storage.layout.migrate(dry_run=args.dry_run)
+    for name, rel_path in moved:
+        print(f"{name} -> {rel_path}")
+
+    if args.dry_run:
+        print(f"将迁移 {len(moved)} 个目录（未执行）")
+        return
+    # 重建索引中的路径信息
+    storage.catalog.reconcile(force=True)
+    print(f"已迁移 {len(moved)} 个目录")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+"""Shared pytest setup: run from server/ with ``python -m pytest``."""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.config import Config
+
+
+@pytest.fixture
+def data_dirs(tmp_path, monkeypatch):
+    """Point the config and result directories at a temporary folder."""
+    monkeypatch.setattr(Config, 'CONFIG_DIR', tmp_path / 'config')
+    monkeypatch.setattr(Config, 'RESULT_DIR', tmp_path / 'result')
+    monkeypatch.setattr(Config, 'TASK_BROKER', 'none')
+    Config.CONFIG_DIR.mkdir(parents=True)
+    Config.RESULT_DIR.mkdir(parents=True)
+    return tmp_path
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""ASGI serving mode: the Flask fallback must not serialize requests."""
+
+import asyncio
+import threading
+
+from flask import Flask
+
+from app.asgi import ThreadPoolWsgi
+
+
+async def _call(app, path: str):
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b''}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        'type': 'http', 'method': 'GET', 'path': path, 'root_path': '', 'query_string': b'',
+        'headers': [], 'http_version': '1.1', 'server': ('testserver', 80)
+    }
+    await app(scope, receive, send)
+    status = next(m['status'] for m in messages if m['type'] == 'http.response.start')
+    body = b''.join(m.get('body', b'') for m in messages if m['type'] == 'http.response.body')
+    return status, body
+
+
+def test_two_flask_requests_run_concurrently():
+    release = threading.Event()
+    flask_app = Flask(__name__)
+
+    @flask_app.route('/slow')
+    def slow():
+        # 只有 /fast 在它进行中被处理时才会放行
+        return 'released' if release.wait(5) else 'timed out'
+
+    @flask_app.route('/fast')
+    def fast():
+        release.set()
+        return 'fast'
+
+    app = ThreadPoolWsgi(flask_app, max_workers=4)
+
+    async def main():
+        slow_request = asyncio.ensure_future(_call(app, '/slow'))
+        await asyncio.sleep(0.05)
+        fast_response = await asyncio.wait_for(_call(app, '/fast'), 2)
+        return await slow_request, fast_response
+
+    (slow_status, slow_body), (fast_status, fast_body) = asyncio.run(main())
+    assert (slow_status, slow_body) == (200, b'released')
+    assert (fast_status, fast_body) == (200, b'fast')
+
+
+def test_streamed_response_is_closed():
+    closed = threading.Event()
+    flask_app = Flask(__name__)
+
+    @flask_app.route('/stream')
+    def stream():
+        def generate():
+            try:
+                yield 'a'
+                yield 'b'
+            finally:
+                closed.set()
+        return flask_app.response_class(generate())
+
+    status, body = asyncio.run(_call(ThreadPoolWsgi(flask_app, max_workers=1), '/stream'))
+    assert (status, body) == (200, b'ab')
+    assert closed.is_set()
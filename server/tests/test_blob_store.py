@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""Content-addressed blob store: delta chains must rebuild every version exactly."""
+
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+import pytest
+from hypothesis import given, settings, strategies as st
+
+from app.services.blob_store import BlobStore, content_hash
+
+# 行要足够长，编辑后的版本才会按差量保存（差量小于完整文本的一半）
+line = st.text(alphabet='abc 中文\t', max_size=12).map(lambda s: f'- 规则 {s}：回答需要简洁、准确并引用来源。\n')
+lines = st.lists(line, min_size=1, max_size=40)
+
+
+@st.composite
+def versions(draw):
+    """A text and a series of line edits of it, like successive prompt versions."""
+    current = draw(lines)
+    result = [''.join(current)]
+    for _ in range(draw(st.integers(min_value=1, max_value=8))):
+        current = list(current)
+        for _ in range(draw(st.integers(min_value=1, max_value=3))):
+            op = draw(st.sampled_from(['replace', 'insert', 'delete']))
+            i = draw(st.integers(min_value=0, max_value=len(current)))
+            if op == 'insert' or not current:
+                current.insert(i, draw(line))
+            elif op == 'replace':
+                current[min(i, len(current) - 1)] = draw(line)
+            elif len(current) > 1:
+                del current[min(i, len(current) - 1)]
+        text = ''.join(current)
+        # 偶尔去掉末尾换行，覆盖最后一行没有换行符的情况
+        result.append(text[:-1] if draw(st.booleans()) else text)
+    return result
+
+
+@settings(max_examples=60, deadline=None)
+@given(versions(), st.integers(min_value=0, max_value=4))
+def test_delta_chain_rebuilds_every_version(texts, max_chain):
+    with tempfile.TemporaryDirectory() as tmp, mock.patch('os.fsync'):
+        store = BlobStore(Path(tmp), min_chars=1, max_chain=max_chain)
+        keys, base = [], None
+        for text in texts:
+            base = store.put(text, base)
+            keys.append(base)
+
+        assert keys == [content_hash(t) for t in texts]
+        # 新实例没有缓存，每个版本都从磁盘按差量链重建
+        fresh = BlobStore(Path(tmp), min_chars=1, max_chain=max_chain)
+        for key, text in zip(keys, texts):
+            assert fresh.get(key) == text
+            assert fresh._depth(key) <= max_chain
+
+
+@settings(max_examples=40, deadline=None)
+@given(versions())
+def test_pack_chain_round_trip(texts):
+    with tempfile.TemporaryDirectory() as tmp, mock.patch('os.fsync'):
+        store = BlobStore(Path(tmp), min_chars=10, max_chain=3)
+        documents = [{'prompt': t, 'meta': {'short': 'x', 'n': i}, 'list': [t, 'y']} for i, t in enumerate(texts)]
+        packed = store.pack_chain(documents)
+        assert BlobStore(Path(tmp), min_chars=10, max_chain=3).unpack(packed) == documents
+
+
+def test_identical_texts_are_stored_once(tmp_path):
+    store = BlobStore(tmp_path, min_chars=1)
+    text = '相同的提示词\n' * 20
+    assert store.put(text) == store.put(text)
+    assert len([p for p in tmp_path.rglob('*') if p.is_file()]) == 1
+
+
+def test_delta_is_used_for_small_edits(tmp_path):
+    store = BlobStore(tmp_path, min_chars=1, max_chain=2)
+    base_text = ''.join(f'第 {i} 行内容\n' for i in range(200))
+    base = store.put(base_text)
+    edited = store.put(base_text.replace('第 100 行', '第 100 行（修改）'), base)
+    assert store._depth(edited) == 1
+    assert store.get(edited).count('（修改）') == 1
+
+
+def test_missing_base_raises_key_error(tmp_path):
+    store = BlobStore(tmp_path, min_chars=1)
+    base_text = ''.join(f'line {i}\n' for i in range(100))
+    base = store.put(base_text)
+    edited = store.put(base_text + 'more\n', base)
+    store._path(base).unlink()
+
+    with pytest.raises(KeyError):
+        BlobStore(tmp_path, min_chars=1).get(edited)
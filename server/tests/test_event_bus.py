@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""Replayable event bus: resume by Last-Event-ID and drop-oldest accounting."""
+
+import asyncio
+import threading
+
+from hypothesis import given, strategies as st
+
+from app.models.pipeline import PipelineEvent
+from app.services.event_bus import EventBus, wait_any
+
+
+def _event(i: int) -> PipelineEvent:
+    return PipelineEvent(type='step', data={'i': i}, timestamp='')
+
+
+def _publish(bus: EventBus, count: int) -> None:
+    for i in range(count):
+        bus.publish(_event(i))
+
+
+@given(st.integers(min_value=1, max_value=20), st.integers(min_value=0, max_value=60),
+       st.one_of(st.none(), st.integers(min_value=0, max_value=80)))
+def test_resume_replays_buffer_and_counts_dropped(capacity, published, last_event_id):
+    bus = EventBus(capacity)
+    _publish(bus, published)
+
+    sub = bus.subscribe(last_event_id)
+    events = sub.poll()
+
+    resume_after = min(last_event_id or 0, published)
+    oldest = max(1, published - capacity + 1)
+    expected = list(range(max(resume_after + 1, oldest), published + 1))
+    assert [e.seq for e in events] == expected
+    assert sub.dropped == max(0, oldest - resume_after - 1)
+    assert sub.poll() == []
+
+
+@given(st.integers(min_value=1, max_value=10),
+       st.lists(st.tuples(st.integers(min_value=0, max_value=15), st.booleans()), max_size=20))
+def test_every_event_is_received_or_counted_dropped(capacity, steps):
+    bus = EventBus(capacity)
+    sub = bus.subscribe()
+    received = []
+    total = 0
+    for count, read in steps:
+        _publish(bus, count)
+        total += count
+        if read:
+            received.extend(e.seq for e in sub.poll())
+    received.extend(e.seq for e in sub.poll())
+
+    assert received == sorted(set(received))
+    assert len(received) + sub.dropped == total
+    if total:
+        assert received[-1] == total
+
+
+def test_sequence_of_mirrored_events_is_kept():
+    bus = EventBus(10)
+    mirrored = _event(0)
+    mirrored.seq = 7
+    assert bus.publish(mirrored) == 7
+    assert bus.publish(_event(1)) == 8
+    assert [e.seq for e in bus.replay(6)] == [7, 8]
+
+
+def test_client_ahead_of_bus_starts_from_current_position():
+    bus = EventBus(10)
+    _publish(bus, 3)
+    sub = bus.subscribe(50)  # 例如服务重启后客户端带着旧的 ID 重连
+    assert sub.poll() == []
+    bus.publish(_event(3))
+    assert [e.seq for e in sub.poll()] == [4]
+
+
+def test_close_wakes_blocked_reader():
+    bus = EventBus(10)
+    sub = bus.subscribe()
+    result = []
+    reader = threading.Thread(target=lambda: result.append(sub.get(timeout=5)))
+    reader.start()
+    sub.close()
+    reader.join(2)
+    assert not reader.is_alive() and result == [[]]
+    assert bus.subscriber_count() == 0
+
+
+def test_get_async_and_wait_any_wake_on_publish_from_another_thread():
+    bus = EventBus(10)
+
+    async def main():
+        sub = bus.subscribe()
+        other = EventBus(10).subscribe()
+        loop = asyncio.get_running_loop()
+        loop.call_later(0.05, lambda: threading.Thread(target=bus.publish, args=(_event(0),)).start())
+        await asyncio.wait_for(wait_any([other, sub], timeout=2), 3)
+        assert sub.pending and not other.pending
+        events = await sub.get_async(timeout=2)
+        timed_out = await sub.get_async(timeout=0.05)
+        return [e.seq for e in events], timed_out
+
+    assert asyncio.run(main()) == ([1], [])
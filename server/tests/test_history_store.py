@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""History store: cursor paging over tombstones, clear watermark and retention."""
+
+import tempfile
+from datetime import datetime, timedelta
+from pathlib import Path
+from unittest import mock
+
+import pytest
+from hypothesis import given, settings, strategies as st
+
+from app.config import Config
+from app.models.history import HistoryRecord
+from app.services.history_store import HistoryStore
+
+actions = st.lists(
+    st.one_of(
+        st.tuples(st.just('add'), st.integers(min_value=1, max_value=4)),
+        st.tuples(st.just('delete'), st.integers(min_value=0, max_value=50)),
+        st.tuples(st.just('clear'), st.just(0)),
+        st.tuples(st.just('prune'), st.just(0)),
+    ),
+    max_size=30
+)
+
+
+def _record(i: int, created_at: str = None) -> HistoryRecord:
+    record = HistoryRecord(id=f'r{i}', description=f'任务 {i}', type='general', system_name='S',
+                           roles_count=1, score=8.0)
+    if created_at:
+        record.created_at = created_at
+    return record
+
+
+def _all_pages(store: HistoryStore, limit: int):
+    ids, cursor, pages = [], None, 0
+    while True:
+        records, cursor = store.page(limit, cursor)
+        assert len(records) <= limit
+        ids.extend(r.id for r in records)
+        pages += 1
+        if cursor is None or pages > 100:
+            return ids
+
+
+@settings(max_examples=60, deadline=None)
+@given(actions, st.integers(min_value=0, max_value=6), st.integers(min_value=1, max_value=7))
+def test_paging_matches_model(steps, retention_count, limit):
+    with tempfile.TemporaryDirectory() as tmp, mock.patch.object(Config, 'HISTORY_PRUNE_EVERY', 10 ** 6):
+        store = HistoryStore(Path(tmp) / 'history.db', retention_count=retention_count, retention_days=0)
+        live = []  # 模型：未删除、未被清理的记录 ID，按插入顺序
+        counter = 0
+        for action, arg in steps:
+            if action == 'add':
+                for _ in range(arg):
+                    counter += 1
+                    store.add(_record(counter))
+                    live.append(f'r{counter}')
+            elif action == 'delete' and live:
+                record_id = live.pop(arg % len(live))
+                store.delete(record_id)
+            elif action == 'clear':
+                store.clear()
+                live = []
+            elif action == 'prune':
+                store.prune()
+                if retention_count:
+                    live = live[-retention_count:]
+
+            visible = live[-retention_count:] if retention_count else live
+            assert _all_pages(store, limit) == list(reversed(visible))
+
+
+def test_cursor_is_stable_under_inserts_and_deletes(tmp_path):
+    store = HistoryStore(tmp_path / 'history.db', retention_count=0, retention_days=0)
+    for i in range(1, 7):
+        store.add(_record(i))
+
+    first, cursor = store.page(3)
+    assert [r.id for r in first] == ['r6', 'r5', 'r4']
+    store.add(_record(7))  # 新记录不影响后续页
+    store.delete('r2')
+    rest, cursor = store.page(3, cursor)
+    assert [r.id for r in rest] == ['r3', 'r1'] and cursor is None
+
+
+def test_retention_days_applies_on_read(tmp_path):
+    store = HistoryStore(tmp_path / 'history.db', retention_count=0, retention_days=7)
+    store.add(_record(1, (datetime.now() - timedelta(days=30)).isoformat()))
+    store.add(_record(2))
+    assert [r.id for r in store.page(10)[0]] == ['r2']
+    store.prune()
+    assert store._conn.execute('SELECT COUNT(*) FROM history').fetchone()[0] == 1
+
+
+def test_duplicate_id_and_invalid_cursor(tmp_path):
+    store = HistoryStore(tmp_path / 'history.db', retention_count=0, retention_days=0)
+    assert store.add(_record(1)).id == 'r1'
+    assert store.add(_record(1)).id == 'r1-1'
+    with pytest.raises(ValueError, match='cursor'):
+        store.page(10, 'not-a-cursor')
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""Section patches of the optimizer's patch mode."""
+
+import pytest
+from hypothesis import given, strategies as st
+
+from app.utils.prompt_patch import PatchError, _tag_balance, apply_patch, list_section_names
+
+NAMES = ['role', 'rules', 'format', 'examples', 'style', 'context']
+
+body_text = st.text(alphabet='abc xyz 中文，。\n', min_size=1, max_size=40).filter(lambda s: s.strip())
+sections = st.lists(st.sampled_from(NAMES), min_size=1, max_size=len(NAMES), unique=True).flatmap(
+    lambda names: st.tuples(st.just(names), st.lists(body_text, min_size=len(names), max_size=len(names)))
+)
+
+
+def _prompt(names, bodies):
+    return '\n\n'.join(f'<{n}>\n{b.strip()}\n</{n}>' for n, b in zip(names, bodies))
+
+
+@given(sections, st.data())
+def test_replace_keeps_tags_balanced_and_other_sections(prompt_sections, data):
+    names, bodies = prompt_sections
+    prompt = _prompt(names, bodies)
+    target = data.draw(st.sampled_from(names))
+    content = data.draw(body_text)
+
+    result = apply_patch(prompt, [{'op': 'replace', 'section': target, 'content': content}])
+
+    assert _tag_balance(result) == {}
+    assert list_section_names(result) == names
+    assert content.strip('\n') in result
+    for name, body in zip(names, bodies):
+        if name != target:
+            assert f'<{name}>\n{body.strip()}\n</{name}>' in result
+
+
+@given(sections, st.data())
+def test_insert_after_and_delete_round_trip(prompt_sections, data):
+    names, bodies = prompt_sections
+    prompt = _prompt(names, bodies)
+    target = data.draw(st.sampled_from(names))
+    new_name = 'added'
+
+    inserted = apply_patch(prompt, [{
+        'op': 'insert_after', 'section': target, 'content': f'<{new_name}>\nnew\n</{new_name}>'
+    }])
+    order = list_section_names(inserted)
+    assert order.index(new_name) == order.index(target) + 1
+    assert _tag_balance(inserted) == {}
+
+    restored = apply_patch(inserted, [{'op': 'delete', 'section': new_name}])
+    assert list_section_names(restored) == names
+    assert _tag_balance(restored) == {}
+
+
+def test_replace_with_body_only_keeps_the_tag():
+    result = apply_patch('<role>\nold\n</role>', [{'op': 'replace', 'section': 'role', 'content': 'new'}])
+    assert result == '<role>\nnew\n</role>'
+
+
+def test_markdown_sections():
+    prompt = '# 角色\n旧的\n\n# 约束\n- a\n'
+    result = apply_patch(prompt, [{'op': 'replace', 'section': '## 角色', 'content': '新的'}])
+    assert result == '# 角色\n新的\n\n# 约束\n- a\n'
+
+
+@pytest.mark.parametrize('operations, message', [
+    (None, '没有编辑操作'),
+    ([], '没有编辑操作'),
+    ([{'op': 'rewrite', 'section': 'role', 'content': 'x'}], '无效的编辑操作'),
+    (['replace role'], '无效的编辑操作'),
+    ([{'op': 'replace', 'section': 'missing', 'content': 'x'}], '找不到章节'),
+    ([{'op': 'replace', 'section': '', 'content': 'x'}], '缺少 section'),
+    ([{'op': 'replace', 'section': 'item', 'content': 'x'}], '章节不唯一'),
+    ([{'op': 'replace', 'section': 'role', 'content': '  '}], '缺少 content'),
+    ([{'op': 'insert_after', 'section': 'role'}], '缺少 content'),
+    ([{'op': 'replace', 'section': 'role', 'content': '<role>\n<b>x\n</role>'}], 'XML 标签不匹配'),
+])
+def test_rejected_operations(operations, message):
+    prompt = '<role>\nr\n</role>\n<rules>\n<item>a</item>\n<item>b</item>\n</rules>'
+    with pytest.raises(PatchError, match=message):
+        apply_patch(prompt, operations)
+
+
+def test_deleting_everything_is_rejected():
+    with pytest.raises(PatchError, match='编辑后提示词为空'):
+        apply_patch('<role>\nr\n</role>', [{'op': 'delete', 'section': 'role'}])
+
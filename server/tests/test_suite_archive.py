@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""Streaming suite export/import: an exported archive imports back unchanged."""
+
+import io
+import json
+import tempfile
+import uuid
+import zipfile
+from pathlib import Path
+from unittest import mock
+
+import pytest
+from hypothesis import given, settings, strategies as st
+
+from app.config import Config
+from app.services.storage_service import StorageService
+from app.services.suite_archive import import_stream, iter_export
+
+file_name = st.text(alphabet='abc_中文-1', min_size=1, max_size=8).map(lambda s: f'{s}.md')
+file_body = st.binary(max_size=3000)
+suite_files = st.dictionaries(file_name, file_body, min_size=1, max_size=4)
+suite_name = st.text(alphabet='abcxyz_中文', min_size=1, max_size=6)
+suites = st.dictionaries(suite_name, suite_files, min_size=1, max_size=3)
+
+
+def _storage(root: Path) -> StorageService:
+    return StorageService(root / 'config', root / 'result', encryption_key='test')
+
+
+def _make_suite(storage: StorageService, name: str, files, data=None) -> Path:
+    folder = storage.layout.allocate(uuid.uuid4().hex, name)
+    for filename, content in files.items():
+        (folder / filename).write_bytes(content)
+    if data is not None:
+        packed = storage.pack_suite_data(data)
+        (folder / '_data.json').write_text(json.dumps(packed, ensure_ascii=False), encoding='utf-8')
+    return folder
+
+
+def _contents(folder: Path):
+    return {p.name: p.read_bytes() for p in folder.iterdir()
+            if p.is_file() and p.name not in ('_data.json', '_alias.json') and not p.name.startswith('.')}
+
+
+def _export(storage: StorageService, names, chunk_size=None) -> bytes:
+    return b''.join(iter_export(storage, names, chunk_size=chunk_size))
+
+
+def _result_files(storage: StorageService):
+    return [p for p in storage.result_dir.rglob('*') if p.is_file()]
+
+
+@settings(max_examples=30, deadline=None)
+@given(suites, st.integers(min_value=1, max_value=4096))
+def test_export_then_import_is_identity(source, chunk_size):
+    with tempfile.TemporaryDirectory() as tmp, mock.patch('os.fsync'):
+        exporter = _storage(Path(tmp) / 'a')
+        for name, files in source.items():
+            _make_suite(exporter, name, files)
+        archive = _export(exporter, list(source), chunk_size=chunk_size)
+        assert zipfile.ZipFile(io.BytesIO(archive)).testzip() is None
+
+        importer = _storage(Path(tmp) / 'b')
+        results = import_stream(importer, io.BytesIO(archive))
+
+        assert {r['name']: r['folder'] for r in results} == {name: name for name in source}
+        for name, files in source.items():
+            assert _contents(importer.layout.resolve(name)) == files
+
+
+def test_suite_data_is_exported_unpacked_and_repacked_on_import(tmp_path):
+    long_text = '你是一名资深的数据分析师，回答需要给出依据。\n' * 200
+    data = {
+        'requirement': {'description': '数据分析'},
+        'promptSuite': {'system_name': 'S', 'prompts': [{'role_name': 'A', 'prompt': long_text}]},
+        'versions': [{'prompt': long_text}, {'prompt': long_text + '补充一条规则。\n'}],
+    }
+    exporter = _storage(tmp_path / 'a')
+    _make_suite(exporter, 'analysis', {'1_A.md': b'# A\n'}, data)
+
+    archive = _export(exporter, ['analysis'])
+    exported = json.loads(zipfile.ZipFile(io.BytesIO(archive)).read('analysis/_data.json'))
+    assert exported == data  # 压缩包里没有 blob 引用
+
+    importer = _storage(tmp_path / 'b')
+    import_stream(importer, io.BytesIO(archive))
+    folder = importer.layout.resolve('analysis')
+    assert importer.read_suite_data(folder) == data
+    assert long_text not in (folder / '_data.json').read_text(encoding='utf-8')
+
+
+def test_import_into_same_storage_adds_suffix(tmp_path):
+    storage = _storage(tmp_path)
+    _make_suite(storage, 'dup', {'a.md': b'x'})
+    archive = _export(storage, ['dup', 'missing'])
+
+    results = import_stream(storage, io.BytesIO(archive))
+    assert len(results) == 1 and results[0]['folder'] != 'dup'
+    assert _contents(storage.layout.resolve(results[0]['folder'])) == {'a.md': b'x'}
+
+
+@pytest.mark.parametrize('compression', [zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED])
+def test_archives_from_zipfile_import(tmp_path, compression):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', compression=compression) as archive:
+        archive.writestr('s/', b'')
+        archive.writestr('s/a.md', '内容'.encode('utf-8') * 100)
+        archive.writestr('s/.hidden', b'skip')
+        archive.writestr('s/_alias.json', b'skip')
+        archive.writestr('../escape.md', b'skip')
+        archive.writestr('s/nested/b.md', b'skip')
+
+    storage = _storage(tmp_path)
+    results = import_stream(storage, io.BytesIO(buffer.getvalue()))
+    assert results == [{'name': 's', 'folder': 's', 'files': 1}]
+    assert _contents(storage.layout.resolve('s')) == {'a.md': '内容'.encode('utf-8') * 100}
+    assert not (tmp_path / 'escape.md').exists()
+
+
+def test_truncated_archive_leaves_nothing_behind(tmp_path):
+    exporter = _storage(tmp_path / 'a')
+    _make_suite(exporter, 's', {'a.md': bytes(range(256)) * 50, 'b.md': b'b' * 5000})
+    archive = _export(exporter, ['s'])
+
+    importer = _storage(tmp_path / 'b')
+    central_dir = zipfile.ZipFile(io.BytesIO(archive)).start_dir
+    for cut in (central_dir - 5, central_dir // 2, 40):
+        with pytest.raises(ValueError, match='压缩包不完整'):
+            import_stream(importer, io.BytesIO(archive[:cut]))
+    assert importer.layout.resolve('s') is None
+    assert _result_files(importer) == []
+
+
+def test_rejected_archives(tmp_path, monkeypatch):
+    storage = _storage(tmp_path)
+    with pytest.raises(ValueError, match='不是有效的 ZIP 文件'):
+        import_stream(storage, io.BytesIO(b'not a zip file at all'))
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_BZIP2) as archive:
+        archive.writestr('s/a.md', b'x' * 100)
+    with pytest.raises(ValueError, match='不支持的压缩方式'):
+        import_stream(storage, io.BytesIO(buffer.getvalue()))
+
+    monkeypatch.setattr(Config, 'IMPORT_MAX_BYTES', 1000)
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('s/a.md', b'x' * 600)
+        archive.writestr('s/b.md', b'y' * 600)
+    with pytest.raises(ValueError, match='导入内容超过大小限制'):
+        import_stream(storage, io.BytesIO(buffer.getvalue()))
+    assert storage.layout.resolve('s') is None
+    assert _result_files(storage) == []
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""Task progress stored as snapshot + append-only journal."""
+
+import copy
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+from hypothesis import given, settings, strategies as st
+
+from app.config import Config
+from app.services.storage_service import StorageService
+
+TASK_ID = 'task-1'
+
+# JSON 可写的文本（不含单独的代理字符）
+text = st.text(alphabet=st.characters(blacklist_categories=('Cs',)), max_size=5)
+paths = st.lists(st.sampled_from(['role_results', 'usage', 'records', '0', '1', 'status']), min_size=1, max_size=3)
+ops = st.lists(
+    st.fixed_dictionaries({
+        'op': st.sampled_from(['put', 'append']),
+        'path': paths,
+        'value': st.one_of(st.integers(), text, st.dictionaries(st.sampled_from('ab'), st.integers()))
+    }),
+    min_size=1, max_size=4
+)
+checkpoints = st.lists(ops, min_size=1, max_size=12)
+
+
+def _storage(root: Path) -> StorageService:
+    return StorageService(root / 'config', root / 'result', encryption_key='test')
+
+
+def _expected(initial, applied):
+    progress = copy.deepcopy(initial)
+    for checkpoint in applied:
+        StorageService._apply_journal_ops(progress, copy.deepcopy(checkpoint))
+    return progress
+
+
+def _strip(progress):
+    return {k: v for k, v in (progress or {}).items() if k not in ('updated_at', 'journal_seq')}
+
+
+@settings(max_examples=50, deadline=None)
+@given(checkpoints, st.integers(min_value=1, max_value=5))
+def test_replay_matches_applied_checkpoints(applied, compact_lines):
+    # 这里只验证回放逻辑，跳过 fsync 以加快用例
+    with tempfile.TemporaryDirectory() as tmp, mock.patch('os.fsync'), \
+            mock.patch.object(Config, 'TASK_JOURNAL_COMPACT_LINES', compact_lines):
+        storage = _storage(Path(tmp))
+        initial = {'status': 'running', 'role_results': {}}
+        storage.save_task_progress(TASK_ID, dict(initial))
+        for checkpoint in applied:
+            storage.append_task_progress(TASK_ID, checkpoint)
+
+        expected = _expected(initial, applied)
+        assert _strip(storage.load_task_progress(TASK_ID)) == _strip(expected)
+        # 新进程（新实例）读取到同样的结果
+        assert _strip(_storage(Path(tmp)).load_task_progress(TASK_ID)) == _strip(expected)
+
+
+@settings(max_examples=50, deadline=None)
+@given(checkpoints, st.floats(min_value=0.0, max_value=0.99), ops)
+def test_replay_after_torn_last_line(applied, cut, next_checkpoint):
+    with tempfile.TemporaryDirectory() as tmp, mock.patch('os.fsync'), \
+            mock.patch.object(Config, 'TASK_JOURNAL_COMPACT_LINES', 1000):
+        storage = _storage(Path(tmp))
+        initial = {'status': 'running'}
+        storage.save_task_progress(TASK_ID, dict(initial))
+        for checkpoint in applied:
+            storage.append_task_progress(TASK_ID, checkpoint)
+
+        # 模拟写最后一条记录时崩溃：只留下它的前一部分
+        _, journal_file = storage._get_task_files(TASK_ID)
+        data = journal_file.read_bytes()
+        last_start = data.rstrip(b'\n').rfind(b'\n') + 1
+        last_length = len(data) - last_start - 1
+        journal_file.write_bytes(data[:last_start + int(last_length * cut)])
+
+        survived = applied[:-1]
+        reopened = _storage(Path(tmp))
+        assert _strip(reopened.load_task_progress(TASK_ID)) == _strip(_expected(initial, survived))
+
+        # 重启后继续追加：半行被截掉，序号接在最后一条完整记录之后
+        reopened.append_task_progress(TASK_ID, next_checkpoint)
+        progress = reopened.load_task_progress(TASK_ID)
+        assert _strip(progress) == _strip(_expected(initial, survived + [next_checkpoint]))
+        assert progress['journal_seq'] == len(applied)
+        assert all(line for line in journal_file.read_text(encoding='utf-8').split('\n')[:-1])
+
+
+def test_journal_without_snapshot_and_deletion(tmp_path):
+    storage = _storage(tmp_path)
+    assert storage.load_task_progress(TASK_ID) is None
+
+    storage.save_role_result(TASK_ID, 0, {'prompt': 'p'})
+    assert storage.load_task_progress(TASK_ID)['role_results'] == {'0': {'prompt': 'p'}}
+
+    storage.delete_task_progress(TASK_ID)
+    assert storage.load_task_progress(TASK_ID) is None
+    assert not any(storage._get_tasks_dir().iterdir())
+
+
+def test_compaction_keeps_sequence(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'TASK_JOURNAL_COMPACT_LINES', 2)
+    storage = _storage(tmp_path)
+    for i in range(5):
+        storage.append_task_progress(TASK_ID, [{'op': 'append', 'path': ['items'], 'value': i}])
+
+    snapshot_file, journal_file = storage._get_task_files(TASK_ID)
+    assert snapshot_file.exists()
+    progress = storage.load_task_progress(TASK_ID)
+    assert progress['items'] == [0, 1, 2, 3, 4]
+    assert progress['journal_seq'] == 5